@@ -0,0 +1,161 @@
+from __future__ import annotations
+import http.client
+import os
+import shutil
+import tempfile
+import urllib.parse
+from typing import Any, Dict, List, Optional
+
+from api._redis import RedisBatch, decode, get_redis
+from api._jobs import job_key
+
+# One upload is shared to at most this many channels (files.completeUploadExternal `channels`)
+FILE_SHARE_MAX_CHANNELS = int(os.environ.get("FILE_SHARE_MAX_CHANNELS", "100"))
+ATTACHMENT_TMP_DIR = os.environ.get("ATTACHMENT_TMP_DIR") or tempfile.gettempdir()
+STREAM_CHUNK_BYTES = 64 * 1024
+
+redis = get_redis()
+
+
+def file_from_submission(files: Optional[List[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """
+    The fields a job keeps of a file picked in the draft modal's file_input.
+    """
+    if not files:
+        return None
+    f = files[0]
+    return {
+        "id": f.get("id"),
+        "name": f.get("name") or f.get("title") or "attachment",
+        "title": f.get("title") or f.get("name") or "attachment",
+        "size": int(f.get("size") or 0),
+        "url": f.get("url_private_download") or f.get("url_private"),
+    }
+
+
+def _open(url: str, method: str = "GET", body=None, headers: Optional[Dict[str, str]] = None, redirects: int = 3):
+    parsed = urllib.parse.urlsplit(url)
+    cls = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+    conn = cls(parsed.netloc, timeout=30)
+    path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+    conn.request(method, path or "/", body=body, headers=headers or {})
+    resp = conn.getresponse()
+    if method == "GET" and resp.status in (301, 302, 303, 307, 308) and redirects:
+        location = urllib.parse.urljoin(url, resp.getheader("Location") or "")
+        conn.close()
+        if urllib.parse.urlsplit(location).netloc != parsed.netloc:
+            # The bot token only ever goes to the host it was meant for
+            headers = {k: v for k, v in (headers or {}).items() if k.lower() != "authorization"}
+        return _open(location, method, body, headers, redirects - 1)
+    return conn, resp
+
+
+def local_copy(file: Dict[str, Any], token: str) -> str:
+    """
+    Path of the attachment in temporary storage, downloaded in chunks on the
+    first call in this instance, so the file never sits in memory. Removed with
+    discard_local_copy once the caller's uploads are done.
+    """
+    path = os.path.join(ATTACHMENT_TMP_DIR, f"partner_alert_bot-{file['id']}")
+    if os.path.exists(path) and (not file.get("size") or os.path.getsize(path) == file["size"]):
+        return path
+
+    conn, resp = _open(file["url"], headers={"Authorization": f"Bearer {token}"})
+    try:
+        if resp.status != 200:
+            raise RuntimeError(f"attachment download failed: HTTP {resp.status}")
+        partial = f"{path}.{os.getpid()}.part"
+        try:
+            with open(partial, "wb") as out:
+                shutil.copyfileobj(resp, out, STREAM_CHUNK_BYTES)
+            os.replace(partial, path)
+        except BaseException:
+            _remove(partial)
+            raise
+    finally:
+        conn.close()
+    return path
+
+
+def discard_local_copy(file: Dict[str, Any]):
+    _remove(os.path.join(ATTACHMENT_TMP_DIR, f"partner_alert_bot-{file['id']}"))
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def upload_and_share(client, path: str, file: Dict[str, Any], channels: List[str]) -> Dict[str, Any]:
+    """
+    Uploads the file once and shares it to every channel in `channels` with a
+    single files.completeUploadExternal call. The bytes are streamed from disk.
+    Returns the uploaded file (id, permalink).
+    """
+    size = os.path.getsize(path)
+    ticket = client.files_getUploadURLExternal(filename=file["name"], length=size)
+
+    with open(path, "rb") as body:
+        conn, resp = _open(
+            ticket["upload_url"],
+            method="POST",
+            body=body,
+            headers={"Content-Type": "application/octet-stream", "Content-Length": str(size)},
+        )
+        try:
+            resp.read()
+            if resp.status != 200:
+                raise RuntimeError(f"attachment upload failed: HTTP {resp.status}")
+        finally:
+            conn.close()
+
+    done = client.files_completeUploadExternal(
+        files=[{"id": ticket["file_id"], "title": file.get("title") or file["name"]}],
+        channels=channels,
+    )
+    uploaded = (done.get("files") or [{}])[0]
+    return {"id": ticket["file_id"], "permalink": uploaded.get("permalink")}
+
+
+def claim_share(job_id: str, share_id: str, ttl: int) -> bool:
+    """
+    Claims one group share, like a delivery slice: whoever gets it uploads, and
+    a share that may already have gone out is never repeated.
+    """
+    batch = RedisBatch()
+    claimed_idx = batch.hsetnx(job_key(job_id, "files"), share_id, "pending")
+    batch.expire(job_key(job_id, "files"), ttl)
+    return bool(batch.flush()[claimed_idx])
+
+
+def record_share(job_id: str, share_id: str, outcome: str, root_job_id: Optional[str] = None):
+    """
+    Records a group share: the uploaded file id, or the error. File ids are
+    mirrored to the original broadcast for follow-ups, so a retraction can
+    delete every copy of the attachment.
+    """
+    batch = RedisBatch()
+    batch.hset(job_key(job_id, "files"), share_id, outcome)
+    if root_job_id and outcome.startswith("F"):
+        batch.hset(job_key(root_job_id, "files"), f"{job_id}:{share_id}", outcome)
+    batch.flush()
+
+
+def share_failures(job_id: str) -> Dict[str, str]:
+    """
+    Group shares of a job that failed: share id ("<shard>:<position>") -> error.
+    A share still "pending" counts as failed: its shard shares before delivering,
+    so by then the worker that claimed it died before recording the outcome.
+    """
+    raw = redis.hgetall(job_key(job_id, "files")) or {}
+    outcomes = {decode(k): decode(v) for k, v in raw.items()}
+    failures = {k: v[len("error: "):] for k, v in outcomes.items() if v.startswith("error: ")}
+    failures.update({k: "share interrupted before its outcome was recorded" for k, v in outcomes.items() if v == "pending"})
+    return failures
+
+
+def shared_file_ids(job_id: str) -> List[str]:
+    values = redis.hvals(job_key(job_id, "files")) or []
+    return [v for v in (decode(v) for v in values) if v.startswith("F")]
@@ -0,0 +1,111 @@
+from __future__ import annotations
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from api._redis import RedisBatch, get_redis
+
+BROADCAST_COOLDOWN_SECONDS = int(os.environ.get("BROADCAST_COOLDOWN_SECONDS", "0"))
+AUTH_CACHE_TTL_SECONDS = float(os.environ.get("AUTH_CACHE_TTL_SECONDS", "30"))
+# How often a warm instance re-reads the version key before trusting its cache
+AUTH_VERSION_CHECK_SECONDS = float(os.environ.get("AUTH_VERSION_CHECK_SECONDS", "5"))
+
+ALLOWED_BROADCASTERS_KEY = "partner_alert_bot:allowed_broadcasters"
+# Bump (INCR) after changing the allowlist to invalidate warm instances' caches;
+# a bump applies everywhere within AUTH_VERSION_CHECK_SECONDS
+ALLOWED_BROADCASTERS_VERSION_KEY = "partner_alert_bot:allowed_broadcasters:version"
+
+redis = get_redis()
+
+# user_id -> (allowed, expires_at); cleared whenever the version key changes
+_allowed_cache: Dict[str, Tuple[bool, float]] = {}
+_cache_version: Optional[str] = None
+# time.monotonic() of the last version read
+_version_checked_at = float("-inf")
+
+
+def cooldown_key(user_id: str) -> str:
+    return f"partner_alert_bot:cooldown:{user_id}"
+
+
+def _cached_allowed(user_id: str) -> Optional[bool]:
+    """
+    The cached answer for `user_id`. Without a round trip while the version key
+    was read in the last AUTH_VERSION_CHECK_SECONDS; after that, one GET, and
+    the answer is trusted only if the version still matches.
+    """
+    global _version_checked_at
+
+    hit = _allowed_cache.get(user_id)
+    now = time.monotonic()
+    if not hit or hit[1] <= now:
+        return None
+    if now - _version_checked_at < AUTH_VERSION_CHECK_SECONDS:
+        return hit[0]
+    try:
+        version = redis.get(ALLOWED_BROADCASTERS_VERSION_KEY)
+    except Exception as e:
+        print(f"Error checking allowed broadcasters version: {e}")
+        return hit[0]
+    if version != _cache_version:
+        return None
+    _version_checked_at = now
+    return hit[0]
+
+
+def _fetch_access(user_id: str, cooldown_user_id: Optional[str]) -> Tuple[bool, bool]:
+    global _cache_version, _version_checked_at
+
+    batch = RedisBatch()
+    batch.get(ALLOWED_BROADCASTERS_VERSION_KEY)
+    batch.scard(ALLOWED_BROADCASTERS_KEY)
+    batch.sismember(ALLOWED_BROADCASTERS_KEY, user_id)
+    if cooldown_user_id:
+        batch.exists(cooldown_key(cooldown_user_id))
+    results = batch.flush()
+
+    version = results[0]
+    if version != _cache_version:
+        _allowed_cache.clear()
+        _cache_version = version
+    _version_checked_at = time.monotonic()
+
+    # If no allowlist is set in Redis, allow anyone (for backward compatibility)
+    allowed = not results[1] or bool(results[2])
+    _allowed_cache[user_id] = (allowed, time.monotonic() + AUTH_CACHE_TTL_SECONDS)
+    cooling_down = bool(results[3]) if cooldown_user_id else False
+    return allowed, cooling_down
+
+
+def check_access(user_id: str, cooldown_user_id: Optional[str] = None) -> Tuple[bool, bool]:
+    """
+    Returns (allowed, in_cooldown) with one pipelined Redis request. A cached
+    answer costs nothing, or a GET of the allowlist version once every
+    AUTH_VERSION_CHECK_SECONDS. Pass `cooldown_user_id` to include the cooldown lookup.
+    """
+    if BROADCAST_COOLDOWN_SECONDS <= 0:
+        cooldown_user_id = None
+
+    cached = _cached_allowed(user_id)
+    if cached is not None and not cooldown_user_id:
+        return cached, False
+
+    try:
+        return _fetch_access(user_id, cooldown_user_id)
+    except Exception as e:
+        # If Redis fails, log error and allow access (fail open for availability)
+        print(f"Error checking allowed broadcasters: {e}")
+        return True, False
+
+
+def user_allowed(user_id: str) -> bool:
+    return check_access(user_id)[0]
+
+
+def set_cooldown(user_id: str, batch: Optional[RedisBatch] = None):
+    """
+    Starts the sender's cooldown; queued on `batch` when one is given.
+    """
+    if BROADCAST_COOLDOWN_SECONDS <= 0:
+        return
+    (batch if batch is not None else redis).set(cooldown_key(user_id), str(int(time.time())), ex=BROADCAST_COOLDOWN_SECONDS)
@@ -2,6 +2,8 @@ from __future__ import annotations
 from typing import Any, Dict, List, Optional
 from datetime import datetime, timezone
 
+from api._payload import clip
+
 
 def build_broadcast_blocks(
     title: str,
@@ -9,10 +11,11 @@ def build_broadcast_blocks(
     category: str,
     sender_name: str,
     link: Optional[str],
+    attachment: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
     """
     Builds the final Block Kit message that partners receive.
-    Fully Slack-compliant.
+    Fully Slack-compliant. `attachment` names the file shared alongside it.
     """
 
     # Sanitize inputs to avoid Slack validation errors
@@ -20,7 +23,8 @@ def build_broadcast_blocks(
     safe_category = " ".join((category or "").split())
 
     header_text = f"{safe_category}: {safe_title}".strip(": ").strip()
-    header_text = header_text[:150]  # Slack header max length
+    # Slack header max length; placeholder marks count as their longest value
+    header_text = clip(header_text, 150)
 
     ts = datetime.now(timezone.utc).strftime("%b %d, %Y • %H:%M UTC")
 
@@ -39,10 +43,16 @@ def build_broadcast_blocks(
         {"type": "divider"},
         {
             "type": "section",
-            "text": {"type": "mrkdwn", "text": body[:3000]},
+            "text": {"type": "mrkdwn", "text": clip(body, 3000)},
         },
     ]
 
+    if attachment:
+        blocks.append({
+            "type": "context",
+            "elements": [{"type": "mrkdwn", "text": f"📎 *Attachment:* {attachment[:200]} (shared in this channel)"}],
+        })
+
     if link:
         blocks.append({"type": "divider"})
         blocks.append(
@@ -61,12 +71,84 @@ def build_broadcast_blocks(
     return blocks
 
 
-def draft_modal_view(private_metadata: str) -> Dict[str, Any]:
+def _option(value: str) -> Dict[str, Any]:
+    return {"text": {"type": "plain_text", "text": value[:75]}, "value": value}
+
+
+def segment_picker_blocks(segments: List[str], audience: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """
-    Draft modal opened by /partner_broadcast
+    Audience inputs for the draft modal: segments to send to (any / all of them)
+    and segments to leave out. Nothing selected means every tracked channel.
     """
+    audience = audience or {}
+    options = [_option(s) for s in segments[:100]]
+    match = "all" if audience.get("match") == "all" else "any"
 
-    return {
+    def multi_select(block_id: str, action_id: str, label: str, placeholder: str, chosen: List[str]) -> Dict[str, Any]:
+        element: Dict[str, Any] = {
+            "type": "multi_static_select",
+            "action_id": action_id,
+            "placeholder": {"type": "plain_text", "text": placeholder},
+            "options": options,
+        }
+        initial = [_option(s) for s in chosen if s in segments]
+        if initial:
+            element["initial_options"] = initial
+        return {"type": "input", "block_id": block_id, "label": {"type": "plain_text", "text": label}, "element": element, "optional": True}
+
+    match_options = [
+        {"text": {"type": "plain_text", "text": "In any selected segment"}, "value": "any"},
+        {"text": {"type": "plain_text", "text": "In every selected segment"}, "value": "all"},
+    ]
+    return [
+        multi_select("segment_block", "segment_select", "Send to segments", "All tracked channels", audience.get("segments") or []),
+        {
+            "type": "input",
+            "block_id": "segment_match_block",
+            "label": {"type": "plain_text", "text": "Channels"},
+            "element": {
+                "type": "static_select",
+                "action_id": "segment_match_select",
+                "options": match_options,
+                "initial_option": match_options[1 if match == "all" else 0],
+            },
+        },
+        multi_select("exclude_block", "exclude_select", "Leave out segments", "None", audience.get("exclude") or []),
+    ]
+
+
+def _file_blocks(current: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    blocks: List[Dict[str, Any]] = [{
+        "type": "input",
+        "block_id": "file_block",
+        "label": {"type": "plain_text", "text": "Optional attachment"},
+        "element": {"type": "file_input", "action_id": "file_input", "max_files": 1},
+        "optional": True,
+    }]
+    if current:
+        # file_input can't be prefilled; an empty input keeps the earlier file
+        blocks.append({
+            "type": "context",
+            "elements": [{"type": "mrkdwn", "text": f"📎 Attached: {current.get('name')}. Leave empty to keep it."}],
+        })
+    return blocks
+
+
+def draft_modal_view(
+    private_metadata: str,
+    draft: Optional[Dict[str, Any]] = None,
+    segments: Optional[List[str]] = None,
+    allow_file: bool = True,
+) -> Dict[str, Any]:
+    """
+    Draft modal opened by /partner_broadcast, prefilled from `draft` when editing.
+    With `segments`, it also offers the segment picker.
+    """
+
+    draft = draft or {}
+    category = draft.get("category") or "Release"
+
+    view = {
         "type": "modal",
         "callback_id": "broadcast_draft_submit",
         "private_metadata": private_metadata,
@@ -99,8 +181,8 @@ def draft_modal_view(private_metadata: str) -> Dict[str, Any]:
                         {"text": {"type": "plain_text", "text": "FYI"}, "value": "FYI"},
                     ],
                     "initial_option": {
-                        "text": {"type": "plain_text", "text": "Release"},
-                        "value": "Release",
+                        "text": {"type": "plain_text", "text": category},
+                        "value": category,
                     },
                 },
             },
@@ -124,6 +206,8 @@ def draft_modal_view(private_metadata: str) -> Dict[str, Any]:
                 },
                 "optional": True,
             },
+            *(_file_blocks(draft.get("file")) if allow_file else []),
+            *(segment_picker_blocks(segments, draft.get("audience")) if segments else []),
             {
                 "type": "context",
                 "elements": [
@@ -136,15 +220,30 @@ def draft_modal_view(private_metadata: str) -> Dict[str, Any]:
         ],
     }
 
+    for block in view["blocks"]:
+        element = block.get("element") or {}
+        field = {"title_input": "title", "body_input": "body", "link_input": "link"}.get(element.get("action_id"))
+        if field and draft.get(field):
+            element["initial_value"] = draft[field]
+    return view
+
 
 def review_modal_view(
     private_metadata: str,
     preview_blocks: List[Dict[str, Any]],
     channel_count: int,
+    heading: Optional[str] = None,
+    estimate: Optional[str] = None,
+    personalized: Optional[List[str]] = None,
 ) -> Dict[str, Any]:
     """
-    Review modal shown after Draft → Review.
+    Review modal shown after Draft → Review. `estimate` is shown under the heading,
+    and `personalized` lists the channel metadata fields the message fills in.
     """
+    notes = [estimate] if estimate else []
+    if personalized:
+        fields = ", ".join(f"`{f}`" for f in personalized)
+        notes.append(f"🧩 Personalized per channel: {fields} (from partner_alert_bot:channel_meta:<channel>)")
 
     return {
         "type": "modal",
@@ -157,9 +256,10 @@ def review_modal_view(
                 "type": "section",
                 "text": {
                     "type": "mrkdwn",
-                    "text": f"*Ready to send to* *{channel_count}* *channel(s).*",
+                    "text": heading or f"*Ready to send to* *{channel_count}* *channel(s).*",
                 },
             },
+            *({"type": "context", "elements": [{"type": "mrkdwn", "text": note}]} for note in notes),
             {"type": "divider"},
             *preview_blocks,
             {"type": "divider"},
@@ -182,3 +282,35 @@ def review_modal_view(
             },
         ],
     }
+
+
+def summary_message_blocks(text: str, job_id: str, failed: int) -> List[Dict[str, Any]]:
+    """
+    Summary DM for a finished broadcast. With failures, offers a retry that
+    re-sends to the failed channels only.
+    """
+    blocks: List[Dict[str, Any]] = [
+        {"type": "section", "text": {"type": "mrkdwn", "text": text[:3000]}},
+        {
+            "type": "context",
+            "elements": [{
+                "type": "mrkdwn",
+                "text": f"Job `{job_id}` · correct it with `/partner_broadcast edit {job_id}`, "
+                        f"delete it everywhere with `/partner_broadcast retract {job_id}`",
+            }],
+        },
+    ]
+    if failed:
+        blocks.append({
+            "type": "actions",
+            "block_id": "summary_actions",
+            "elements": [
+                {
+                    "type": "button",
+                    "action_id": "retry_failed",
+                    "text": {"type": "plain_text", "text": f"Retry failed ({failed})"},
+                    "value": job_id,
+                },
+            ],
+        })
+    return blocks
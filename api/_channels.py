@@ -0,0 +1,255 @@
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from api._redis import RedisBatch, decode, get_redis
+
+CHANNEL_SCAN_BATCH = int(os.environ.get("CHANNEL_SCAN_BATCH", "500"))
+CHANNEL_COUNT_CACHE_SECONDS = float(os.environ.get("CHANNEL_COUNT_CACHE_SECONDS", "15"))
+
+CHANNEL_SET_KEY = "partner_alert_bot:channels"
+# Exists only while a reconcile runs: channels confirmed by users.conversations
+RECONCILE_SEEN_KEY = "partner_alert_bot:reconcile:seen"
+# Per-channel personalization values (partner_name, greeting, …), one hash per channel
+CHANNEL_META_KEY_PREFIX = "partner_alert_bot:channel_meta"
+
+redis = get_redis()
+
+_count_cache: Tuple[int, float] = (0, 0.0)
+
+
+def stream_channels_into(
+    on_batch: Callable[[RedisBatch, List[str]], None],
+    key: str = CHANNEL_SET_KEY,
+    batch_size: int = CHANNEL_SCAN_BATCH,
+) -> int:
+    """
+    SSCANs `key` and hands each batch of channels to `on_batch`, which queues its
+    writes on a RedisBatch that is flushed together with the next SSCAN page:
+    one round trip per page. Returns the number of channels handed over.
+    """
+    seen = 0
+    cursor, members = redis.sscan(key, 0, count=batch_size)
+    while True:
+        channels = [decode(c) for c in (members or [])]
+        if int(cursor) == 0:
+            if channels:
+                batch = RedisBatch()
+                on_batch(batch, channels)
+                batch.flush()
+            return seen + len(channels)
+
+        batch = RedisBatch()
+        if channels:
+            on_batch(batch, channels)
+        scan_idx = batch.sscan(key, cursor, count=batch_size)
+        seen += len(channels)
+        cursor, members = batch.flush()[scan_idx]
+
+
+def channel_meta(channels: List[str], fields: List[str]) -> Dict[str, Dict[str, str]]:
+    """
+    The given metadata fields of each channel (HMGET of
+    partner_alert_bot:channel_meta:<channel>), in one pipelined request.
+    Channels without any of them are left out.
+    """
+    if not channels or not fields:
+        return {}
+    batch = RedisBatch()
+    for ch in channels:
+        batch.hmget(f"{CHANNEL_META_KEY_PREFIX}:{ch}", *fields)
+    found = {}
+    for ch, values in zip(channels, batch.flush()):
+        meta = {f: decode(v) for f, v in zip(fields, values or []) if v is not None}
+        if meta:
+            found[ch] = meta
+    return found
+
+
+def channel_count(key: str = CHANNEL_SET_KEY) -> int:
+    return int(redis.scard(key) or 0)
+
+
+def cached_channel_count(max_age: Optional[float] = None, batch: Optional[RedisBatch] = None) -> int:
+    """
+    SCARD of the tracked set, cached in-process for CHANNEL_COUNT_CACHE_SECONDS.
+    Extra commands can be sent along on `batch` (flushed either way).
+    """
+    global _count_cache
+    max_age = CHANNEL_COUNT_CACHE_SECONDS if max_age is None else max_age
+    count, fetched_at = _count_cache
+    if fetched_at and time.monotonic() - fetched_at < max_age:
+        if batch is not None:
+            batch.flush()
+        return count
+    if batch is None:
+        count = channel_count()
+    else:
+        count_idx = batch.scard(CHANNEL_SET_KEY)
+        count = int(batch.flush()[count_idx] or 0)
+    _count_cache = (count, time.monotonic())
+    return count
+
+
+# KEYS: event dedup key, channel set, reconcile seen set, channel health hash.
+# ARGV: "add" | "remove", channel, dedup ttl.
+# Returns -1 for an event already applied, else the SADD / SREM result.
+# Joins during a reconcile are marked seen so its final prune keeps them; a
+# removed channel's health fields go with it.
+_MEMBERSHIP_SCRIPT = """
+if redis.call('SET', KEYS[1], '1', 'NX', 'EX', ARGV[3]) == false then
+  return -1
+end
+if ARGV[1] == 'add' then
+  if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('SADD', KEYS[3], ARGV[2])
+  end
+  return redis.call('SADD', KEYS[2], ARGV[2])
+end
+redis.call('HDEL', KEYS[4], ARGV[2] .. ':failures', ARGV[2] .. ':last_error')
+return redis.call('SREM', KEYS[2], ARGV[2])
+"""
+
+
+class _MembershipWriter:
+    """
+    Group commit for join/leave writes: while one thread's pipeline is in flight,
+    writes arriving from other requests queue up and go out together in the next
+    one, so an invite burst costs a handful of round trips instead of one each.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending: List[dict] = []
+        self._flushing = False
+
+    def submit(self, op: str, channel: str, dedup_key: str, dedup_ttl: int) -> int:
+        entry = {"args": (op, channel, dedup_key, dedup_ttl), "done": False, "result": None, "error": None}
+        with self._cond:
+            self._pending.append(entry)
+            while not entry["done"]:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flushing = True
+                entries, self._pending = self._pending, []
+                self._cond.release()
+                try:
+                    self._flush(entries)
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                    self._cond.notify_all()
+        if entry["error"] is not None:
+            raise entry["error"]
+        return entry["result"]
+
+    def _flush(self, entries: List[dict]):
+        global _count_cache
+        batch = RedisBatch()
+        for entry in entries:
+            op, channel, dedup_key, dedup_ttl = entry["args"]
+            batch.eval(
+                _MEMBERSHIP_SCRIPT,
+                keys=[dedup_key, CHANNEL_SET_KEY, RECONCILE_SEEN_KEY, CHANNEL_HEALTH_KEY],
+                args=[op, channel, dedup_ttl],
+            )
+        try:
+            results = batch.flush()
+            for entry, result in zip(entries, results):
+                entry["result"] = int(result)
+        except Exception as e:
+            for entry in entries:
+                entry["error"] = e
+        for entry in entries:
+            entry["done"] = True
+        _count_cache = (0, 0.0)
+
+
+_membership_writer = _MembershipWriter()
+
+
+def apply_membership_event(op: str, channel: str, dedup_key: str, dedup_ttl: int) -> int:
+    """
+    Adds ("add") or removes ("remove") a tracked channel unless `dedup_key` was
+    already seen within `dedup_ttl` seconds. Returns -1 for a duplicate, otherwise
+    the number of members changed.
+    """
+    return _membership_writer.submit(op, channel, dedup_key, dedup_ttl)
+
+
+# <channel>:failures / <channel>:last_error of channels failing right now; a
+# delivery, prune or removal drops them, and the hash expires when unused
+CHANNEL_HEALTH_KEY = "partner_alert_bot:channel_health"
+CHANNEL_HEALTH_TTL_SECONDS = 30 * 86400
+CHANNEL_FAILURE_THRESHOLD = int(os.environ.get("CHANNEL_FAILURE_THRESHOLD", "3"))
+
+# The bot can never post here again: stop tracking on the first failure
+PERMANENT_CHANNEL_ERRORS = {"channel_not_found", "is_archived", "not_in_channel"}
+# Channel-specific but possibly temporary: stop tracking after CHANNEL_FAILURE_THRESHOLD in a row.
+# Everything else (ratelimited, token errors such as account_inactive, message
+# errors, network errors) says nothing about the channel and is not counted.
+TRANSIENT_CHANNEL_ERRORS = {
+    "restricted_action",
+    "restricted_action_read_only_channel",
+    "restricted_action_thread_only_channel",
+    "restricted_action_non_threadable_channel",
+    "team_access_not_granted",
+    "ekm_access_denied",
+}
+
+# KEYS: health hash, channel set, pruned list. ARGV: threshold, pruned ttl, health
+# ttl, then (channel, error, permanent "1"/"0") triples. Returns the number of
+# channels pruned.
+_HEALTH_SCRIPT = """
+local threshold = tonumber(ARGV[1])
+local pruned = 0
+for i = 4, #ARGV, 3 do
+  local ch, err = ARGV[i], ARGV[i + 1]
+  redis.call('HSET', KEYS[1], ch .. ':last_error', err)
+  local drop = ARGV[i + 2] == '1'
+  if not drop then
+    drop = redis.call('HINCRBY', KEYS[1], ch .. ':failures', 1) >= threshold
+  end
+  if drop then
+    if redis.call('SREM', KEYS[2], ch) == 1 then
+      redis.call('RPUSH', KEYS[3], ch .. ' (' .. err .. ')')
+      pruned = pruned + 1
+    end
+    redis.call('HDEL', KEYS[1], ch .. ':failures', ch .. ':last_error')
+  end
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+if pruned > 0 then redis.call('EXPIRE', KEYS[3], ARGV[2]) end
+return pruned
+"""
+
+
+def health_fields(channels: List[str]) -> List[str]:
+    return [f"{ch}:{field}" for ch in channels for field in ("failures", "last_error")]
+
+
+def queue_channel_health(batch: RedisBatch, results, pruned_key: str, pruned_ttl: int):
+    """
+    Queues health bookkeeping for one slice of (channel, ok, error) results:
+    successes clear the channel's health fields, permanent errors prune it at
+    once and transient ones after CHANNEL_FAILURE_THRESHOLD consecutive failures.
+    Pruned channels are appended to `pruned_key` for the summary DM.
+    """
+    healthy = [ch for ch, ok, _ in results if ok]
+    if healthy:
+        batch.hdel(CHANNEL_HEALTH_KEY, *health_fields(healthy))
+
+    args = []
+    for ch, ok, err in results:
+        if ok or (err not in PERMANENT_CHANNEL_ERRORS and err not in TRANSIENT_CHANNEL_ERRORS):
+            continue
+        args += [ch, err, "1" if err in PERMANENT_CHANNEL_ERRORS else "0"]
+    if args:
+        batch.eval(
+            _HEALTH_SCRIPT,
+            keys=[CHANNEL_HEALTH_KEY, CHANNEL_SET_KEY, pruned_key],
+            args=[CHANNEL_FAILURE_THRESHOLD, pruned_ttl, CHANNEL_HEALTH_TTL_SECONDS, *args],
+        )
@@ -0,0 +1,36 @@
+from __future__ import annotations
+import os
+import threading
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from slack_sdk import WebClient
+
+_slack_client: Optional["WebClient"] = None
+_lock = threading.Lock()
+
+
+def get_slack_client() -> "WebClient":
+    """
+    One slack_sdk WebClient per process, created on first use. slack_sdk is only
+    imported here, so handlers that never call the Web API through it (events)
+    don't pay for it on a cold start.
+    """
+    global _slack_client
+    if _slack_client is None:
+        with _lock:
+            if _slack_client is None:
+                from slack_sdk import WebClient
+
+                # SLACK_API_BASE_URL: same override as api._slack_http (e.g. a local fake Slack)
+                base_url = os.environ.get("SLACK_API_BASE_URL", "https://slack.com/api").rstrip("/") + "/"
+                _slack_client = WebClient(token=os.environ["SLACK_BOT_TOKEN"], base_url=base_url)
+    return _slack_client
+
+
+def call_slack(method: str, **kwargs):
+    """
+    get_slack_client().<method>(**kwargs), resolved at call time. For Deferred
+    tasks, so building the client never delays the ack.
+    """
+    return getattr(get_slack_client(), method)(**kwargs)
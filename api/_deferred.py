@@ -0,0 +1,56 @@
+from __future__ import annotations
+import threading
+from typing import Any, Callable, List, Tuple
+
+from api._redis import RedisBatch
+
+ACK_LATENCY_KEY_PREFIX = "partner_alert_bot:metrics:ack_ms"
+ACK_LATENCY_SAMPLES = 500
+
+
+def _call(fn: Callable[..., Any], args: tuple, kwargs: dict):
+    try:
+        fn(*args, **kwargs)
+    except Exception as e:
+        print(f"Deferred task {getattr(fn, '__name__', fn)} failed: {e}")
+
+
+class Deferred:
+    """
+    Follow-up work of a handler, kept off the path of Slack's ack. add() queues
+    non-critical work (metrics, message touch-ups) that runs only after the
+    response has been written. start() runs work that must happen, such as a
+    worker wake-up or the modal a user waits for, on a thread right away: the
+    platform may freeze the invocation once the response is out. run() does
+    the queued work and then waits for the started threads.
+    """
+
+    def __init__(self):
+        self._tasks: List[Tuple[Callable[..., Any], tuple, dict]] = []
+        self._threads: List[threading.Thread] = []
+
+    def add(self, fn: Callable[..., Any], *args, **kwargs):
+        self._tasks.append((fn, args, kwargs))
+
+    def start(self, fn: Callable[..., Any], *args, **kwargs):
+        thread = threading.Thread(target=_call, args=(fn, args, kwargs), daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def run(self):
+        tasks, self._tasks = self._tasks, []
+        for fn, args, kwargs in tasks:
+            _call(fn, args, kwargs)
+        threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join()
+
+
+def record_ack_latency(callback_id: str, elapsed_ms: float):
+    """
+    Keeps the last ACK_LATENCY_SAMPLES ack times (ms) per callback_id / action_id.
+    """
+    key = f"{ACK_LATENCY_KEY_PREFIX}:{callback_id}"
+    with RedisBatch() as batch:
+        batch.lpush(key, str(round(elapsed_ms, 1)))
+        batch.ltrim(key, 0, ACK_LATENCY_SAMPLES - 1)
@@ -0,0 +1,78 @@
+from __future__ import annotations
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+# Reused across slices and warm invocations so per-thread keep-alive connections survive
+_pools: Dict[int, ThreadPoolExecutor] = {}
+
+
+def _pool(concurrency: int) -> ThreadPoolExecutor:
+    pool = _pools.get(concurrency)
+    if pool is None:
+        pool = _pools[concurrency] = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="deliver")
+    return pool
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all delivery threads of one invocation.
+    `pause()` holds every caller back, e.g. after Slack returns Retry-After.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = max(float(rate), 0.001)
+        self.capacity = float(burst or max(1, int(self.rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def fan_out(
+    channels: Iterable[str],
+    post: Callable[[str], Tuple[bool, Optional[str]]],
+    concurrency: int,
+    limiter: RateLimiter,
+    deadline: Optional[float] = None,
+) -> List[Tuple[str, bool, Optional[str]]]:
+    """
+    Calls `post(channel)` -> (ok, detail) for every channel with at most `concurrency`
+    calls in flight, paced by `limiter`. Returns (channel, ok, detail) in the same
+    order as `channels`; detail is the message ts on success, else the error.
+    Channels whose turn comes after `deadline` (time.monotonic()) are not posted
+    and are left out of the result.
+    """
+
+    def _one(ch: str):
+        if deadline is not None and time.monotonic() >= deadline:
+            return None
+        limiter.acquire()
+        if deadline is not None and time.monotonic() >= deadline:
+            return None
+        ok, detail = post(ch)
+        return ch, ok, detail
+
+    return [r for r in _pool(max(1, concurrency)).map(_one, channels) if r is not None]
@@ -0,0 +1,56 @@
+from __future__ import annotations
+import functools
+import json
+import time
+from http.server import BaseHTTPRequestHandler
+
+from api import _metrics
+
+
+def _instrumented(do, name: str):
+    @functools.wraps(do)
+    def wrapper(self):
+        self._started = time.monotonic()
+        try:
+            with _metrics.timer(name):
+                do(self)
+        finally:
+            # One pipelined write per invocation, after the response is out. Handler
+            # timings alone wait for the next one: a health check or a rejected
+            # request doesn't pay a Redis round trip
+            if _metrics.recorded(ignore="handler."):
+                _metrics.flush()
+
+    return wrapper
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    """
+    Base for the api/* handlers: response helpers shared by every endpoint.
+    Each do_GET / do_POST is timed as handler.<module>.<verb> (it starts at
+    `self._started`, time.monotonic()), and the metrics recorded during the
+    request are flushed to Redis when it returns, along with earlier handler
+    timings of the instance.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        module = cls.__module__.rsplit(".", 1)[-1]
+        for verb in ("GET", "POST"):
+            do = cls.__dict__.get(f"do_{verb}")
+            if do is not None:
+                setattr(cls, f"do_{verb}", _instrumented(do, f"handler.{module}.{verb}"))
+
+    def _send_body(self, data: bytes, content_type: str, status: int):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def _send_json(self, payload, status: int = 200):
+        self._send_body(json.dumps(payload).encode("utf-8"), "application/json", status)
+
+    def _send_text(self, text: str, status: int = 200):
+        self._send_body(text.encode("utf-8"), "text/plain; charset=utf-8", status)
@@ -0,0 +1,392 @@
+from __future__ import annotations
+import json
+import os
+import secrets
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from api._channels import CHANNEL_SET_KEY, stream_channels_into
+from api._metrics import Histogram, PostStats, histogram_fields, queue_histogram
+from api._redis import RedisBatch, decode, get_redis
+
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "86400"))
+# The spec and ledger outlive the delivery state: retries (and edits) need them
+LEDGER_TTL_SECONDS = int(os.environ.get("LEDGER_TTL_SECONDS", str(7 * 86400)))
+RETRY_SCAN_BATCH = 500
+
+# Ledger value for a channel whose copy was deleted by a retraction
+RETRACTED = "retracted"
+
+JOB_KEY_PREFIX = "partner_alert_bot:job"
+FIRST_DELIVERY_KEY_PREFIX = "partner_alert_bot:metrics:first_delivery_ms"
+FIRST_DELIVERY_SAMPLES = 500
+
+# KEYS: targets, status. ARGV: start, stop.
+# Claims the channels of a slice with HSETNX so concurrent workers on the same job
+# never post to a channel twice. Returns {channels listed, claimed channels}.
+_CLAIM_SLICE_SCRIPT = """
+local listed = redis.call('LRANGE', KEYS[1], ARGV[1], ARGV[2])
+local claimed = {}
+for _, ch in ipairs(listed) do
+  if redis.call('HSETNX', KEYS[2], ch, 'pending') == 1 then
+    table.insert(claimed, ch)
+  end
+end
+return {#listed, claimed}
+"""
+
+# KEYS: job counts hash, lane samples list. ARGV: queue-to-first-delivery ms, max samples.
+# Only the first slice of a job to land records its sample.
+_FIRST_DELIVERY_SCRIPT = """
+if redis.call('HSETNX', KEYS[1], 'first_delivery_ms', ARGV[1]) == 1 then
+  redis.call('LPUSH', KEYS[2], ARGV[1])
+  redis.call('LTRIM', KEYS[2], 0, tonumber(ARGV[2]) - 1)
+  return 1
+end
+return 0
+"""
+
+redis = get_redis()
+
+
+def job_key(job_id: str, part: Optional[str] = None) -> str:
+    """
+    partner_alert_bot:job:<id>            job spec (JSON, includes the shard ranges)
+    partner_alert_bot:job:<id>:status     delivery ledger: channel -> message ts, Slack error code,
+                                          "retracted", or "pending" while claimed by a worker
+    partner_alert_bot:job:<id>:retracted  set once the broadcast was retracted; blocks retries
+    partner_alert_bot:job:<id>:targets    channel snapshot (list, SSCAN order)
+    partner_alert_bot:job:<id>:cursors    shard index -> index of its next channel
+    partner_alert_bot:job:<id>:counts     sent / failed / shards_done, aggregated across shards
+    partner_alert_bot:job:<id>:failed     "<channel> (<error>)" entries for the summary DM
+    partner_alert_bot:job:<id>:pruned     "<channel> (<error>)" for channels this job stopped tracking
+    """
+    key = f"{JOB_KEY_PREFIX}:{job_id}"
+    return f"{key}:{part}" if part else key
+
+
+def is_message_ts(value: str) -> bool:
+    # Ledger values: "1712345678.123456" for delivered, error codes never start with a digit
+    return value[:1].isdigit()
+
+
+def _hash_pairs(raw) -> List[Tuple[str, str]]:
+    # HSCAN results come back as a dict or as a flat [field, value, ...] list
+    if isinstance(raw, dict):
+        return [(decode(k), decode(v)) for k, v in raw.items()]
+    raw = list(raw or [])
+    return [(decode(raw[i]), decode(raw[i + 1])) for i in range(0, len(raw) - 1, 2)]
+
+
+def iter_ledger(job_id: str, batch_size: int = RETRY_SCAN_BATCH):
+    """
+    Streams (channel, ts or error) pairs from a job's delivery ledger with HSCAN.
+    """
+    cursor = 0
+    while True:
+        cursor, entries = redis.hscan(job_key(job_id, "status"), cursor, count=batch_size)
+        pairs = _hash_pairs(entries)
+        if pairs:
+            yield pairs
+        if int(cursor) == 0:
+            return
+
+
+def new_job_id() -> str:
+    return secrets.token_hex(6)
+
+
+def shard_ranges(total: int, shards: int) -> List[List[int]]:
+    """
+    Splits [0, total) into `shards` contiguous [start, end) ranges of near-equal size.
+    """
+    shards = max(1, min(shards, total or 1))
+    size, extra = divmod(total, shards)
+    ranges = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append([start, end])
+        start = end
+    return ranges
+
+
+def snapshot_targets(job_id: str, source_key: str = CHANNEL_SET_KEY) -> int:
+    """
+    Copies the channel set into the job's targets list page by page (SSCAN), so
+    memory stays constant however many channels are tracked. Returns the count.
+    """
+    targets = job_key(job_id, "targets")
+    redis.delete(targets)
+
+    def append(batch: RedisBatch, channels: List[str]):
+        batch.rpush(targets, *channels)
+
+    total = stream_channels_into(append, key=source_key)
+    redis.expire(targets, JOB_TTL_SECONDS)
+    return total
+
+
+def _snapshot_from_ledger(job_id: str, source_job_id: str, keep: Callable[[str], bool]) -> int:
+    targets = job_key(job_id, "targets")
+    redis.delete(targets)
+    total = 0
+    for pairs in iter_ledger(source_job_id):
+        selected = [ch for ch, value in pairs if keep(value)]
+        if selected:
+            redis.rpush(targets, *selected)
+            total += len(selected)
+    redis.expire(targets, JOB_TTL_SECONDS)
+    return total
+
+
+def snapshot_retry_targets(job_id: str, source_job_id: str, skip_errors=()) -> int:
+    """
+    Fills the job's targets with the channels `source_job_id` failed to deliver to,
+    except errors in `skip_errors`. Channels still "pending" are skipped: a worker
+    may have posted there before dying, and a retry must not post twice.
+    """
+    skip = {"pending", RETRACTED, *skip_errors}
+    return _snapshot_from_ledger(job_id, source_job_id, lambda value: not is_message_ts(value) and value not in skip)
+
+
+def snapshot_delivered_targets(job_id: str, source_job_id: str) -> int:
+    """
+    Fills the job's targets with the channels holding a copy of `source_job_id`
+    (ledger entries with a message ts), for edits and retractions.
+    """
+    return _snapshot_from_ledger(job_id, source_job_id, is_message_ts)
+
+
+def target_range(job_id: str, start: int, stop: int) -> List[str]:
+    """
+    Channels at positions start..stop (inclusive) of the job's targets list.
+    """
+    return [decode(c) for c in (redis.lrange(job_key(job_id, "targets"), start, stop) or [])]
+
+
+def ledger_ts(job_id: str, channels: List[str]) -> Dict[str, str]:
+    """
+    Message ts per channel from a job's ledger, for channels that hold a copy.
+    """
+    if not channels:
+        return {}
+    values = redis.hmget(job_key(job_id, "status"), *channels) or []
+    found = {}
+    for ch, raw in zip(channels, values):
+        value = decode(raw) if raw is not None else ""
+        if is_message_ts(value):
+            found[ch] = value
+    return found
+
+
+def update_job_spec(job_id: str, fields: Dict[str, Any]) -> bool:
+    """
+    Overwrites message fields of a stored job (e.g. after an edit, so later retries
+    send the corrected version). Returns False if the job expired.
+    """
+    job, _ = load_job(job_id)
+    if not job:
+        return False
+    job.update(fields)
+    redis.set(job_key(job_id), json.dumps(job), ex=LEDGER_TTL_SECONDS)
+    return True
+
+
+def mark_retracted(job_id: str, batch: Optional[RedisBatch] = None):
+    target = batch if batch is not None else redis
+    target.set(job_key(job_id, "retracted"), "1", ex=LEDGER_TTL_SECONDS)
+
+
+def is_retracted(job_id: str) -> bool:
+    return bool(redis.exists(job_key(job_id, "retracted")))
+
+
+def create_job(
+    spec: Dict[str, Any],
+    total: int,
+    shards: int = 1,
+    batch: Optional[RedisBatch] = None,
+) -> Dict[str, Any]:
+    """
+    Persists a freshly queued broadcast and its shard ranges over the `total`
+    channels already snapshotted by snapshot_targets(), so each shard can be
+    delivered (and resumed) by any invocation.
+    Extra commands can be sent along on `batch`, which is flushed.
+    """
+    job = dict(spec)
+    job["job_id"] = job.get("job_id") or new_job_id()
+    job["total"] = total
+    job["started_at"] = round(time.time(), 3)
+    job["shards"] = shard_ranges(total, shards)
+
+    job_id = job["job_id"]
+    batch = batch if batch is not None else RedisBatch()
+    batch.set(job_key(job_id), json.dumps(job), ex=LEDGER_TTL_SECONDS)
+    batch.hset(job_key(job_id, "cursors"), values={str(i): str(start) for i, (start, _) in enumerate(job["shards"])})
+    batch.expire(job_key(job_id, "cursors"), JOB_TTL_SECONDS)
+    batch.flush()
+    return job
+
+
+def load_job(job_id: str, shard: int = 0) -> Tuple[Optional[Dict[str, Any]], int]:
+    """
+    Returns (job spec, shard cursor). The spec is None if the job expired.
+    """
+    batch = RedisBatch()
+    batch.get(job_key(job_id))
+    batch.hget(job_key(job_id, "cursors"), str(shard))
+    raw_job, raw_cursor = batch.flush()
+    if not raw_job:
+        return None, 0
+    job = json.loads(decode(raw_job))
+    start = job["shards"][shard][0]
+    return job, int(decode(raw_cursor)) if raw_cursor is not None else start
+
+
+def _claim_slice(target, job_id: str, cursor: int, size: int):
+    return target.eval(
+        _CLAIM_SLICE_SCRIPT,
+        keys=[job_key(job_id, "targets"), job_key(job_id, "status")],
+        args=[cursor, cursor + size - 1],
+    )
+
+
+def _decode_slice(raw) -> Tuple[int, List[str]]:
+    listed, claimed = raw or (0, [])
+    return int(listed or 0), [decode(c) for c in (claimed or [])]
+
+
+def next_slice(job_id: str, cursor: int, size: int) -> Tuple[int, List[str]]:
+    """
+    Returns (channels listed at the cursor, channels this worker claimed to deliver).
+    """
+    return _decode_slice(_claim_slice(redis, job_id, cursor, size))
+
+
+def release_slice(job_id: str, channels: List[str], batch: Optional[RedisBatch] = None):
+    """
+    Drops this worker's "pending" claims on channels it claimed but never
+    delivered (it stopped for its time budget or a higher lane), so whichever
+    invocation resumes the shard claims and delivers them. Queued on `batch`
+    when one is given.
+    """
+    if channels:
+        (batch if batch is not None else redis).hdel(job_key(job_id, "status"), *channels)
+
+
+def save_checkpoint(
+    job_id: str,
+    shard: int,
+    cursor: int,
+    results: List[Tuple[str, bool, Optional[str]]],
+    next_size: int = 0,
+    batch: Optional[RedisBatch] = None,
+    root_job_id: Optional[str] = None,
+) -> Tuple[int, List[str]]:
+    """
+    Records a delivered slice in the ledger and advances the shard cursor.
+    For follow-ups (retry, edit, retraction), successes are also written to the
+    ledger of `root_job_id` so the original broadcast's ledger stays the one
+    complete record.
+    With `next_size`, the following slice is claimed in the same pipelined request
+    (see next_slice). Extra commands can be sent along on `batch`.
+    """
+    sent = sum(1 for _, ok, _ in results if ok)
+    failed = [f"{ch} ({err})" for ch, ok, err in results if not ok]
+
+    batch = batch if batch is not None else RedisBatch()
+    if results:
+        batch.hset(job_key(job_id, "status"), values={ch: (detail or "error") for ch, _, detail in results})
+        batch.expire(job_key(job_id, "status"), LEDGER_TTL_SECONDS)
+    delivered = {ch: detail for ch, ok, detail in results if ok and detail}
+    if root_job_id and delivered:
+        batch.hset(job_key(root_job_id, "status"), values=delivered)
+    if sent:
+        batch.hincrby(job_key(job_id, "counts"), "sent", sent)
+    if failed:
+        batch.hincrby(job_key(job_id, "counts"), "failed", len(failed))
+        batch.rpush(job_key(job_id, "failed"), *failed)
+        batch.expire(job_key(job_id, "failed"), JOB_TTL_SECONDS)
+    batch.expire(job_key(job_id, "counts"), JOB_TTL_SECONDS)
+    batch.hset(job_key(job_id, "cursors"), str(shard), str(cursor))
+    next_idx = _claim_slice(batch, job_id, cursor, next_size) if next_size else None
+    results_raw = batch.flush()
+    if next_idx is None:
+        return 0, []
+    return _decode_slice(results_raw[next_idx])
+
+
+def queue_first_delivery(batch: RedisBatch, job_id: str, lane: str, queued_at: float):
+    """
+    Records the time from queueing (epoch seconds) to the job's first delivered
+    slice, once per job, and keeps the last FIRST_DELIVERY_SAMPLES per lane in
+    partner_alert_bot:metrics:first_delivery_ms:<lane>.
+    """
+    elapsed_ms = max(0, int((time.time() - queued_at) * 1000))
+    batch.eval(
+        _FIRST_DELIVERY_SCRIPT,
+        keys=[job_key(job_id, "counts"), f"{FIRST_DELIVERY_KEY_PREFIX}:{lane}"],
+        args=[elapsed_ms, FIRST_DELIVERY_SAMPLES],
+    )
+
+
+def queue_slice_perf(batch: RedisBatch, job_id: str, stats: PostStats, throttled_seconds: float):
+    """
+    Adds a slice's post latencies, retries and rate-limit wait to the job's
+    perf hash; sent along with the slice checkpoint.
+    """
+    key = job_key(job_id, "perf")
+    queue_histogram(batch, key, stats.latency, JOB_TTL_SECONDS)
+    if stats.retries:
+        batch.hincrby(key, "retries", stats.retries)
+    if throttled_seconds > 0:
+        batch.hincrbyfloat(key, "throttled_s", round(throttled_seconds, 3))
+
+
+def first_delivery_samples(lanes, limit: int = FIRST_DELIVERY_SAMPLES) -> Dict[str, List[int]]:
+    batch = RedisBatch()
+    for lane in lanes:
+        batch.lrange(f"{FIRST_DELIVERY_KEY_PREFIX}:{lane}", 0, limit - 1)
+    return {lane: [int(decode(v)) for v in (raw or [])] for lane, raw in zip(lanes, batch.flush())}
+
+
+def finish_shard(
+    job_id: str,
+    shard_count: int,
+    max_failures: int = 10,
+    batch: Optional[RedisBatch] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Marks one shard done. For the last shard to finish (exactly one caller), returns
+    the job summary {"sent", "failed", "failures" (first `max_failures` entries),
+    "pruned", "first_delivery_ms", "perf"} and drops the channel snapshot; everyone
+    else gets None. "perf" holds the job's post latency Histogram, retries and
+    throttled seconds (see queue_slice_perf).
+    Counters expire with JOB_TTL_SECONDS, the spec and ledger with LEDGER_TTL_SECONDS.
+    """
+    batch = batch if batch is not None else RedisBatch()
+    done_idx = batch.hincrby(job_key(job_id, "counts"), "shards_done", 1)
+    batch.hmget(job_key(job_id, "counts"), "sent", "failed", "first_delivery_ms")
+    batch.lrange(job_key(job_id, "failed"), 0, max_failures - 1)
+    batch.lrange(job_key(job_id, "pruned"), 0, -1)
+    perf_fields = histogram_fields()
+    batch.hmget(job_key(job_id, "perf"), *perf_fields, "retries", "throttled_s")
+    results = batch.flush()[done_idx:done_idx + 5]
+    done, (sent, failed, first_ms), first_failures, pruned, perf = results
+    if int(done) != shard_count:
+        return None
+
+    redis.delete(job_key(job_id, "targets"), job_key(job_id, "cursors"))
+    return {
+        "sent": int(decode(sent or "0")),
+        "failed": int(decode(failed or "0")),
+        "failures": [decode(f) for f in (first_failures or [])],
+        "pruned": [decode(p) for p in (pruned or [])],
+        "first_delivery_ms": int(decode(first_ms)) if first_ms is not None else None,
+        "perf": {
+            "post_ms": Histogram.from_values(perf[:len(perf_fields)]),
+            "retries": int(decode(perf[-2] or "0")),
+            "throttled_seconds": float(decode(perf[-1] or "0")),
+        },
+    }
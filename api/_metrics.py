@@ -0,0 +1,341 @@
+from __future__ import annotations
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+METRICS_KEY_PREFIX = "partner_alert_bot:metrics"
+# Names of every histogram flushed so far, for /partner_broadcast stats
+HISTOGRAM_INDEX_KEY = f"{METRICS_KEY_PREFIX}:histograms"
+COUNTERS_KEY = f"{METRICS_KEY_PREFIX}:counters"
+# Newest first: one performance record per finished broadcast
+BROADCAST_PERF_KEY = f"{METRICS_KEY_PREFIX}:broadcasts"
+BROADCAST_PERF_SAMPLES = int(os.environ.get("BROADCAST_PERF_SAMPLES", "50"))
+METRICS_TTL_SECONDS = 30 * 86400
+# Rolling delivery model per job type, for the review modal's estimate
+THROUGHPUT_KEY_PREFIX = f"{METRICS_KEY_PREFIX}:throughput"
+# Weight of the newest broadcast in the model (exponentially weighted moving average)
+THROUGHPUT_EWMA_ALPHA = float(os.environ.get("THROUGHPUT_EWMA_ALPHA", "0.3"))
+_THROUGHPUT_FIELDS = ("msgs_per_sec", "ratelimited_per_msg")
+
+# Upper bounds (ms) of the histogram buckets; one more bucket holds everything above
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+_FIELDS = [f"b{i}" for i in range(len(BUCKET_BOUNDS_MS) + 1)] + ["count", "sum_ms"]
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram: O(1) memory, a bisect and a lock per
+    observation, and mergeable, so per-thread, per-invocation and stored
+    counts all add up the same way.
+    """
+
+    __slots__ = ("buckets", "count", "sum_ms", "_lock")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms: float):
+        i = bisect.bisect_left(BUCKET_BOUNDS_MS, ms)
+        with self._lock:
+            self.buckets[i] += 1
+            self.count += 1
+            self.sum_ms += ms
+
+    def merge(self, other: "Histogram"):
+        with self._lock:
+            for i, n in enumerate(other.buckets):
+                self.buckets[i] += n
+            self.count += other.count
+            self.sum_ms += other.sum_ms
+
+    def percentile(self, q: float) -> float:
+        """
+        Estimated q-th percentile (ms), interpolated within its bucket.
+        """
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                low = BUCKET_BOUNDS_MS[i - 1] if i else 0
+                high = BUCKET_BOUNDS_MS[i] if i < len(BUCKET_BOUNDS_MS) else low * 2
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return float(BUCKET_BOUNDS_MS[-1])
+
+    def mean(self) -> float:
+        return self.sum_ms / self.count if self.count else 0.0
+
+    def to_fields(self) -> Dict[str, float]:
+        fields: Dict[str, float] = {f"b{i}": n for i, n in enumerate(self.buckets) if n}
+        fields["count"] = self.count
+        fields["sum_ms"] = round(self.sum_ms, 3)
+        return fields
+
+    @classmethod
+    def from_buckets(cls, buckets: List[int]) -> "Histogram":
+        hist = cls()
+        for i, n in enumerate(buckets[:len(hist.buckets)]):
+            hist.buckets[i] = int(n)
+        hist.count = sum(hist.buckets)
+        return hist
+
+    @classmethod
+    def from_values(cls, values: List[Any]) -> "Histogram":
+        """
+        From an HMGET of histogram_fields(), in that order.
+        """
+        from api._redis import decode
+
+        hist = cls()
+        values = list(values) + [None] * (len(_FIELDS) - len(values))
+        nums = [float(decode(v)) if v is not None else 0.0 for v in values]
+        hist.buckets = [int(n) for n in nums[:len(hist.buckets)]]
+        hist.count = int(nums[len(hist.buckets)])
+        hist.sum_ms = nums[len(hist.buckets) + 1]
+        return hist
+
+
+class PostStats:
+    """
+    Post latencies and rate-limited retries of one delivery slice, shared by
+    the threads posting it.
+    """
+
+    __slots__ = ("latency", "retries", "_lock")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def retried(self):
+        with self._lock:
+            self.retries += 1
+
+
+def histogram_fields() -> List[str]:
+    return list(_FIELDS)
+
+
+def queue_histogram(batch, key: str, hist: Histogram, ttl: int = METRICS_TTL_SECONDS):
+    """
+    Queues adding `hist` into the histogram stored in hash `key`.
+    """
+    for field, value in hist.to_fields().items():
+        if field == "sum_ms":
+            batch.hincrbyfloat(key, field, value)
+        else:
+            batch.hincrby(key, field, int(value))
+    batch.expire(key, ttl)
+
+
+# KEYS: model hash. ARGV: msgs/s, rate-limited retries per message, weight of the
+# new sample, now (epoch seconds). The first sample is taken as is. Returns the new msgs/s.
+_THROUGHPUT_SCRIPT = """
+local current = redis.call('HMGET', KEYS[1], 'msgs_per_sec', 'ratelimited_per_msg')
+local rate, limited, weight = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+if current[1] then
+  rate = tonumber(current[1]) + weight * (rate - tonumber(current[1]))
+  limited = tonumber(current[2] or '0') + weight * (limited - tonumber(current[2] or '0'))
+end
+redis.call('HSET', KEYS[1], 'msgs_per_sec', tostring(rate), 'ratelimited_per_msg', tostring(limited), 'updated_at', ARGV[4])
+redis.call('HINCRBY', KEYS[1], 'samples', 1)
+return tostring(rate)
+"""
+
+
+# ---- process registry: flushed to Redis once per invocation ----
+
+_histograms: Dict[str, Histogram] = {}
+_counters: Dict[str, float] = {}
+_registry_lock = threading.Lock()
+
+
+def histogram(name: str) -> Histogram:
+    hist = _histograms.get(name)
+    if hist is None:
+        with _registry_lock:
+            hist = _histograms.setdefault(name, Histogram())
+    return hist
+
+
+def observe(name: str, ms: float):
+    histogram(name).observe(ms)
+
+
+def incr(name: str, amount: float = 1):
+    with _registry_lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+@contextmanager
+def timer(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - started) * 1000)
+
+
+def snapshot(reset: bool = False) -> Tuple[Dict[str, Histogram], Dict[str, float]]:
+    global _histograms, _counters
+    with _registry_lock:
+        hists, counters = _histograms, dict(_counters)
+        if reset:
+            _histograms, _counters = {}, {}
+        else:
+            hists = dict(hists)
+    return hists, counters
+
+
+def recorded(ignore: str = "") -> bool:
+    """
+    Whether anything but histograms named `ignore`* was recorded since the last flush.
+    """
+    with _registry_lock:
+        if _counters:
+            return True
+        return any(h.count and not (ignore and name.startswith(ignore)) for name, h in _histograms.items())
+
+
+def flush():
+    """
+    Adds everything recorded since the last flush to the shared histograms
+    (partner_alert_bot:metrics:hist:<name>) and counters in one pipelined request.
+    Best effort: on failure the numbers are dropped, never retried.
+    """
+    hists, counters = snapshot(reset=True)
+    hists = {name: h for name, h in hists.items() if h.count}
+    if not hists and not counters:
+        return
+    from api._redis import RedisBatch
+
+    # Untimed: its own timing would count as new metrics and make the next request flush again
+    batch = RedisBatch(timed=False)
+    for name, hist in hists.items():
+        queue_histogram(batch, f"{METRICS_KEY_PREFIX}:hist:{name}", hist)
+    if hists:
+        batch.sadd(HISTOGRAM_INDEX_KEY, *hists)
+        batch.expire(HISTOGRAM_INDEX_KEY, METRICS_TTL_SECONDS)
+    for name, value in counters.items():
+        batch.hincrbyfloat(COUNTERS_KEY, name, round(value, 3))
+    if counters:
+        batch.expire(COUNTERS_KEY, METRICS_TTL_SECONDS)
+    try:
+        batch.flush()
+    except Exception as e:
+        print(f"Metrics flush failed: {e}")
+
+
+# ---- per-broadcast performance ----
+
+def broadcast_perf(total: int, sent: int, seconds: float, post_ms: Histogram, throttled_seconds: float, retries: int) -> Dict[str, Any]:
+    """
+    Performance record of one finished broadcast: messages/s over its wall time,
+    post latency percentiles, time its posting threads spent waiting on the rate
+    limiter, and rate-limited retries.
+    """
+    return {
+        "channels": total,
+        "sent": sent,
+        "seconds": round(seconds, 2),
+        "msgs_per_sec": round(sent / seconds, 1) if seconds > 0 else 0.0,
+        "p50_ms": round(post_ms.percentile(50)),
+        "p95_ms": round(post_ms.percentile(95)),
+        "throttled_seconds": round(throttled_seconds, 1),
+        "retries": retries,
+        "buckets": post_ms.buckets,
+    }
+
+
+def perf_line(perf: Dict[str, Any]) -> str:
+    line = (
+        f"⏱ {perf['msgs_per_sec']} msgs/s over {perf['seconds']}s · "
+        f"post p95 {perf['p95_ms']} ms · throttled {perf['throttled_seconds']}s (summed over posting threads)"
+    )
+    if perf.get("retries"):
+        line += f" · {perf['retries']} retries"
+    return line
+
+
+def throughput_key(kind: str) -> str:
+    return f"{THROUGHPUT_KEY_PREFIX}:{kind}"
+
+
+def record_broadcast(job_id: str, kind: str, perf: Dict[str, Any]):
+    """
+    Stores a finished job's performance record and folds it into the throughput
+    model of its job type, in one pipelined request.
+    """
+    from api._redis import RedisBatch
+
+    record = dict(perf, job_id=job_id, kind=kind, finished_at=int(time.time()))
+    with RedisBatch() as batch:
+        batch.lpush(BROADCAST_PERF_KEY, json.dumps(record))
+        batch.ltrim(BROADCAST_PERF_KEY, 0, BROADCAST_PERF_SAMPLES - 1)
+        batch.expire(BROADCAST_PERF_KEY, METRICS_TTL_SECONDS)
+        if perf["sent"] and perf["seconds"] > 0:
+            batch.eval(
+                _THROUGHPUT_SCRIPT,
+                keys=[throughput_key(kind)],
+                args=[perf["sent"] / perf["seconds"], perf.get("retries", 0) / perf["sent"], THROUGHPUT_EWMA_ALPHA, int(time.time())],
+            )
+            batch.expire(throughput_key(kind), METRICS_TTL_SECONDS)
+
+
+def queue_throughput(batch, kind: str = "broadcast") -> int:
+    """
+    Queues reading the throughput model; pass the result to delivery_estimate().
+    Returns its index in the batch.
+    """
+    return batch.hmget(throughput_key(kind), *_THROUGHPUT_FIELDS)
+
+
+def delivery_estimate(values: Optional[List[Any]], channels: int) -> Optional[str]:
+    """
+    Expected time to deliver to `channels` channels at the modelled rate, or None
+    before the first measured job.
+    """
+    from api._redis import decode
+
+    rate, limited = (list(values or []) + [None] * 2)[:2]
+    if rate is None or not channels or float(decode(rate)) <= 0:
+        return None
+    seconds = channels / float(decode(rate))
+    when = f"about {seconds:.0f}s" if seconds < 90 else f"about {seconds / 60:.0f} min"
+    text = f"⏱ Estimated delivery: {when} ({float(decode(rate)):.1f} msgs/s over recent broadcasts"
+    limited = float(decode(limited)) if limited is not None else 0.0
+    if limited >= 0.01:
+        text += f", {limited:.0%} of posts rate-limited"
+    return text + ")"
+
+
+def recent_broadcasts(limit: int) -> List[Dict[str, Any]]:
+    from api._redis import decode, get_redis
+
+    raw = get_redis().lrange(BROADCAST_PERF_KEY, 0, max(1, limit) - 1) or []
+    return [json.loads(decode(r)) for r in raw]
+
+
+def stored_histograms(prefix: str = "") -> Dict[str, Histogram]:
+    """
+    The shared histograms whose name starts with `prefix` (one SMEMBERS, one pipeline).
+    """
+    from api._redis import RedisBatch, decode, get_redis
+
+    names = sorted(n for n in (decode(n) for n in (get_redis().smembers(HISTOGRAM_INDEX_KEY) or [])) if n.startswith(prefix))
+    if not names:
+        return {}
+    batch = RedisBatch()
+    for name in names:
+        batch.hmget(f"{METRICS_KEY_PREFIX}:hist:{name}", *_FIELDS)
+    return {name: Histogram.from_values(values or []) for name, values in zip(names, batch.flush())}
@@ -0,0 +1,208 @@
+from __future__ import annotations
+import json
+import os
+import re
+import urllib.parse
+from typing import Any, Dict, List, Tuple
+
+# A placeholder value is cut to this many characters; text limits reserve as much per slot
+PLACEHOLDER_MAX_CHARS = int(os.environ.get("PLACEHOLDER_MAX_CHARS", "50"))
+# Slack's limit for a button URL
+LINK_MAX_CHARS = 3000
+
+# Private-use delimiters: not whitespace, so text sanitizing (" ".join(split())) keeps them
+_SLOT_MARK = "\ue000slot:{}\ue000"
+_MARKED = re.compile("(\ue000slot:[^\ue000]*\ue000)")
+
+# {{field}} or {{field|default}}
+_PLACEHOLDER = re.compile(r"\{\{\s*([a-z][a-z0-9_]*)\s*(?:\|([^{}]*))?\}\}")
+
+
+def _escape(value: Any) -> bytes:
+    # JSON string contents (no surrounding quotes), same encoding as the template
+    return json.dumps(str(value), ensure_ascii=False)[1:-1].encode("utf-8")
+
+
+def slot_mark(name: str) -> str:
+    return _SLOT_MARK.format(name)
+
+
+def clip(text: str, limit: int) -> str:
+    """
+    Cuts `text` so it stays within `limit` characters once its slots are filled:
+    each slot mark counts as PLACEHOLDER_MAX_CHARS and is kept whole or dropped.
+    """
+    out, used = [], 0
+    for i, part in enumerate(_MARKED.split(text or "")):
+        # split() with a group: marks are the odd parts
+        size = PLACEHOLDER_MAX_CHARS if i % 2 else len(part)
+        if used + size > limit:
+            if not i % 2:
+                out.append(part[: limit - used])
+            break
+        out.append(part)
+        used += size
+    return "".join(out)
+
+
+class PayloadTemplate:
+    """
+    A Web API request body encoded to JSON once. Only the named slots (string
+    values such as "channel") change per request; render() splices the escaped
+    values between pre-encoded byte segments instead of re-serializing blocks.
+    `inline` slots are already marked (slot_mark) inside string values, such
+    as a placeholder in the message text, and may appear any number of times.
+    """
+
+    __slots__ = ("segments", "slots")
+
+    def __init__(self, fields: Dict[str, Any], slots: Tuple[str, ...] = ("channel",), inline: Tuple[str, ...] = ()):
+        fields = dict(fields)
+        for name in slots:
+            fields[name] = _SLOT_MARK.format(name)
+        names = tuple(slots) + tuple(inline)
+
+        encoded = json.dumps(fields, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+        segments = []
+        order = []
+        rest = encoded
+        while True:
+            positions = [(rest.find(_escape(_SLOT_MARK.format(n))), n) for n in names]
+            positions = [(pos, n) for pos, n in positions if pos >= 0]
+            if not positions:
+                break
+            pos, name = min(positions)
+            mark = _escape(_SLOT_MARK.format(name))
+            segments.append(rest[:pos])
+            order.append(name)
+            rest = rest[pos + len(mark):]
+        segments.append(rest)
+
+        object.__setattr__(self, "segments", tuple(segments))
+        object.__setattr__(self, "slots", tuple(order))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PayloadTemplate is immutable")
+
+    def render(self, **values: Any) -> bytes:
+        out = [self.segments[0]]
+        for name, segment in zip(self.slots, self.segments[1:]):
+            out.append(_escape(values[name]))
+            out.append(segment)
+        return b"".join(out)
+
+
+class Placeholders:
+    """
+    The {{field}} / {{field|default}} placeholders of a job's text. mark() swaps
+    each for an inline PayloadTemplate slot when the job's blocks are built, so
+    per channel only the values are spliced in (see values()).
+    """
+
+    __slots__ = ("slots",)
+
+    def __init__(self):
+        # slot name -> (metadata field, default, how the value is written: "text",
+        # "mrkdwn", "url" (percent-encoded into a link) or "link" (the whole link))
+        self.slots: Dict[str, Tuple[str, str, str]] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.slots)
+
+    def mark(self, text: str, url: bool = False, mrkdwn: bool = False) -> str:
+        """
+        Marks the placeholders of `text`. With `url`, values inside the link are
+        percent-encoded, and a placeholder that is the whole link takes a full
+        http(s) URL (see drops_link); with `mrkdwn`, &, < and > are escaped.
+        """
+        kind = _kind(text, url, mrkdwn)
+
+        def replace(match: re.Match) -> str:
+            spec = (match.group(1), (match.group(2) or "").strip(), kind)
+            for name, known in self.slots.items():
+                if known == spec:
+                    return slot_mark(name)
+            name = f"meta_{len(self.slots)}"
+            self.slots[name] = spec
+            return slot_mark(name)
+
+        if not text:
+            return text
+        return _PLACEHOLDER.sub(replace, text.strip() if kind == "link" else text)
+
+    @property
+    def fields(self) -> List[str]:
+        return sorted({field for field, _, _ in self.slots.values()})
+
+    @property
+    def links(self) -> bool:
+        """
+        Whether a placeholder is the whole link, so a channel may get no button.
+        """
+        return any(kind == "link" for _, _, kind in self.slots.values())
+
+    def values(self, meta: Dict[str, str]) -> Dict[str, str]:
+        return {name: _value(meta.get(field), default, kind) for name, (field, default, kind) in self.slots.items()}
+
+    def drops_link(self, values: Dict[str, str]) -> bool:
+        """
+        Whether neither the channel's value nor the default of the whole-link
+        placeholder is a URL: the message goes out without the button.
+        """
+        return any(kind == "link" and not values[name] for name, (_, _, kind) in self.slots.items())
+
+
+def _kind(text: str, url: bool, mrkdwn: bool) -> str:
+    if url:
+        return "link" if text and _PLACEHOLDER.fullmatch(text.strip()) else "url"
+    return "mrkdwn" if mrkdwn else "text"
+
+
+def _is_link(value: str) -> bool:
+    parsed = urllib.parse.urlsplit(value)
+    return (
+        parsed.scheme in ("http", "https")
+        and bool(parsed.netloc)
+        and len(value) <= LINK_MAX_CHARS
+        and not any(c.isspace() or ord(c) < 32 for c in value)
+    )
+
+
+def _escape_mrkdwn(value: str) -> str:
+    # Escaped, and cut so the escaped text stays within PLACEHOLDER_MAX_CHARS
+    out, used = [], 0
+    for c in value:
+        c = {"&": "&amp;", "<": "&lt;", ">": "&gt;"}.get(c, c)
+        if used + len(c) > PLACEHOLDER_MAX_CHARS:
+            break
+        out.append(c)
+        used += len(c)
+    return "".join(out)
+
+
+def _value(value: str, default: str, kind: str) -> str:
+    if kind == "link":
+        # Never cut or encoded; empty when there is no usable URL
+        return next((v.strip() for v in (value, default) if v and _is_link(v.strip())), "")
+    value = value or default
+    if kind == "mrkdwn":
+        return _escape_mrkdwn(value)
+    value = value[:PLACEHOLDER_MAX_CHARS]
+    return urllib.parse.quote(value) if kind == "url" else value
+
+
+def placeholder_fields(text: str) -> List[str]:
+    return sorted({m.group(1) for m in _PLACEHOLDER.finditer(text or "")})
+
+
+def fill_placeholders(text: str, meta: Dict[str, str], url: bool = False) -> str:
+    """
+    Fills placeholders directly (defaults, else the field name), e.g. for a preview.
+    A placeholder that is the whole link and has no URL to fill in leaves "".
+    """
+    if not text:
+        return text
+    kind = _kind(text, url, False)
+    text = text.strip() if kind == "link" else text
+    return _PLACEHOLDER.sub(lambda m: _value(meta.get(m.group(1)), (m.group(2) or "").strip() or m.group(1), kind), text)
@@ -0,0 +1,202 @@
+from __future__ import annotations
+import os
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+from api._redis import RedisBatch, get_redis
+
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "60"))
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "600"))
+
+JOB_LIST_KEY = "partner_alert_bot:jobs"
+PROCESSING_LIST_KEY = "partner_alert_bot:jobs:processing"
+LEASES_KEY = "partner_alert_bot:jobs:leases"
+
+# Priority lanes, highest first. Each lane has its own pending list and lease zset;
+# "normal" keeps the original keys.
+LANES = ("high", "normal")
+CATEGORY_LANES = {"Incident": "high", "Action required": "high"}
+
+
+def lane_for(category: Optional[str], kind: str = "broadcast") -> str:
+    """
+    The lane of a job. Only chat.postMessage work is prioritized: edits and
+    retractions are paced by other Slack rate buckets, so a Release yielding to
+    them would free none of the budget they use.
+    """
+    if kind != "broadcast":
+        return "normal"
+    return CATEGORY_LANES.get(category or "", "normal")
+
+
+def lane_keys(lane: str) -> Tuple[str, str]:
+    """
+    (pending list, lease zset) of a lane.
+    """
+    if lane == "normal":
+        return JOB_LIST_KEY, LEASES_KEY
+    return f"{JOB_LIST_KEY}:{lane}", f"{LEASES_KEY}:{lane}"
+
+
+# Items are LPUSHed and consumed from the right (FIFO within a lane). Claimed items
+# sit in the processing list with a lease (zset score = expiry, ms) in their lane's
+# lease zset until acked or requeued.
+
+# KEYS: idempotency key, pending list. ARGV: item, ttl. Returns 1 if queued.
+_ENQUEUE_SCRIPT = """
+if redis.call('SET', KEYS[1], '1', 'NX', 'EX', ARGV[2]) then
+  redis.call('LPUSH', KEYS[2], ARGV[1])
+  return 1
+end
+return 0
+"""
+
+# KEYS: processing, then (pending, leases) for each lane, highest first.
+# ARGV: now_ms, lease_ms.
+# Requeues items whose lease expired into their own lane, then claims the next
+# item from the highest lane that has one.
+# Returns {item or false, lane index (1-based), items still pending, items reaped,
+# items pending or leased in the first lane}.
+_CLAIM_SCRIPT = """
+local now = tonumber(ARGV[1])
+local reaped = 0
+for i = 2, #KEYS, 2 do
+  local expired = redis.call('ZRANGEBYSCORE', KEYS[i + 1], '-inf', now)
+  for _, item in ipairs(expired) do
+    if redis.call('LREM', KEYS[1], 1, item) > 0 then
+      redis.call('RPUSH', KEYS[i], item)
+    end
+    redis.call('ZREM', KEYS[i + 1], item)
+  end
+  reaped = reaped + #expired
+end
+local item, lane = false, 0
+for i = 2, #KEYS, 2 do
+  item = redis.call('LMOVE', KEYS[i], KEYS[1], 'RIGHT', 'LEFT')
+  if item then
+    redis.call('ZADD', KEYS[i + 1], now + tonumber(ARGV[2]), item)
+    lane = i / 2
+    break
+  end
+end
+local pending = 0
+for i = 2, #KEYS, 2 do pending = pending + redis.call('LLEN', KEYS[i]) end
+local top = redis.call('LLEN', KEYS[2]) + redis.call('ZCARD', KEYS[3])
+return {item, lane, pending, reaped, top}
+"""
+
+# KEYS: pending, processing, leases of the item's lane. ARGV: item.
+# Hands a claimed item back so it is consumed next within its lane.
+_REQUEUE_SCRIPT = """
+redis.call('ZREM', KEYS[3], ARGV[1])
+if redis.call('LREM', KEYS[2], 1, ARGV[1]) > 0 then
+  redis.call('RPUSH', KEYS[1], ARGV[1])
+  return 1
+end
+return 0
+"""
+
+
+class Claim(NamedTuple):
+    item: Optional[str]
+    lane: str
+    pending: int
+    # Items waiting in or being worked on from the highest lane, this one included
+    top_lane_load: int
+
+
+redis = get_redis()
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def enqueue(
+    item: str,
+    idempotency_key: Optional[str] = None,
+    batch: Optional[RedisBatch] = None,
+    lane: str = "normal",
+):
+    """
+    Queues an item in `lane`. With an idempotency key, repeats within IDEMPOTENCY_TTL_SECONDS
+    (e.g. a double-clicked Send) are dropped. Queued on `batch` when one is given.
+    """
+    target = batch if batch is not None else redis
+    pending_key, _ = lane_keys(lane)
+    if not idempotency_key:
+        return target.lpush(pending_key, item)
+    return target.eval(
+        _ENQUEUE_SCRIPT,
+        keys=[f"{JOB_LIST_KEY}:idem:{idempotency_key}", pending_key],
+        args=[item, IDEMPOTENCY_TTL_SECONDS],
+    )
+
+
+def enqueue_next(items: List[str], batch: Optional[RedisBatch] = None, lane: str = "normal"):
+    """
+    Queues items at the consuming end of `lane`, ahead of everything already waiting.
+    """
+    target = batch if batch is not None else redis
+    return target.rpush(lane_keys(lane)[0], *items)
+
+
+def _queue_live_leases(batch: RedisBatch, lane: str) -> int:
+    # Leases of workers that died stay in the zset until the next claim() reaps them
+    return batch.zcount(lane_keys(lane)[1], _now_ms() + 1, "+inf")
+
+
+def active_leases() -> int:
+    batch = RedisBatch()
+    for lane in LANES:
+        _queue_live_leases(batch, lane)
+    return sum(int(n or 0) for n in batch.flush())
+
+
+def claim(lease_seconds: int = JOB_LEASE_SECONDS) -> Claim:
+    """
+    Reaps expired leases and leases the next item from the highest lane with one,
+    in one round trip.
+    """
+    keys = [PROCESSING_LIST_KEY]
+    for lane in LANES:
+        keys += lane_keys(lane)
+    item, lane_idx, pending, reaped, top_load = redis.eval(
+        _CLAIM_SCRIPT,
+        keys=keys,
+        args=[_now_ms(), lease_seconds * 1000],
+    )
+    if reaped:
+        print(f"Requeued {reaped} job(s) with expired leases")
+    lane = LANES[int(lane_idx) - 1] if lane_idx else LANES[-1]
+    return Claim(item or None, lane, int(pending or 0), int(top_load or 0))
+
+
+def extend_lease(item: str, lease_seconds: int = JOB_LEASE_SECONDS, batch: Optional[RedisBatch] = None, lane: str = "normal"):
+    target = batch if batch is not None else redis
+    target.zadd(lane_keys(lane)[1], {item: _now_ms() + lease_seconds * 1000}, xx=True)
+
+
+def queue_lane_load(batch: RedisBatch, lane: str) -> Tuple[int, int]:
+    """
+    Queues counting a lane's waiting items and unexpired leases on `batch`;
+    returns their result indexes. Their sum is the lane's waiting plus in-flight items.
+    """
+    return batch.llen(lane_keys(lane)[0]), _queue_live_leases(batch, lane)
+
+
+def ack(item: str, batch: Optional[RedisBatch] = None, lane: str = "normal"):
+    """
+    Drops a finished item; queued on `batch` when one is given.
+    """
+    own = batch is None
+    batch = RedisBatch() if own else batch
+    batch.lrem(PROCESSING_LIST_KEY, 1, item)
+    batch.zrem(lane_keys(lane)[1], item)
+    if own:
+        batch.flush()
+
+
+def requeue(item: str, lane: str = "normal"):
+    pending_key, leases_key = lane_keys(lane)
+    redis.eval(_REQUEUE_SCRIPT, keys=[pending_key, PROCESSING_LIST_KEY, leases_key], args=[item])
@@ -0,0 +1,132 @@
+from __future__ import annotations
+import threading
+import time
+from typing import Optional
+
+from api import _metrics
+from api._delivery import RateLimiter
+from api._redis import get_redis
+
+RATELIMIT_KEY_PREFIX = "partner_alert_bot:ratelimit"
+
+# Slack's documented per-workspace tiers, in requests/second.
+# chat.postMessage is "special" and paced by BROADCAST_RATE_PER_SECOND instead.
+TIER_RATES = {
+    "tier2": 20 / 60,
+    "tier3": 50 / 60,
+    "tier4": 100 / 60,
+}
+
+METHOD_TIERS = {
+    "chat.postMessage": "special",
+    "chat.update": "tier3",
+    "chat.delete": "tier3",
+    "users.conversations": "tier3",
+    "files.getUploadURLExternal": "tier4",
+    "files.completeUploadExternal": "tier4",
+    "files.delete": "tier3",
+}
+
+# Both scripts read the time from the Redis server, not the caller, so the
+# schedule every instance shares doesn't depend on their clocks agreeing.
+_SERVER_NOW_MS = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+"""
+
+# GCRA: KEYS[1] = theoretical arrival time (ms), KEYS[2] = pause-until (ms)
+# ARGV = emission interval ms, burst tolerance ms
+# Returns how many ms the caller must wait; 0 means the request may go now.
+_GCRA_SCRIPT = _SERVER_NOW_MS + """
+local pause = tonumber(redis.call('GET', KEYS[2]) or '0')
+if pause > now then return pause - now end
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tat < now then tat = now end
+if tat - tolerance > now then return math.ceil(tat - tolerance - now) end
+local new_tat = tat + interval
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil(new_tat - now + tolerance) + 1000)
+return 0
+"""
+
+# KEYS[1] = pause-until (ms); ARGV = pause ms, ttl_ms. Only ever extends the pause.
+_PAUSE_SCRIPT = _SERVER_NOW_MS + """
+local until_ms = now + tonumber(ARGV[1])
+local cur = tonumber(redis.call('GET', KEYS[1]) or '0')
+if until_ms > cur then
+  redis.call('SET', KEYS[1], tostring(until_ms), 'PX', ARGV[2])
+end
+return 1
+"""
+
+redis = get_redis()
+
+
+class DistributedRateLimiter:
+    """
+    GCRA limiter kept in Redis and keyed by workspace + Slack method tier, so every
+    concurrent worker invocation shares one budget. A Retry-After seen by any caller
+    pauses all of them. Same acquire()/pause() interface as the local RateLimiter,
+    which it falls back to if Redis is unavailable. `throttled_seconds` adds up
+    the time callers spent waiting in acquire().
+    """
+
+    def __init__(self, team_id: str, tier: str, rate: float, burst: Optional[int] = None):
+        self.rate = max(float(rate), 0.001)
+        burst = burst or max(1, int(self.rate))
+        self._interval_ms = 1000.0 / self.rate
+        self._tolerance_ms = self._interval_ms * (burst - 1)
+        self._tat_key = f"{RATELIMIT_KEY_PREFIX}:{team_id or 'default'}:{tier}"
+        self._pause_key = f"{self._tat_key}:pause_until"
+        self._fallback = RateLimiter(self.rate, burst)
+        self._paused_until = 0.0
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+        with self._lock:
+            self.throttled_seconds += seconds
+        _metrics.incr("ratelimit.throttled_seconds", seconds)
+
+    def _sleep_local_pause(self) -> None:
+        with self._lock:
+            wait = self._paused_until - time.monotonic()
+        if wait > 0:
+            self._sleep(wait)
+
+    def acquire(self):
+        while True:
+            self._sleep_local_pause()
+            try:
+                wait_ms = int(redis.eval(
+                    _GCRA_SCRIPT,
+                    keys=[self._tat_key, self._pause_key],
+                    args=[self._interval_ms, self._tolerance_ms],
+                ) or 0)
+            except Exception as e:
+                print(f"Rate limiter unavailable, pacing locally: {e}")
+                self._fallback.acquire()
+                return
+            if wait_ms <= 0:
+                return
+            self._sleep(wait_ms / 1000.0)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._fallback.pause(seconds)
+        try:
+            redis.eval(_PAUSE_SCRIPT, keys=[self._pause_key], args=[int(seconds * 1000), int(seconds * 1000) + 1000])
+        except Exception as e:
+            print(f"Could not share Retry-After pause: {e}")
+
+
+def limiter_for(method: str, team_id: str, special_rate: float) -> DistributedRateLimiter:
+    """
+    Returns the shared limiter for a Slack Web API method.
+    """
+    tier = METHOD_TIERS.get(method, "tier3")
+    rate = special_rate if tier == "special" else TIER_RATES[tier]
+    return DistributedRateLimiter(team_id, tier, rate)
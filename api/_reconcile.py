@@ -0,0 +1,114 @@
+from __future__ import annotations
+import json
+import os
+import time
+from typing import Any, Dict, List, Tuple
+
+from api._channels import CHANNEL_HEALTH_KEY, CHANNEL_SET_KEY, RECONCILE_SEEN_KEY, health_fields, stream_channels_into
+from api._redis import RedisBatch, get_redis
+
+RECONCILE_PAGE_SIZE = int(os.environ.get("RECONCILE_PAGE_SIZE", "200"))
+RECONCILE_TTL_SECONDS = 86400
+
+RECONCILE_STATE_KEY = "partner_alert_bot:reconcile"
+RECONCILE_STALE_KEY = "partner_alert_bot:reconcile:stale"
+
+# KEYS: seen set, channel set, state hash. ARGV: next cursor, ttl, channel ids...
+# SADD only adds members that are missing, so its result is exactly this page's
+# diff against the tracked set. Returns the number of channels added.
+_PAGE_SCRIPT = """
+local ids = {}
+for i = 3, #ARGV do ids[#ids + 1] = ARGV[i] end
+local added = 0
+if #ids > 0 then
+  redis.call('SADD', KEYS[1], unpack(ids))
+  added = redis.call('SADD', KEYS[2], unpack(ids))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('HSET', KEYS[3], 'cursor', ARGV[1])
+redis.call('HINCRBY', KEYS[3], 'added', added)
+redis.call('HINCRBY', KEYS[3], 'pages', 1)
+redis.call('EXPIRE', KEYS[3], ARGV[2])
+return added
+"""
+
+redis = get_redis()
+
+
+def reconcile_item(requested_by: str = "") -> str:
+    return json.dumps({"type": "reconcile", "requested_by": requested_by})
+
+
+def _list_page(client, limiter, cursor: str) -> Tuple[List[str], str]:
+    limiter.acquire()
+    resp = client.users_conversations(
+        types="public_channel,private_channel",
+        exclude_archived=True,
+        limit=RECONCILE_PAGE_SIZE,
+        cursor=cursor or None,
+    )
+    ids = [c["id"] for c in (resp.get("channels") or [])]
+    next_cursor = (resp.get("response_metadata") or {}).get("next_cursor") or ""
+    return ids, next_cursor
+
+
+def _prune() -> int:
+    """
+    Removes tracked channels users.conversations never listed. Skipped when the
+    listing came back empty, so an API or token problem can't wipe the set.
+    """
+    if not redis.scard(RECONCILE_SEEN_KEY):
+        return 0
+    stale = int(redis.sdiffstore(RECONCILE_STALE_KEY, CHANNEL_SET_KEY, RECONCILE_SEEN_KEY) or 0)
+    if stale:
+        def remove(batch: RedisBatch, channels: List[str]):
+            batch.srem(CHANNEL_SET_KEY, *channels)
+            batch.hdel(CHANNEL_HEALTH_KEY, *health_fields(channels))
+
+        stream_channels_into(remove, key=RECONCILE_STALE_KEY)
+    return stale
+
+
+def run_reconcile(client, limiter, deadline: float) -> Tuple[bool, Dict[str, Any]]:
+    """
+    Pages through users.conversations from the saved cursor, adding channels the
+    bot is in but doesn't track, until `deadline` (time.monotonic()). After the
+    last page, removes tracked channels that were not listed.
+    Returns (finished, stats); unfinished runs resume from Redis on the next call.
+    """
+    state = redis.hgetall(RECONCILE_STATE_KEY) or {}
+    if not state:
+        redis.delete(RECONCILE_SEEN_KEY, RECONCILE_STALE_KEY)
+        redis.hset(RECONCILE_STATE_KEY, values={"cursor": "", "started_at": str(int(time.time()))})
+    cursor = state.get("cursor") or ""
+    listed_all = state.get("done") == "1"
+
+    page_seconds = 0.0
+    while not listed_all and time.monotonic() + page_seconds < deadline:
+        page_started = time.monotonic()
+        ids, cursor = _list_page(client, limiter, cursor)
+        redis.eval(
+            _PAGE_SCRIPT,
+            keys=[RECONCILE_SEEN_KEY, CHANNEL_SET_KEY, RECONCILE_STATE_KEY],
+            args=[cursor, RECONCILE_TTL_SECONDS, *ids],
+        )
+        listed_all = not cursor
+        page_seconds = time.monotonic() - page_started
+
+    if not listed_all:
+        return False, {"pages": int((redis.hget(RECONCILE_STATE_KEY, "pages") or 0))}
+
+    redis.hset(RECONCILE_STATE_KEY, "done", "1")
+    removed = _prune()
+
+    batch = RedisBatch()
+    batch.hmget(RECONCILE_STATE_KEY, "added", "pages")
+    batch.scard(CHANNEL_SET_KEY)
+    batch.delete(RECONCILE_STATE_KEY, RECONCILE_SEEN_KEY, RECONCILE_STALE_KEY)
+    (added, pages), tracked, _ = batch.flush()
+    return True, {
+        "added": int(added or 0),
+        "removed": removed,
+        "pages": int(pages or 0),
+        "tracked": int(tracked or 0),
+    }
@@ -1,15 +1,158 @@
+from __future__ import annotations
 import os
-from upstash_redis import Redis
+import threading
+import time
+from typing import Any, List, Optional, Tuple
 
+from api import _metrics
 
-def get_redis() -> Redis:
-    """
-    Uses Vercel KV env vars (KV_*) or older STORAGE_KV_* aliases.
-    """
+_client: Optional["_TimedRedis"] = None
+
+
+def _record(command: str, elapsed_ms: float):
+    _metrics.observe(f"redis.{command}", elapsed_ms)
+
+
+class _TimedPipeline:
+    def __init__(self, pipe, name: str):
+        self._pipe = pipe
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        return getattr(self._pipe, attr)
+
+    def exec(self) -> List[Any]:
+        started = time.perf_counter()
+        try:
+            return self._pipe.exec()
+        finally:
+            _record(self._name, (time.perf_counter() - started) * 1000)
+
+
+def _connect():
     url = os.environ.get("KV_REST_API_URL") or os.environ.get("STORAGE_KV_REST_API_URL")
     token = os.environ.get("KV_REST_API_TOKEN") or os.environ.get("STORAGE_KV_REST_API_TOKEN")
 
     if not url or not token:
         raise RuntimeError("Missing KV_REST_API_URL / KV_REST_API_TOKEN in env.")
 
-    return Redis(url=url, token=token)
\ No newline at end of file
+    # Imported on first use: keeps the HTTP client stack off the cold-start path
+    from upstash_redis import Redis
+
+    return Redis(url=url, token=token)
+
+
+class _TimedRedis:
+    """
+    Thin proxy over upstash_redis.Redis that records the latency of every call.
+    The underlying client is created on the first command, not at import.
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._conn_lock = threading.Lock()
+
+    @property
+    def _client(self):
+        if self._conn is None:
+            with self._conn_lock:
+                if self._conn is None:
+                    self._conn = _connect()
+        return self._conn
+
+    def pipeline(self, timed: bool = True):
+        pipe = self._client.pipeline()
+        return _TimedPipeline(pipe, "pipeline") if timed else pipe
+
+    def multi(self, timed: bool = True):
+        pipe = self._client.multi()
+        return _TimedPipeline(pipe, "multi") if timed else pipe
+
+    def __getattr__(self, attr: str):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        fn = getattr(self._client, attr)
+        if not callable(fn):
+            return fn
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(attr, (time.perf_counter() - started) * 1000)
+
+        return timed
+
+
+def decode(raw) -> str:
+    """
+    A reply value as text: Upstash answers with str, but bytes are accepted too.
+    """
+    return raw.decode("utf-8") if isinstance(raw, (bytes, bytearray)) else str(raw)
+
+
+def get_redis() -> _TimedRedis:
+    """
+    Uses Vercel KV env vars (KV_*) or older STORAGE_KV_* aliases.
+    One client per process, so warm invocations reuse its keep-alive HTTP session.
+    Cheap to call at import time: the connection is set up on first use.
+    """
+    global _client
+    if _client is None:
+        _client = _TimedRedis()
+    return _client
+
+
+class RedisBatch:
+    """
+    Queues Redis commands and sends them as one Upstash pipeline (or MULTI/EXEC
+    transaction) call:
+
+        batch = RedisBatch()
+        batch.lpush(key, value)
+        batch.set(other, "1", ex=60)
+        results = batch.flush()
+
+    Each queued call returns the index of its result in `flush()`'s list, which
+    also stays available as `results` after flushing.
+    Used as a context manager, the batch is flushed on a clean exit. With
+    `timed=False` the call is left out of the redis.* timings.
+    """
+
+    def __init__(self, transaction: bool = False, timed: bool = True):
+        self.transaction = transaction
+        self.timed = timed
+        self.results: List[Any] = []
+        self._commands: List[Tuple[str, tuple, dict]] = []
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    def __getattr__(self, command: str):
+        if command.startswith("_"):
+            raise AttributeError(command)
+
+        def queue(*args, **kwargs) -> int:
+            self._commands.append((command, args, kwargs))
+            return len(self._commands) - 1
+
+        return queue
+
+    def flush(self) -> List[Any]:
+        if not self._commands:
+            return []
+        redis = get_redis()
+        pipe = redis.multi(timed=self.timed) if self.transaction else redis.pipeline(timed=self.timed)
+        for command, args, kwargs in self._commands:
+            getattr(pipe, command)(*args, **kwargs)
+        self._commands = []
+        self.results = pipe.exec()
+        return self.results
+
+    def __enter__(self) -> "RedisBatch":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
@@ -0,0 +1,145 @@
+from __future__ import annotations
+import re
+import secrets
+from typing import Any, Dict, List, Optional, Tuple
+
+from api._redis import RedisBatch, decode, get_redis
+from api._channels import CHANNEL_SET_KEY, cached_channel_count
+
+SEGMENT_KEY_PREFIX = "partner_alert_bot:segment"
+# Names of every segment that has (or had) members, for the draft modal picker
+SEGMENT_INDEX_KEY = "partner_alert_bot:segments"
+AUDIENCE_KEY_PREFIX = "partner_alert_bot:audience"
+# A job's computed audience only has to outlive the snapshot taken right after
+AUDIENCE_TTL_SECONDS = 600
+SEGMENT_NAME_MAX = 40
+
+# Slack channel mentions (<#C123|name>, <#C123>) or bare channel ids
+_CHANNEL_REF = re.compile(r"<#([CG][A-Z0-9]+)(?:\|[^>]*)?>|\b([CG][A-Z0-9]{6,})\b")
+
+redis = get_redis()
+
+
+def segment_key(name: str) -> str:
+    return f"{SEGMENT_KEY_PREFIX}:{name}"
+
+
+def normalize_segment(name: str) -> str:
+    """
+    Segment names are lower-case slugs ("EMEA Tier 1" -> "emea-tier-1").
+    """
+    slug = re.sub(r"[^a-z0-9_-]+", "-", (name or "").strip().lower()).strip("-")
+    return slug[:SEGMENT_NAME_MAX]
+
+
+def parse_channel_refs(text: str) -> List[str]:
+    seen: List[str] = []
+    for mention, bare in _CHANNEL_REF.findall(text or ""):
+        ch = mention or bare
+        if ch not in seen:
+            seen.append(ch)
+    return seen
+
+
+def list_segments() -> List[str]:
+    return sorted(decode(s) for s in (redis.smembers(SEGMENT_INDEX_KEY) or []))
+
+
+def segment_sizes(names: List[str]) -> Dict[str, int]:
+    batch = RedisBatch()
+    for name in names:
+        batch.scard(segment_key(name))
+    return {name: int(n or 0) for name, n in zip(names, batch.flush())}
+
+
+def tag_channels(segment: str, channels: List[str]) -> int:
+    """
+    Adds channels to a segment. Returns how many were not in it yet.
+    """
+    batch = RedisBatch(transaction=True)
+    added_idx = batch.sadd(segment_key(segment), *channels)
+    batch.sadd(SEGMENT_INDEX_KEY, segment)
+    return int(batch.flush()[added_idx] or 0)
+
+
+def untag_channels(segment: str, channels: List[str]) -> Tuple[int, int]:
+    """
+    Removes channels from a segment; an emptied segment leaves the picker.
+    Returns (channels removed, channels left in the segment).
+    """
+    batch = RedisBatch(transaction=True)
+    removed_idx = batch.srem(segment_key(segment), *channels)
+    left_idx = batch.scard(segment_key(segment))
+    results = batch.flush()
+    removed, left = int(results[removed_idx] or 0), int(results[left_idx] or 0)
+    if not left:
+        redis.srem(SEGMENT_INDEX_KEY, segment)
+    return removed, left
+
+
+def is_targeted(audience: Optional[Dict[str, Any]]) -> bool:
+    audience = audience or {}
+    return bool(audience.get("segments") or audience.get("exclude"))
+
+
+def describe_audience(audience: Dict[str, Any]) -> str:
+    parts = []
+    segments = audience.get("segments") or []
+    if segments:
+        joiner = " and " if audience.get("match") == "all" else " or "
+        parts.append(joiner.join(f"`{s}`" for s in segments))
+    else:
+        parts.append("all tracked channels")
+    if audience.get("exclude"):
+        parts.append("excluding " + ", ".join(f"`{s}`" for s in audience["exclude"]))
+    return " ".join(parts)
+
+
+def queue_audience(batch: RedisBatch, dest: str, audience: Dict[str, Any], ttl: int) -> int:
+    """
+    Queues the set algebra that stores an audience in `dest`: the tracked channels
+    that are in any (SUNIONSTORE) or all (SINTERSTORE) of the chosen segments, minus
+    the excluded segments (SDIFFSTORE). Everything runs inside Redis, so only the
+    count ever comes back. Returns the index of the final SCARD.
+    """
+    include = [segment_key(s) for s in audience.get("segments") or []]
+    exclude = [segment_key(s) for s in audience.get("exclude") or []]
+
+    if not include:
+        batch.sunionstore(dest, CHANNEL_SET_KEY)
+    elif audience.get("match") == "all":
+        batch.sinterstore(dest, CHANNEL_SET_KEY, *include)
+    else:
+        batch.sunionstore(dest, *include)
+        # Channels the bot has left stay tagged; only tracked ones are targeted
+        batch.sinterstore(dest, dest, CHANNEL_SET_KEY)
+    if exclude:
+        batch.sdiffstore(dest, dest, *exclude)
+    batch.expire(dest, ttl)
+    return batch.scard(dest)
+
+
+def audience_count(audience: Optional[Dict[str, Any]], batch: Optional[RedisBatch] = None) -> int:
+    """
+    Exact number of channels a draft would reach (SCARD of the computed set),
+    in one transaction that discards the set again. Untargeted drafts use the
+    cached size of the tracked set. Extra commands can be sent along on `batch`
+    (read their results from batch.results).
+    """
+    if not is_targeted(audience):
+        return cached_channel_count(batch=batch)
+    dest = f"{AUDIENCE_KEY_PREFIX}:preview:{secrets.token_hex(6)}"
+    batch = batch if batch is not None else RedisBatch(transaction=True)
+    count_idx = queue_audience(batch, dest, audience, AUDIENCE_TTL_SECONDS)
+    batch.delete(dest)
+    return int(batch.flush()[count_idx] or 0)
+
+
+def build_audience(dest: str, audience: Dict[str, Any]) -> int:
+    """
+    Stores a job's audience in `dest` (kept AUDIENCE_TTL_SECONDS) for
+    snapshot_targets(..., source_key=dest) to stream. Returns its size.
+    """
+    batch = RedisBatch(transaction=True)
+    count_idx = queue_audience(batch, dest, audience, AUDIENCE_TTL_SECONDS)
+    return int(batch.flush()[count_idx] or 0)
@@ -0,0 +1,81 @@
+from __future__ import annotations
+import http.client
+import json
+import os
+import select
+import threading
+import urllib.parse
+from typing import Any, Dict, Tuple
+
+SLACK_API_BASE_URL = os.environ.get("SLACK_API_BASE_URL", "https://slack.com/api").rstrip("/")
+
+_base = urllib.parse.urlparse(SLACK_API_BASE_URL)
+_local = threading.local()
+
+
+def _connection() -> http.client.HTTPConnection:
+    """
+    One keep-alive connection per delivery thread, reused across slices and
+    warm invocations.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and conn.sock is not None and select.select([conn.sock], [], [], 0)[0]:
+        # Readable while idle: Slack closed the keep-alive connection
+        _reset()
+        conn = None
+    if conn is None:
+        cls = http.client.HTTPSConnection if _base.scheme == "https" else http.client.HTTPConnection
+        conn = cls(_base.netloc, timeout=10)
+        _local.conn = conn
+    return conn
+
+
+def _reset():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+    _local.conn = None
+
+
+def post_json(method: str, body: bytes, token: str) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    POSTs a pre-encoded JSON body to a Web API method.
+    Returns (response JSON, lower-cased response headers). A 429 comes back as
+    {"ok": False, "error": "ratelimited"} with its Retry-After header.
+    """
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json; charset=utf-8",
+    }
+    path = f"{_base.path}/{method}"
+
+    for attempt in range(2):
+        conn = _connection()
+        try:
+            conn.request("POST", path, body=body, headers=headers)
+        except TimeoutError:
+            _reset()
+            raise
+        except (http.client.HTTPException, ConnectionError, OSError):
+            # Not sent (stale keep-alive connection): reconnect once
+            _reset()
+            if attempt:
+                raise
+            continue
+        try:
+            resp = conn.getresponse()
+            data = resp.read()
+            break
+        except (http.client.HTTPException, OSError):
+            # The request went out and may have been handled (e.g. a message
+            # posted); never resend it
+            _reset()
+            raise
+
+    resp_headers = {k.lower(): v for k, v in resp.getheaders()}
+    if resp.status == 429:
+        return {"ok": False, "error": "ratelimited"}, resp_headers
+    try:
+        return json.loads(data.decode("utf-8")), resp_headers
+    except ValueError:
+        return {"ok": False, "error": f"http_{resp.status}"}, resp_headers
@@ -0,0 +1,37 @@
+import os
+import urllib.parse
+from typing import Callable, Optional
+
+# Set by a long-running host (see server.py) to run the worker in-process
+_local_trigger: Optional[Callable[[], None]] = None
+
+
+def set_worker_trigger(trigger: Optional[Callable[[], None]]):
+    """
+    Routes trigger_worker_async() to `trigger` instead of an HTTP request to
+    /api/worker. `trigger` must return quickly; None restores the HTTP trigger.
+    """
+    global _local_trigger
+    _local_trigger = trigger
+
+
+def trigger_worker_async():
+    """
+    Wakes /api/worker with a short-lived GET. Best effort: the queued job stays
+    in Redis if this fails and is picked up by the next trigger.
+    """
+    if _local_trigger is not None:
+        _local_trigger()
+        return
+
+    base_url = os.environ["PUBLIC_BASE_URL"].rstrip("/")
+    secret = os.environ["WORKER_SECRET"]
+    url = f"{base_url}/api/worker?secret={urllib.parse.quote(secret)}"
+    # Deferred: urllib.request pulls in http.client, email and ssl setup
+    import urllib.request
+
+    try:
+        req = urllib.request.Request(url, method="GET")
+        urllib.request.urlopen(req, timeout=2).read()
+    except Exception:
+        pass
@@ -1,62 +1,26 @@
-from http.server import BaseHTTPRequestHandler
 import os
 import json
 import time
 import urllib.parse
-import urllib.request
-
-from slack_sdk import WebClient
 
+from api._http import JSONHandler
+from api._clients import call_slack
 from api._slack_sig import verify_slack_signature
-from api._redis import get_redis
+from api._redis import RedisBatch
 from api._blocks import build_broadcast_blocks, draft_modal_view, review_modal_view
+from api._auth import check_access, set_cooldown
+from api._deferred import Deferred, record_ack_latency
+from api._segments import audience_count, describe_audience, is_targeted, list_segments
+from api._jobs import load_job, new_job_id
+from api._metrics import delivery_estimate, queue_throughput
+from api._payload import fill_placeholders, placeholder_fields
+from api._attachments import file_from_submission
+from api._queue import enqueue, lane_for
+from api._trigger import trigger_worker_async
 
 SLACK_SIGNING_SECRET = os.environ["SLACK_SIGNING_SECRET"].encode("utf-8")
-SLACK_BOT_TOKEN = os.environ["SLACK_BOT_TOKEN"]
 
 MAX_BROADCAST_CHANNELS = int(os.environ.get("MAX_BROADCAST_CHANNELS", "500"))
-BROADCAST_COOLDOWN_SECONDS = int(os.environ.get("BROADCAST_COOLDOWN_SECONDS", "0"))
-
-WORKER_SECRET = os.environ["WORKER_SECRET"]
-PUBLIC_BASE_URL = os.environ["PUBLIC_BASE_URL"].rstrip("/")
-
-redis = get_redis()
-client = WebClient(token=SLACK_BOT_TOKEN)
-
-CHANNEL_SET_KEY = "partner_alert_bot:channels"
-JOB_LIST_KEY = "partner_alert_bot:jobs"
-ALLOWED_BROADCASTERS_KEY = "partner_alert_bot:allowed_broadcasters"
-
-
-def user_allowed(user_id: str) -> bool:
-    try:
-        allowed_users = redis.smembers(ALLOWED_BROADCASTERS_KEY)
-        # If no allowlist is set in Redis, allow anyone (for backward compatibility)
-        return True if not allowed_users else user_id in allowed_users
-    except Exception as e:
-        # If Redis fails, log error and allow access (fail open for availability)
-        print(f"Error checking allowed broadcasters: {e}")
-        return True
-
-
-def cooldown_key(user_id: str) -> str:
-    return f"partner_alert_bot:cooldown:{user_id}"
-
-
-def in_cooldown(user_id: str) -> bool:
-    if BROADCAST_COOLDOWN_SECONDS <= 0:
-        return False
-    return redis.get(cooldown_key(user_id)) is not None
-
-
-def set_cooldown(user_id: str):
-    if BROADCAST_COOLDOWN_SECONDS <= 0:
-        return
-    redis.set(cooldown_key(user_id), str(int(time.time())), ex=BROADCAST_COOLDOWN_SECONDS)
-
-
-def get_channel_count() -> int:
-    return len(redis.smembers(CHANNEL_SET_KEY) or [])
 
 
 def extract_draft(view_state: dict) -> dict:
@@ -72,28 +36,52 @@ def extract_draft(view_state: dict) -> dict:
     body = (values.get("body_block", {}).get("body_input", {}).get("value") or "").strip()
     link = (values.get("link_block", {}).get("link_input", {}).get("value") or "").strip() or None
 
-    return {"title": title, "category": category, "body": body, "link": link}
+    def selected(block_id: str, action_id: str):
+        options = values.get(block_id, {}).get(action_id, {}).get("selected_options") or []
+        return [o["value"] for o in options]
+
+    audience = {
+        "segments": selected("segment_block", "segment_select"),
+        "match": (values.get("segment_match_block", {}).get("segment_match_select", {}).get("selected_option") or {}).get("value", "any"),
+        "exclude": selected("exclude_block", "exclude_select"),
+    }
 
+    file = file_from_submission(values.get("file_block", {}).get("file_input", {}).get("files"))
 
-def trigger_worker_async():
-    url = f"{PUBLIC_BASE_URL}/api/worker?secret={urllib.parse.quote(WORKER_SECRET)}"
-    try:
-        req = urllib.request.Request(url, method="GET")
-        urllib.request.urlopen(req, timeout=2).read()
-    except Exception:
-        pass
+    return {"title": title, "category": category, "body": body, "link": link, "audience": audience, "file": file}
 
 
-class handler(BaseHTTPRequestHandler):
+def _reopen_draft(view: dict, private_metadata: str, draft: dict, edit_of=None):
+    # Deferred: the segment list is only needed once Slack has its ack
+    segments = None if edit_of else list_segments()
+    call_slack(
+        "views_update",
+        view_id=view["id"],
+        hash=view.get("hash"),
+        view=draft_modal_view(private_metadata, draft=draft, segments=segments, allow_file=not edit_of),
+    )
+
+
+class handler(JSONHandler):
     def _send_json(self, payload, status: int = 200):
-        data = json.dumps(payload).encode("utf-8")
-        self.send_response(status)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Content-Length", str(len(data)))
-        self.end_headers()
-        self.wfile.write(data)
+        super()._send_json(payload, status)
+        self._ack_ms = (time.monotonic() - self._started) * 1000
 
     def do_POST(self):
+        # Slack must get its ack within 3s: anything not needed for the response
+        # body goes on self._deferred, started on a thread before the response
+        # (worker wake-ups, modal updates) or run after it (metrics, message touch-ups)
+        self._ack_ms = None
+        self._ack_label = ""
+        self._deferred = Deferred()
+
+        self._handle_post()
+
+        if self._ack_label and self._ack_ms is not None:
+            self._deferred.add(record_ack_latency, self._ack_label, self._ack_ms)
+        self._deferred.run()
+
+    def _handle_post(self):
         length = int(self.headers.get("Content-Length", "0"))
         body = self.rfile.read(length)
 
@@ -112,46 +100,90 @@ class handler(BaseHTTPRequestHandler):
         ptype = payload.get("type")
         user_id = (payload.get("user") or {}).get("id", "")
 
-        print("INTERACTIONS type=", ptype, "callback_id=", (payload.get("view") or {}).get("callback_id"))
+        callback_id = (payload.get("view") or {}).get("callback_id")
+        print("INTERACTIONS type=", ptype, "callback_id=", callback_id)
 
-        if not user_allowed(user_id):
+        actions = payload.get("actions") or []
+        action_id = actions[0].get("action_id") if actions else ""
+        self._ack_label = action_id or callback_id or ""
+
+        # Send needs the cooldown too: fetch it with the allowlist check in one round trip
+        cooldown_user_id = None
+        if ptype == "block_actions" and action_id == "send_broadcast":
+            meta = json.loads((payload.get("view") or {}).get("private_metadata") or "{}")
+            cooldown_user_id = meta.get("user_id") or user_id
+
+        allowed, cooling_down = check_access(user_id, cooldown_user_id=cooldown_user_id)
+        if not allowed:
             self._send_json({})
             return
 
         # ---- Draft submitted -> show review modal ----
         if ptype == "view_submission" and (payload.get("view") or {}).get("callback_id") == "broadcast_draft_submit":
-            channel_count = get_channel_count()
-            if channel_count == 0:
+            draft_meta = json.loads((payload.get("view") or {}).get("private_metadata") or "{}")
+            # Set when the draft corrects a sent broadcast (/partner_broadcast edit <job id>)
+            edit_of = draft_meta.get("edit_of")
+            draft = extract_draft((payload.get("view") or {}).get("state") or {})
+            # Back from review with the file input left empty: keep the file picked before
+            draft["file"] = draft["file"] or draft_meta.get("file")
+            targeted = not edit_of and is_targeted(draft["audience"])
+            # Exact size of the chosen audience (SCARD of the set Redis computes), with
+            # the throughput model for the delivery estimate read in the same request
+            channel_count, estimate = 0, None
+            if not edit_of:
+                count_batch = RedisBatch(transaction=True)
+                model_idx = queue_throughput(count_batch)
+                channel_count = audience_count(draft["audience"], batch=count_batch)
+                estimate = delivery_estimate(count_batch.results[model_idx], channel_count)
+            if channel_count == 0 and targeted:
+                self._send_json({"response_action": "errors", "errors": {"segment_block": "No tracked channels match these segments."}})
+                return
+            if channel_count == 0 and not edit_of:
                 self._send_json({"response_action": "errors", "errors": {"body_block": "No tracked channels yet. Invite the bot to a channel first."}})
                 return
             if channel_count > MAX_BROADCAST_CHANNELS:
                 self._send_json({"response_action": "errors", "errors": {"body_block": f"Safety cap: {channel_count} > {MAX_BROADCAST_CHANNELS}."}})
                 return
 
-            draft = extract_draft((payload.get("view") or {}).get("state") or {})
             if not draft["body"]:
                 self._send_json({"response_action": "errors", "errors": {"body_block": "Message is required."}})
                 return
 
             title = draft["title"] or "Partner Update"
 
+            # Slack validates the button URL, so a personalized link is previewed filled
+            # in; one that is a placeholder without a URL default is shown as text
+            link = fill_placeholders(draft["link"], {}, url=True)
             preview = build_broadcast_blocks(
                 title=title,
                 body=draft["body"],
                 category=draft["category"],
                 sender_name=f"<@{user_id}>",
-                link=draft["link"],
+                link=link or None,
+                attachment=(draft["file"] or {}).get("name"),
             )
+            if draft["link"] and not link:
+                preview.append({
+                    "type": "context",
+                    "elements": [{"type": "mrkdwn", "text": f"🔗 *Link:* `{draft['link']}`, filled in per channel (no button where there is no URL)"}],
+                })
+
+            private_metadata = json.dumps({"user_id": user_id, "draft": draft, "edit_of": edit_of})
 
-            private_metadata = json.dumps({"user_id": user_id, "draft": draft})
+            heading = None
+            if edit_of:
+                heading = f"*Ready to update every copy of broadcast* `{edit_of}`*.*"
+            elif targeted:
+                heading = f"*Ready to send to* *{channel_count}* *channel(s)*: {describe_audience(draft['audience'])}."
 
-            # ✅ DEBUG: print the exact modal JSON Slack is validating
             review_view = review_modal_view(
                 private_metadata=private_metadata,
                 preview_blocks=preview,
                 channel_count=channel_count,
+                heading=heading,
+                estimate=estimate,
+                personalized=placeholder_fields(" ".join(filter(None, (title, draft["body"], draft["link"])))),
             )
-            print("REVIEW_VIEW_JSON:", json.dumps(review_view))
 
             self._send_json({
                 "response_action": "update",
@@ -159,10 +191,36 @@ class handler(BaseHTTPRequestHandler):
             })
             return
 
+        # ---- Buttons on the summary DM ----
+        if ptype == "block_actions" and action_id == "retry_failed":
+            job_id = actions[0].get("value") or ""
+            retry = {
+                "job_id": new_job_id(),
+                "retry_of": job_id,
+                "queued_at": round(time.time(), 3),
+                "queued_by": user_id,
+            }
+            # A retry keeps the original's priority
+            original, _ = load_job(job_id)
+            # Repeat clicks on the same summary queue a single retry
+            enqueue(
+                json.dumps(retry),
+                idempotency_key=f"retry:{job_id}:{(payload.get('message') or {}).get('ts', '')}",
+                lane=lane_for((original or {}).get("category")),
+            )
+            self._deferred.start(trigger_worker_async)
+            self._send_json({})
+
+            message = payload.get("message") or {}
+            channel_id = (payload.get("channel") or {}).get("id")
+            if channel_id and message.get("ts"):
+                blocks = [b for b in (message.get("blocks") or []) if b.get("type") != "actions"]
+                blocks.append({"type": "context", "elements": [{"type": "mrkdwn", "text": f"🔁 Retry queued by <@{user_id}>."}]})
+                self._deferred.add(call_slack, "chat_update", channel=channel_id, ts=message["ts"], text=message.get("text") or "", blocks=blocks)
+            return
+
         # ---- Buttons on review modal ----
         if ptype == "block_actions":
-            actions = payload.get("actions") or []
-            action_id = actions[0].get("action_id") if actions else ""
             view = payload.get("view") or {}
 
             meta = json.loads(view.get("private_metadata") or "{}")
@@ -170,14 +228,21 @@ class handler(BaseHTTPRequestHandler):
             meta_user_id = meta.get("user_id") or user_id
 
             if action_id == "edit_draft":
-                private_metadata = json.dumps({"user_id": meta_user_id, "ts": int(time.time())})
-                client.views_update(view_id=view["id"], hash=view.get("hash"), view=draft_modal_view(private_metadata))
+                private_metadata = json.dumps({
+                    "user_id": meta_user_id,
+                    "ts": int(time.time()),
+                    "edit_of": meta.get("edit_of"),
+                    "file": draft.get("file"),
+                })
+                self._deferred.start(_reopen_draft, view, private_metadata, draft, edit_of=meta.get("edit_of"))
                 self._send_json({})
                 return
 
             if action_id == "send_broadcast":
-                if in_cooldown(meta_user_id):
-                    client.views_update(
+                if cooling_down:
+                    self._deferred.start(
+                        call_slack,
+                        "views_update",
                         view_id=view["id"],
                         hash=view.get("hash"),
                         view={
@@ -191,16 +256,26 @@ class handler(BaseHTTPRequestHandler):
                     return
 
                 job = {
-                    "queued_at": int(time.time()),
+                    "job_id": new_job_id(),
+                    "queued_at": round(time.time(), 3),
                     "queued_by": meta_user_id,
                     "title": (draft.get("title") or "Partner Update"),
                     "category": (draft.get("category") or "Release"),
                     "body": (draft.get("body") or ""),
                     "link": draft.get("link"),
                 }
+                if meta.get("edit_of"):
+                    job.update({"type": "edit", "target_job": meta["edit_of"]})
+                else:
+                    if is_targeted(draft.get("audience")):
+                        job["audience"] = draft["audience"]
+                    if draft.get("file"):
+                        job["file"] = draft["file"]
 
                 if not job["body"]:
-                    client.views_update(
+                    self._deferred.start(
+                        call_slack,
+                        "views_update",
                         view_id=view["id"],
                         hash=view.get("hash"),
                         view={
@@ -213,10 +288,15 @@ class handler(BaseHTTPRequestHandler):
                     self._send_json({})
                     return
 
-                redis.lpush(JOB_LIST_KEY, json.dumps(job))
-                set_cooldown(meta_user_id)
+                # A double-clicked Send carries the same view id: queue it only once
+                with RedisBatch() as batch:
+                    enqueue(json.dumps(job), idempotency_key=f"send:{view['id']}", batch=batch, lane=lane_for(job["category"], job.get("type") or "broadcast"))
+                    set_cooldown(meta_user_id, batch=batch)
 
-                client.views_update(
+                self._deferred.start(trigger_worker_async)
+                self._deferred.start(
+                    call_slack,
+                    "views_update",
                     view_id=view["id"],
                     hash=view.get("hash"),
                     view={
@@ -226,8 +306,6 @@ class handler(BaseHTTPRequestHandler):
                         "blocks": [{"type": "section", "text": {"type": "mrkdwn", "text": "Broadcast started. I’ll DM you when it finishes."}}],
                     },
                 )
-
-                trigger_worker_async()
                 self._send_json({})
                 return
 
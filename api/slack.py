@@ -1,45 +1,67 @@
-from http.server import BaseHTTPRequestHandler
 import os
 import json
 import urllib.parse
 import time
 
-from slack_sdk import WebClient
-
+from api._http import JSONHandler
+from api._clients import get_slack_client
 from api._slack_sig import verify_slack_signature
-from api._redis import get_redis
 from api._blocks import draft_modal_view
+from api._auth import user_allowed
+from api._channels import cached_channel_count
+from api._deferred import Deferred
+from api._jobs import first_delivery_samples, load_job, new_job_id
+from api._metrics import Histogram, recent_broadcasts, stored_histograms
+from api._queue import LANES, enqueue, lane_for
+from api._reconcile import reconcile_item
+from api._segments import list_segments, normalize_segment, parse_channel_refs, segment_sizes, tag_channels, untag_channels
+from api._trigger import trigger_worker_async
 
 SLACK_SIGNING_SECRET = os.environ["SLACK_SIGNING_SECRET"].encode("utf-8")
-SLACK_BOT_TOKEN = os.environ["SLACK_BOT_TOKEN"]
-
-redis = get_redis()
-client = WebClient(token=SLACK_BOT_TOKEN)
-
-CHANNEL_SET_KEY = "partner_alert_bot:channels"
-ALLOWED_BROADCASTERS_KEY = "partner_alert_bot:allowed_broadcasters"
-
-
-def user_allowed(user_id: str) -> bool:
-    try:
-        allowed_users = redis.smembers(ALLOWED_BROADCASTERS_KEY)
-        # If no allowlist is set in Redis, allow anyone (for backward compatibility)
-        return True if not allowed_users else user_id in allowed_users
-    except Exception as e:
-        # If Redis fails, log error and allow access (fail open for availability)
-        print(f"Error checking allowed broadcasters: {e}")
-        return True
-
-
-class handler(BaseHTTPRequestHandler):
-    def _send_json(self, payload, status: int = 200):
-        data = json.dumps(payload).encode("utf-8")
-        self.send_response(status)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Content-Length", str(len(data)))
-        self.end_headers()
-        self.wfile.write(data)
-
+STATS_DEFAULT_BROADCASTS = 20
+
+
+def _first_delivery_report() -> str:
+    lines = []
+    for lane, samples in first_delivery_samples(LANES).items():
+        if not samples:
+            continue
+        ordered = sorted(samples)
+        p50 = ordered[len(ordered) // 2] / 1000
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] / 1000
+        lines.append(f"{lane} priority: queue → first delivery p50 {p50:.1f}s, p95 {p95:.1f}s ({len(ordered)} jobs)")
+    return "\n".join(lines)
+
+
+def _stats_report(limit: int) -> str:
+    lines = []
+    records = recent_broadcasts(limit)
+    if records:
+        post_ms = Histogram()
+        for r in records:
+            post_ms.merge(Histogram.from_buckets(r.get("buckets") or []))
+        rates = [r["msgs_per_sec"] for r in records]
+        lines.append(
+            f"Last {len(records)} job(s), {sum(r['sent'] for r in records)} messages: "
+            f"{sum(rates) / len(rates):.1f} msgs/s avg (best {max(rates)}), post p95 {post_ms.percentile(95):.0f} ms, "
+            f"throttled {sum(r['throttled_seconds'] for r in records):.1f}s, {sum(r.get('retries', 0) for r in records)} retries"
+        )
+        for r in records[:5]:
+            lines.append(f"• `{r['job_id']}` {r['kind']}: {r['sent']}/{r['channels']} in {r['seconds']}s, {r['msgs_per_sec']} msgs/s, p95 {r['p95_ms']} ms")
+
+    hists = stored_histograms()
+    timings = [(name, h) for name, h in hists.items() if name.startswith(("handler.", "slack."))]
+    slowest_redis = sorted(
+        ((name, h) for name, h in hists.items() if name.startswith("redis.")),
+        key=lambda item: item[1].percentile(95),
+        reverse=True,
+    )[:5]
+    for name, h in timings + slowest_redis:
+        lines.append(f"`{name}`: p50 {h.percentile(50):.0f} ms, p95 {h.percentile(95):.0f} ms ({h.count} calls)")
+    return "\n".join(lines)
+
+
+class handler(JSONHandler):
     def do_POST(self):
         length = int(self.headers.get("Content-Length", "0"))
         body = self.rfile.read(length)
@@ -60,13 +82,97 @@ class handler(BaseHTTPRequestHandler):
 
         # Optional status shortcut: /partner_broadcast status
         if text.lower() == "status":
-            count = len(redis.smembers(CHANNEL_SET_KEY) or [])
-            self._send_json({"response_type": "ephemeral", "text": f"Tracked channels: {count}"})
+            count = cached_channel_count()
+            report = _first_delivery_report()
+            self._send_json({"response_type": "ephemeral", "text": f"Tracked channels: {count}" + (f"\n{report}" if report else "")})
+            return
+
+        # /partner_broadcast reconcile: re-sync tracked channels with users.conversations
+        if text.lower() == "reconcile":
+            queued = enqueue(reconcile_item(user_id), idempotency_key="reconcile")
+            if not queued:
+                self._send_json({"response_type": "ephemeral", "text": "A reconcile was started recently; try again in a few minutes."})
+                return
+            # Woken before the reply: the invocation may be frozen once it is out
+            wake = Deferred()
+            wake.start(trigger_worker_async)
+            self._send_json({"response_type": "ephemeral", "text": "Reconciling tracked channels… I’ll DM you when it finishes."})
+            wake.run()
+            return
+
+        # /partner_broadcast segments: list segments and their sizes
+        if text.lower() == "segments":
+            sizes = segment_sizes(list_segments())
+            lines = [f"`{name}`: {n} channel(s)" for name, n in sizes.items()]
+            self._send_json({"response_type": "ephemeral", "text": "\n".join(lines) or "No segments yet. Create one with `/partner_broadcast tag <segment> #channel …`."})
+            return
+
+        command, _, rest = text.partition(" ")
+        command, rest = command.lower(), rest.strip()
+
+        # /partner_broadcast stats [N]: performance of the last N broadcasts and hot paths
+        if command == "stats":
+            limit = int(rest) if rest.isdigit() else STATS_DEFAULT_BROADCASTS
+            report = _stats_report(limit)
+            self._send_json({"response_type": "ephemeral", "text": report or "No performance data yet."})
+            return
+
+        # /partner_broadcast tag|untag <segment> #channel …: manage a segment's channels
+        if command in ("tag", "untag"):
+            raw_name, _, refs = rest.partition(" ")
+            segment, channels = normalize_segment(raw_name), parse_channel_refs(refs)
+            if not segment or not channels:
+                self._send_json({"response_type": "ephemeral", "text": f"Usage: `/partner_broadcast {command} <segment> #channel [#channel …]`"})
+                return
+            if command == "tag":
+                added = tag_channels(segment, channels)
+                reply = f"Tagged {added} channel(s) into `{segment}`" + (f" ({len(channels) - added} already in it)." if added < len(channels) else ".")
+            else:
+                removed, left = untag_channels(segment, channels)
+                reply = f"Removed {removed} channel(s) from `{segment}`; {left} left."
+            self._send_json({"response_type": "ephemeral", "text": reply})
+            return
+
+        # /partner_broadcast edit <job id> | retract <job id>: correct or delete every copy of a sent broadcast
+        job_id = rest
+        if command in ("edit", "retract"):
+            if not job_id:
+                self._send_json({"response_type": "ephemeral", "text": f"Usage: `/partner_broadcast {command} <job id>` (the id is in the summary DM)."})
+                return
+            job, _ = load_job(job_id)
+            if not job:
+                self._send_json({"response_type": "ephemeral", "text": f"No broadcast `{job_id}` found; it may have expired."})
+                return
+
+            if command == "retract":
+                item = {
+                    "job_id": new_job_id(),
+                    "type": "retract",
+                    "target_job": job_id,
+                    "queued_at": round(time.time(), 3),
+                    "queued_by": user_id,
+                }
+                # chat.delete has its own rate bucket: queued in the normal lane, where it
+                # neither holds up broadcasts nor yields to them (see lane_for)
+                if not enqueue(json.dumps(item), idempotency_key=f"retract:{job_id}", lane=lane_for(None, "retract")):
+                    self._send_json({"response_type": "ephemeral", "text": f"Broadcast `{job_id}` is already being retracted."})
+                    return
+                wake = Deferred()
+                wake.start(trigger_worker_async)
+                self._send_json({"response_type": "ephemeral", "text": f"Retracting broadcast `{job_id}` from every channel… I’ll DM you when it finishes."})
+                wake.run()
+                return
+
+            # Edit: the draft modal, prefilled; the review modal then queues the update
+            private_metadata = json.dumps({"user_id": user_id, "ts": int(time.time()), "edit_of": job_id})
+            get_slack_client().views_open(trigger_id=trigger_id, view=draft_modal_view(private_metadata=private_metadata, draft=job, allow_file=False))
+            self._send_json({"response_type": "ephemeral", "text": f"Opening broadcast `{job_id}` for editing… ✅"})
             return
 
         # Open the Draft modal
         private_metadata = json.dumps({"user_id": user_id, "ts": int(time.time())})
-        client.views_open(trigger_id=trigger_id, view=draft_modal_view(private_metadata=private_metadata))
+        view = draft_modal_view(private_metadata=private_metadata, segments=list_segments())
+        get_slack_client().views_open(trigger_id=trigger_id, view=view)
 
         # Respond quickly to Slack (prevents timeout)
         self._send_json({"response_type": "ephemeral", "text": "Opening draft… ✅"})
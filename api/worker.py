@@ -1,70 +1,665 @@
-from http.server import BaseHTTPRequestHandler
 import os
 import json
+import math
 import time
+import threading
 import urllib.parse
 
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
-
-from api._redis import get_redis
-from api._blocks import build_broadcast_blocks
+from api import _metrics
+from api._http import JSONHandler
+from api._clients import get_slack_client
+from api._redis import RedisBatch
+from api._blocks import build_broadcast_blocks, summary_message_blocks
+from api._delivery import fan_out
+from api._payload import PayloadTemplate, Placeholders
+from api._queue import LANES, Claim, ack, active_leases, claim, enqueue, enqueue_next, extend_lease, queue_lane_load, requeue
+from api._reconcile import reconcile_item, run_reconcile
+from api._channels import CHANNEL_SET_KEY, PERMANENT_CHANNEL_ERRORS, channel_count, channel_meta, queue_channel_health
+from api._segments import build_audience, is_targeted
+from api._attachments import (
+    FILE_SHARE_MAX_CHANNELS,
+    claim_share,
+    discard_local_copy,
+    local_copy,
+    record_share,
+    share_failures,
+    shared_file_ids,
+    upload_and_share,
+)
+from api._jobs import (
+    JOB_TTL_SECONDS,
+    LEDGER_TTL_SECONDS,
+    RETRACTED,
+    create_job,
+    job_key,
+    finish_shard,
+    is_retracted,
+    ledger_ts,
+    load_job,
+    mark_retracted,
+    queue_first_delivery,
+    queue_slice_perf,
+    next_slice,
+    release_slice,
+    save_checkpoint,
+    shard_ranges,
+    snapshot_delivered_targets,
+    snapshot_retry_targets,
+    snapshot_targets,
+    target_range,
+    update_job_spec,
+)
+from api._ratelimit import METHOD_TIERS, TIER_RATES, DistributedRateLimiter, limiter_for
+from api._slack_http import post_json
+from api._trigger import trigger_worker_async
 
 SLACK_BOT_TOKEN = os.environ["SLACK_BOT_TOKEN"]
 WORKER_SECRET = os.environ["WORKER_SECRET"]
 
-POST_THROTTLE_SECONDS = float(os.environ.get("POST_THROTTLE_SECONDS", "0.2"))
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_RATE_PER_SECOND = float(os.environ.get("BROADCAST_RATE_PER_SECOND", "10"))
+# Platform function timeout (Vercel maxDuration); the worker stops taking work
+# WORKER_DEADLINE_MARGIN_SECONDS before it. WORKER_TIME_BUDGET_SECONDS overrides.
+WORKER_MAX_DURATION_SECONDS = float(os.environ.get("WORKER_MAX_DURATION_SECONDS", "10"))
+WORKER_DEADLINE_MARGIN_SECONDS = float(os.environ.get("WORKER_DEADLINE_MARGIN_SECONDS", "2"))
+WORKER_TIME_BUDGET_SECONDS = float(
+    os.environ.get("WORKER_TIME_BUDGET_SECONDS") or (WORKER_MAX_DURATION_SECONDS - WORKER_DEADLINE_MARGIN_SECONDS)
+)
+DELIVERY_SLICE_SIZE = int(os.environ.get("DELIVERY_SLICE_SIZE", "50"))
 MAX_BROADCAST_CHANNELS = int(os.environ.get("MAX_BROADCAST_CHANNELS", "500"))
+SHARD_MIN_CHANNELS = int(os.environ.get("SHARD_MIN_CHANNELS", "200"))
+MAX_SHARDS = int(os.environ.get("MAX_SHARDS", "8"))
+EXPECTED_POST_LATENCY_SECONDS = float(os.environ.get("EXPECTED_POST_LATENCY_SECONDS", "0.3"))
+# How long a worker whose job yielded to the high lane waits before claiming again
+LANE_YIELD_POLL_SECONDS = float(os.environ.get("LANE_YIELD_POLL_SECONDS", "1"))
+
+# Job type -> Web API method called per channel
+JOB_METHODS = {
+    "broadcast": "chat.postMessage",
+    "edit": "chat.update",
+    "retract": "chat.delete",
+}
+FOLLOW_UP_VERBS = {"broadcast": "retry", "edit": "edit", "retract": "retract"}
+SUMMARY_WORDING = {
+    "broadcast": ("Broadcast", "Sent to"),
+    "edit": ("Edit", "Updated"),
+    "retract": ("Retraction", "Deleted from"),
+}
+
 
-CHANNEL_SET_KEY = "partner_alert_bot:channels"
-JOB_LIST_KEY = "partner_alert_bot:jobs"
+_team_id = os.environ.get("SLACK_TEAM_ID", "")
 
-redis = get_redis()
-client = WebClient(token=SLACK_BOT_TOKEN)
 
+def _workspace_id() -> str:
+    """
+    Workspace the rate-limit budget is keyed by (auth.test once per warm instance).
+    """
+    global _team_id
+    if not _team_id:
+        try:
+            _team_id = get_slack_client().auth_test().get("team_id") or ""
+        except Exception:
+            pass
+    return _team_id
 
-def _normalize_members(raw) -> list[str]:
-    items = raw or []
-    out = []
-    for c in items:
-        out.append(c.decode("utf-8") if isinstance(c, (bytes, bytearray)) else str(c))
-    out.sort()
-    return out
+
+def _timed_post(method: str, body: bytes, stats=None):
+    started = time.perf_counter()
+    try:
+        return post_json(method, body, SLACK_BOT_TOKEN)
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        _metrics.observe(f"slack.{method}", elapsed_ms)
+        if stats is not None:
+            stats.latency.observe(elapsed_ms)
 
 
-def _post_with_retry(channel: str, text: str, blocks):
+def _post_with_retry(
+    channel: str,
+    payload: PayloadTemplate,
+    limiter: DistributedRateLimiter,
+    method: str = "chat.postMessage",
+    stats=None,
+    **slots,
+):
     try:
-        client.chat_postMessage(channel=channel, text=text, blocks=blocks)
-        return True, None
-    except SlackApiError as e:
-        err = e.response.get("error")
+        body = payload.render(channel=channel, **slots)
+        resp, headers = _timed_post(method, body, stats)
+        if resp.get("ok"):
+            return True, resp.get("ts")
+        err = resp.get("error")
         if err == "ratelimited":
             retry_after = 1
             try:
-                retry_after = int(e.response.headers.get("Retry-After", "1"))
+                retry_after = int(headers.get("retry-after", "1"))
             except Exception:
                 retry_after = 1
-            time.sleep(retry_after + 1)
-            try:
-                client.chat_postMessage(channel=channel, text=text, blocks=blocks)
-                return True, None
-            except SlackApiError as e2:
-                return False, e2.response.get("error") or "ratelimited"
+            # Hold back every in-flight post, in every invocation, not just this one
+            limiter.pause(retry_after + 1)
+            limiter.acquire()
+            _metrics.incr(f"slack.{method}.retries")
+            if stats is not None:
+                stats.retried()
+            resp, _ = _timed_post(method, body, stats)
+            if resp.get("ok"):
+                return True, resp.get("ts")
+            return False, resp.get("error") or "ratelimited"
         return False, err or "SlackApiError"
     except Exception as e:
         return False, str(e)
 
 
-class handler(BaseHTTPRequestHandler):
-    def _send_json(self, payload, status: int = 200):
-        data = json.dumps(payload).encode("utf-8")
-        self.send_response(status)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Content-Length", str(len(data)))
-        self.end_headers()
-        self.wfile.write(data)
+def _shard_count(total: int, rate: float = BROADCAST_RATE_PER_SECOND) -> int:
+    """
+    Enough shards to keep every invocation busy, but no more than the channel count
+    warrants (SHARD_MIN_CHANNELS each) or than the shared rate budget can feed.
+    """
+    by_size = math.ceil(total / max(1, SHARD_MIN_CHANNELS))
+
+    # One invocation drives about CONCURRENCY / latency posts/s; other leased jobs
+    # draw from the same workspace budget, so only the rest is available.
+    per_invocation = BROADCAST_CONCURRENCY / max(EXPECTED_POST_LATENCY_SECONDS, 0.01)
+    by_rate = math.ceil(rate / per_invocation)
+    try:
+        by_rate -= max(0, active_leases() - 1)
+    except Exception:
+        pass
+
+    return max(1, min(MAX_SHARDS, by_size, by_rate))
+
+
+def _plan_job(item: str, queued: dict, lane: str) -> dict:
+    """
+    Snapshots the target channels of a newly queued broadcast and replaces its
+    queue item with one item per shard in the same priority lane, in a single
+    transaction.
+    Follow-ups of a sent broadcast work off its ledger instead of the channel set:
+    a retry ({"retry_of": <job id>}) targets the channels that failed, with the
+    original message; an edit or retraction ({"type": "edit" | "retract",
+    "target_job": <job id>}) targets every channel holding a copy. A broadcast
+    with an "audience" goes to the tracked channels in the chosen segments.
+    """
+    kind = queued.get("type") or "broadcast"
+    root_id = queued.get("retry_of") or queued.get("target_job")
+    queued_by = queued.get("queued_by") or ""
+    if root_id:
+        root, _ = load_job(root_id)
+        if not root:
+            ack(item, lane=lane)
+            _dm(queued_by, f"Broadcast `{root_id}` has expired; nothing to {FOLLOW_UP_VERBS[kind]}.")
+            return {"ok": True, "message": "Target job expired; dropped."}
+        if kind != "retract" and is_retracted(root_id):
+            ack(item, lane=lane)
+            _dm(queued_by, f"Broadcast `{root_id}` was retracted; nothing to {FOLLOW_UP_VERBS[kind]}.")
+            return {"ok": True, "message": "Target job retracted; dropped."}
+
+    if kind == "broadcast" and root_id:
+        for field in ("title", "category", "body", "link", "file"):
+            queued[field] = root.get(field)
+        # Channels we stopped tracking would only fail again
+        total = snapshot_retry_targets(queued["job_id"], root_id, skip_errors=PERMANENT_CHANNEL_ERRORS)
+    elif root_id:
+        if kind == "edit":
+            # Later retries of the original send the corrected message
+            update_job_spec(root_id, {f: queued.get(f) for f in ("title", "category", "body", "link")})
+            # The attachment stays; edited copies keep pointing at it
+            queued["file"] = root.get("file")
+        else:
+            mark_retracted(root_id)
+            _delete_attachments(root_id)
+        total = snapshot_delivered_targets(queued["job_id"], root_id)
+    else:
+        # A segmented broadcast's channels are computed inside Redis, then streamed like the full set
+        source_key = CHANNEL_SET_KEY
+        if is_targeted(queued.get("audience")):
+            source_key = job_key(queued["job_id"], "audience")
+            count = build_audience(source_key, queued["audience"])
+        else:
+            count = channel_count()
+        if not count:
+            ack(item, lane=lane)
+            return {"ok": True, "message": "No channels tracked; job dropped."}
+
+        if count > MAX_BROADCAST_CHANNELS:
+            ack(item, lane=lane)
+            return {"ok": False, "error": f"cap_exceeded {count}>{MAX_BROADCAST_CHANNELS}"}
+
+        total = snapshot_targets(queued["job_id"], source_key=source_key)
+
+    if root_id and not total:
+        ack(item, lane=lane)
+        _dm(queued_by, f"Broadcast `{root_id}` has no channels left to {FOLLOW_UP_VERBS[kind]}.")
+        return {"ok": True, "message": "No target channels; job dropped."}
+
+    method = JOB_METHODS[kind]
+    rate = BROADCAST_RATE_PER_SECOND if method == "chat.postMessage" else TIER_RATES[METHOD_TIERS[method]]
+    shards = len(shard_ranges(total, _shard_count(total, rate)))
+    batch = RedisBatch(transaction=True)
+    enqueue_next([json.dumps({"job_id": queued["job_id"], "shard": i}) for i in range(shards)], batch=batch, lane=lane)
+    ack(item, batch=batch, lane=lane)
+    queued["lane"] = lane
+    job = create_job(queued, total, shards=shards, batch=batch)
+
+    # This invocation picks up one shard itself; wake one worker per other shard
+    for _ in range(len(job["shards"]) - 1):
+        threading.Thread(target=trigger_worker_async, daemon=True).start()
+    return {"ok": True, "job_id": job["job_id"], "channels": job["total"], "shards": len(job["shards"])}
+
+
+def _share_attachment(job: dict, shard: int, root_id=None):
+    """
+    Shares the job's attachment with the shard's channels before its messages go
+    out: one upload per FILE_SHARE_MAX_CHANNELS channels, each shared with a
+    single files.completeUploadExternal call, instead of one upload per channel.
+    Groups are claimed like slices, so a resumed shard never shares twice. The
+    local copy of the file is removed once the shard's groups are done.
+    """
+    job_id = job["job_id"]
+    start, end = job["shards"][shard]
+    limiter = limiter_for("files.completeUploadExternal", _workspace_id(), BROADCAST_RATE_PER_SECOND)
+    path = None
+    try:
+        for at in range(start, end, FILE_SHARE_MAX_CHANNELS):
+            share_id = f"{shard}:{at}"
+            if not claim_share(job_id, share_id, LEDGER_TTL_SECONDS):
+                continue
+            try:
+                path = path or local_copy(job["file"], SLACK_BOT_TOKEN)
+                channels = target_range(job_id, at, min(end, at + FILE_SHARE_MAX_CHANNELS) - 1)
+                # getUploadURLExternal + completeUploadExternal
+                limiter.acquire()
+                limiter.acquire()
+                uploaded = upload_and_share(get_slack_client(), path, job["file"], channels)
+                record_share(job_id, share_id, uploaded["id"], root_job_id=root_id)
+            except Exception as e:
+                print(f"Attachment share {share_id} of job {job_id} failed: {e}")
+                record_share(job_id, share_id, f"error: {e}")
+    finally:
+        if path:
+            discard_local_copy(job["file"])
+
+
+def _failed_share_groups(job: dict, failures: dict):
+    # (shard, first position, last position) of each failed group share
+    for share_id in sorted(failures):
+        shard, at = (int(n) for n in share_id.split(":"))
+        yield shard, at, min(job["shards"][shard][1], at + FILE_SHARE_MAX_CHANNELS) - 1
+
+
+def _unshared_channels(job: dict, shard: int) -> set:
+    """
+    Channels of the shard whose group share of the attachment failed; their
+    message goes out without the attachment note.
+    """
+    failures = share_failures(job["job_id"])
+    channels = set()
+    for group_shard, first, last in _failed_share_groups(job, failures):
+        if group_shard == shard:
+            channels.update(target_range(job["job_id"], first, last))
+    return channels
+
+
+def _delete_attachments(job_id: str):
+    # Best effort: every uploaded copy of a retracted broadcast's attachment
+    limiter = limiter_for("files.delete", _workspace_id(), BROADCAST_RATE_PER_SECOND)
+    for file_id in shared_file_ids(job_id):
+        limiter.acquire()
+        try:
+            get_slack_client().files_delete(file=file_id)
+        except Exception as e:
+            print(f"Could not delete attachment {file_id}: {e}")
+
+
+def _dm(user_id: str, text: str, blocks=None):
+    # Best effort
+    if not user_id:
+        return
+    try:
+        dm = get_slack_client().conversations_open(users=user_id)
+        get_slack_client().chat_postMessage(channel=dm["channel"]["id"], text=text, blocks=blocks)
+    except Exception:
+        pass
+
+
+def _send_summary(queued_by: str, total: int, summary: dict, job: dict):
+    kind = job.get("type") or "broadcast"
+    label, verb = SUMMARY_WORDING[kind]
+    if kind == "broadcast" and job.get("retry_of"):
+        label = "Retry"
+    msg = f"✅ {label} complete. {verb} {summary['sent']}/{total} channels."
+    if summary.get("retracted"):
+        msg += " Stopped early: the broadcast was retracted."
+    if summary.get("first_delivery_ms") is not None:
+        msg += f" First delivery {summary['first_delivery_ms'] / 1000:.1f}s after queueing ({job.get('lane') or 'normal'} priority)."
+    if summary["failed"]:
+        msg += f" Failed: {summary['failed']} (first 10): " + ", ".join(summary["failures"])
+    if summary.get("unshared"):
+        msg += (
+            f"\n📎 The attachment could not be shared with {summary['unshared']} channel(s); "
+            f"their message went out without it: {summary['share_error']}"
+        )
+    if summary["pruned"]:
+        msg += f"\nStopped tracking {len(summary['pruned'])} dead channel(s): " + ", ".join(summary["pruned"][:20])
+    if summary.get("perf"):
+        msg += "\n" + _metrics.perf_line(summary["perf"])
+    # Follow-ups always work off the original broadcast's ledger
+    root_id = job.get("retry_of") or job.get("target_job") or job["job_id"]
+    retryable = summary["failed"] if kind == "broadcast" and not summary.get("retracted") else 0
+    _dm(queued_by, msg, blocks=summary_message_blocks(msg, root_id, retryable))
+
+
+def _reconcile(item: str, queued: dict, deadline: float) -> dict:
+    limiter = limiter_for("users.conversations", _workspace_id(), BROADCAST_RATE_PER_SECOND)
+    try:
+        finished, stats = run_reconcile(get_slack_client(), limiter, deadline)
+    except Exception as e:
+        # Progress is saved per page; let the lease expire and retry from there
+        print(f"Reconcile failed: {e}")
+        return {"ok": False, "error": "reconcile_failed"}
+
+    if not finished:
+        requeue(item)
+        return {"ok": True, "reconcile": stats, "continued": True}
+
+    ack(item)
+    _dm(
+        queued.get("requested_by") or "",
+        f"🔄 Reconcile complete. Added {stats['added']}, removed {stats['removed']}; now tracking {stats['tracked']} channels.",
+    )
+    return {"ok": True, "reconcile": stats}
+
+
+def _yield_to_top_lane(item: str, lane: str) -> dict:
+    # Requeued at the front of its lane: drain_queue() claims it again once the top lane is idle
+    requeue(item, lane=lane)
+    return {"ok": True, "yielded": True}
+
+
+def _deliver_shard(item: str, queued: dict, deadline: float, claimed: Claim) -> dict:
+    """
+    Delivers one shard until it is done or the time budget runs out. A broadcast
+    from a lower lane stops at the next slice boundary while higher-priority work is
+    waiting or running, so an Incident gets the workspace rate budget to itself.
+    A broadcast, retry or edit whose broadcast was retracted meanwhile stops at
+    the next slice boundary for good.
+    """
+    lane = claimed.lane
+    shard = int(queued.get("shard", 0))
+    job, cursor = load_job(queued["job_id"], shard)
+    if not job:
+        ack(item, lane=lane)
+        return {"ok": True, "message": "Job expired; dropped."}
+
+    kind = job.get("type") or "broadcast"
+    method = JOB_METHODS[kind]
+    # The top lane holds chat.postMessage work only (see lane_for): edits and
+    # retractions share no rate bucket with it and never yield
+    yields = lane != LANES[0] and method == JOB_METHODS["broadcast"]
+    if yields and claimed.top_lane_load:
+        return _yield_to_top_lane(item, lane)
 
+    job_id = job["job_id"]
+    total = job["total"]
+    shard_end = job["shards"][shard][1]
+    title = job.get("title") or "Partner Update"
+    category = job.get("category") or "Release"
+    body = job.get("body") or ""
+    link = job.get("link")
+    queued_by = job.get("queued_by") or ""
+
+    root_id = job.get("retry_of") or job.get("target_job")
+    # Checked at every slice claim: a retraction stops the rest of the shard
+    retracted_key = job_key(root_id or job_id, "retracted") if kind != "retract" else None
+
+    # Serialized once; only the channel (and for follow-ups the message ts) changes per
+    # call, plus the values of any {{field}} placeholders, from the channel's metadata.
+    # Keyed by (attachment note, link button): channels whose share failed get the
+    # message without the note, those without a URL for a link placeholder without the button
+    placeholders = Placeholders()
+    payloads = {}
+    if kind == "retract":
+        payloads[True, True] = PayloadTemplate({}, slots=("channel", "ts"))
+    else:
+        title, body = placeholders.mark(title), placeholders.mark(body, mrkdwn=True)
+        link = placeholders.mark(link, url=True)
+        slots = ("channel", "ts") if kind == "edit" else ("channel",)
+
+        def broadcast_payload(attachment, with_link: bool):
+            blocks = build_broadcast_blocks(
+                title=title,
+                body=body,
+                category=category,
+                sender_name=f"<@{queued_by}>" if queued_by else "Partner Alert Bot",
+                link=link if with_link else None,
+                attachment=attachment,
+            )
+            fallback_text = f"{category}: {title}"
+            return PayloadTemplate({"text": fallback_text, "blocks": blocks}, slots=slots, inline=tuple(placeholders.slots))
+
+        for with_link in (True, False) if placeholders.links else (True,):
+            payloads[True, with_link] = broadcast_payload((job.get("file") or {}).get("name"), with_link)
+
+    unshared = set()
+    if kind == "broadcast" and job.get("file"):
+        if cursor == job["shards"][shard][0]:
+            # Before the shard's first slice; a resumed shard has shared already
+            _share_attachment(job, shard, root_id)
+        unshared = _unshared_channels(job, shard)
+        if unshared:
+            for _, with_link in list(payloads):
+                payloads[False, with_link] = broadcast_payload(None, with_link)
+
+    limiter = limiter_for(method, _workspace_id(), BROADCAST_RATE_PER_SECOND)
+    slice_seconds = 0.0
+
+    def deliver(ch: str, ts_by_channel: dict, meta_by_channel: dict, stats: _metrics.PostStats):
+        values = placeholders.values(meta_by_channel.get(ch) or {})
+        payload = payloads[ch not in unshared, not placeholders.drops_link(values)]
+        if kind == "broadcast":
+            return _post_with_retry(ch, payload, limiter, stats=stats, **values)
+        ts = ts_by_channel.get(ch)
+        if not ts:
+            return False, "message_not_found"
+        ok, detail = _post_with_retry(ch, payload, limiter, method=method, stats=stats, ts=ts, **values)
+        if kind == "retract" and (ok or detail == "message_not_found"):
+            # Already gone counts as retracted
+            return True, RETRACTED
+        return ok, detail
+
+    def slice_size(at: int) -> int:
+        # No more than the limiter lets through before the deadline: chat.update and
+        # chat.delete (tier 3) manage under one post per second
+        affordable = max(1, int(limiter.rate * (deadline - time.monotonic())))
+        return min(DELIVERY_SLICE_SIZE, shard_end - at, affordable)
+
+    # Deliver in slices, checkpointing after each (and claiming the next slice
+    # in the same round trip), until the time budget runs out. Channels are
+    # claimed per slice, so a job is never posted twice to the same channel.
+    retracted = retracted_key is not None and is_retracted(root_id or job_id)
+    listed, chunk = next_slice(job_id, cursor, slice_size(cursor)) if cursor < shard_end and not retracted else (0, [])
+    first_slice = True
+    top_lane_load = 0
+    posted = 0
+    while listed and not top_lane_load and not retracted and time.monotonic() + slice_seconds < deadline:
+        slice_started = time.monotonic()
+        throttled_before = limiter.throttled_seconds
+        stats = _metrics.PostStats()
+        ts_by_channel = ledger_ts(root_id, chunk) if kind != "broadcast" else {}
+        meta_by_channel = channel_meta(chunk, placeholders.fields) if placeholders else {}
+        results = fan_out(
+            chunk,
+            lambda ch: deliver(ch, ts_by_channel, meta_by_channel, stats),
+            concurrency=BROADCAST_CONCURRENCY,
+            limiter=limiter,
+            deadline=deadline,
+        )
+        # Cut short by the deadline: the cursor stays, and the channels not posted
+        # are released for the invocation that resumes the shard
+        finished_slice = len(results) == len(chunk)
+        posted_channels = {ch for ch, _, _ in results}
+        unsent = [ch for ch in chunk if ch not in posted_channels]
+        if finished_slice:
+            cursor += listed
+        posted += len(results)
+        batch = RedisBatch()
+        release_slice(job_id, unsent, batch=batch)
+        extend_lease(item, batch=batch, lane=lane)
+        queue_channel_health(batch, results, job_key(job_id, "pruned"), JOB_TTL_SECONDS)
+        queue_slice_perf(batch, job_id, stats, limiter.throttled_seconds - throttled_before)
+        if first_slice and job.get("queued_at") and any(ok for _, ok, _ in results):
+            queue_first_delivery(batch, job_id, lane, float(job["queued_at"]))
+            first_slice = False
+        load_idx = queue_lane_load(batch, LANES[0]) if yields else ()
+        retracted_idx = batch.exists(retracted_key) if retracted_key else None
+        listed, chunk = save_checkpoint(
+            job_id,
+            shard,
+            cursor,
+            results,
+            next_size=slice_size(cursor) if finished_slice and cursor < shard_end else 0,
+            batch=batch,
+            root_job_id=root_id,
+        )
+        top_lane_load = sum(int(batch.results[i] or 0) for i in load_idx)
+        retracted = retracted_idx is not None and bool(batch.results[retracted_idx])
+        slice_seconds = time.monotonic() - slice_started
+
+    # The next slice was claimed along with the last checkpoint but won't be sent here
+    release_slice(job_id, chunk)
+
+    if cursor < shard_end and top_lane_load and not retracted:
+        result = _yield_to_top_lane(item, lane)
+        result.update({"job_id": job_id, "shard": shard, "delivered": cursor, "channels": total, "posted": posted})
+        return result
+
+    if cursor < shard_end and not retracted:
+        # Out of time: the rest goes to the next invocation (see handler.do_GET)
+        requeue(item, lane=lane)
+        return {
+            "ok": True,
+            "job_id": job_id,
+            "shard": shard,
+            "delivered": cursor,
+            "channels": total,
+            "posted": posted,
+            "continued": True,
+        }
+
+    # Counts are aggregated across shards; only the last shard to finish sends the DM.
+    # A retracted shard ends here too, with the channels it did not reach left out
+    batch = RedisBatch()
+    ack(item, batch=batch, lane=lane)
+    summary = finish_shard(job_id, len(job["shards"]), batch=batch)
+    if summary is None:
+        return {"ok": True, "job_id": job_id, "shard": shard, "channels": total, "posted": posted, "shard_done": True}
+    summary["retracted"] = retracted
+
+    if job.get("file") and kind == "broadcast":
+        failures = share_failures(job_id)
+        summary["unshared"] = sum(last - first + 1 for _, first, last in _failed_share_groups(job, failures))
+        summary["share_error"] = next(iter(failures.values()), None)
+
+    perf = summary["perf"]
+    summary["perf"] = _metrics.broadcast_perf(
+        total,
+        summary["sent"],
+        time.time() - float(job.get("started_at") or time.time()),
+        perf["post_ms"],
+        perf["throttled_seconds"],
+        perf["retries"],
+    )
+    try:
+        _metrics.record_broadcast(job_id, kind, summary["perf"])
+    except Exception as e:
+        print(f"Could not record broadcast performance: {e}")
+    _send_summary(queued_by, total, summary, job)
+    return {
+        "ok": True,
+        "job_id": job_id,
+        "sent": summary["sent"],
+        "failed": summary["failed"],
+        "pruned": len(summary["pruned"]),
+        "channels": total,
+        "posted": posted,
+        "lane": lane,
+        "first_delivery_ms": summary["first_delivery_ms"],
+    }
+
+
+def _min_slice_seconds() -> float:
+    # Rough duration of one delivery slice; no point starting a job with less left
+    return DELIVERY_SLICE_SIZE / BROADCAST_CONCURRENCY * EXPECTED_POST_LATENCY_SECONDS
+
+
+def _handle(claimed: Claim, deadline: float) -> dict:
+    item = claimed.item
+    queued = json.loads(item)
+    if queued.get("type") == "reconcile":
+        return _reconcile(item, queued, deadline)
+    if "shard" not in queued:
+        # New broadcast or follow-up: split it into shards; the loop picks them up
+        return _plan_job(item, queued, claimed.lane)
+    return _deliver_shard(item, queued, deadline, claimed)
+
+
+def drain_queue(deadline: float):
+    """
+    Leases and works on queue items one after another until the queue is empty or
+    `deadline` (time.monotonic()) is near, so back-to-back jobs share one
+    invocation. Work left over is handed to the next invocation with a single
+    re-trigger. Returns (per-item results, invocation stats).
+    """
+    results = []
+    stats = {"jobs": 0, "posted": 0, "busy_seconds": 0.0, "idle_seconds": 0.0}
+    loop_started = time.monotonic()
+    woke_peer = False
+    hand_off = False
+    while True:
+        if deadline - time.monotonic() < _min_slice_seconds():
+            break
+
+        claimed = claim()
+        if not claimed.item:
+            hand_off = False
+            break
+        if claimed.pending and not woke_peer:
+            # A backlog is waiting: wake one more worker so it drains in parallel
+            threading.Thread(target=trigger_worker_async, daemon=True).start()
+            woke_peer = True
+
+        job_started = time.monotonic()
+        result = _handle(claimed, deadline)
+        stats["busy_seconds"] += time.monotonic() - job_started
+        stats["jobs"] += 1
+        stats["posted"] += result.get("posted", 0)
+        results.append(result)
+
+        if result.get("yielded"):
+            # The top-lane job may belong to a worker that is gone before its lease
+            # expires: poll while the budget allows, then leave the item to the next
+            # invocation rather than to whoever finishes that job
+            if deadline - time.monotonic() - LANE_YIELD_POLL_SECONDS >= _min_slice_seconds():
+                time.sleep(LANE_YIELD_POLL_SECONDS)
+                continue
+            hand_off = True
+            break
+        # Anything still queued after this point is left for the next invocation
+        hand_off = bool(result.get("continued") or claimed.pending)
+        if result.get("continued"):
+            break
+
+    if hand_off:
+        trigger_worker_async()
+    stats["idle_seconds"] = round(time.monotonic() - loop_started - stats["busy_seconds"], 3)
+    stats["busy_seconds"] = round(stats["busy_seconds"], 3)
+    stats["handed_off"] = hand_off
+    return results, stats
+
+
+class handler(JSONHandler):
     def do_GET(self):
+        started = time.monotonic()
+
         # Auth via querystring secret
         parsed = urllib.parse.urlparse(self.path)
         params = urllib.parse.parse_qs(parsed.query)
@@ -73,59 +668,13 @@ class handler(BaseHTTPRequestHandler):
             self._send_json({"error": "unauthorized"}, status=401)
             return
 
-        # Pop exactly one job per invocation (keeps runtime bounded)
-        job_raw = redis.rpop(JOB_LIST_KEY)
-        if not job_raw:
-            self._send_json({"ok": True, "message": "No queued jobs."})
-            return
-
-        job = json.loads(job_raw if isinstance(job_raw, str) else job_raw.decode("utf-8"))
-
-        channels = _normalize_members(redis.smembers(CHANNEL_SET_KEY))
-        if not channels:
-            self._send_json({"ok": True, "message": "No channels tracked; job dropped."})
-            return
+        # ?task=reconcile queues a channel-membership reconcile (at most one at a time)
+        if (params.get("task") or [""])[0] == "reconcile":
+            enqueue(reconcile_item(), idempotency_key="reconcile")
 
-        if len(channels) > MAX_BROADCAST_CHANNELS:
-            self._send_json({"ok": False, "error": f"cap_exceeded {len(channels)}>{MAX_BROADCAST_CHANNELS}"}, status=400)
+        results, stats = drain_queue(started + WORKER_TIME_BUDGET_SECONDS)
+        stats["elapsed_seconds"] = round(time.monotonic() - started, 3)
+        if not results:
+            self._send_json({"ok": True, "message": "No queued jobs.", "stats": stats})
             return
-
-        title = job.get("title") or "Partner Update"
-        category = job.get("category") or "Release"
-        body = job.get("body") or ""
-        link = job.get("link")
-        queued_by = job.get("queued_by") or ""
-
-        blocks = build_broadcast_blocks(
-            title=title,
-            body=body,
-            category=category,
-            sender_name=f"<@{queued_by}>" if queued_by else "Partner Alert Bot",
-            link=link,
-        )
-        fallback_text = f"{category}: {title}"
-
-        sent = 0
-        failed = []
-
-        for ch in channels:
-            ok, err = _post_with_retry(ch, fallback_text, blocks)
-            if ok:
-                sent += 1
-            else:
-                failed.append(f"{ch} ({err})")
-            time.sleep(POST_THROTTLE_SECONDS)
-
-        # DM sender summary (best effort)
-        if queued_by:
-            try:
-                dm = client.conversations_open(users=queued_by)
-                dm_channel = dm["channel"]["id"]
-                msg = f"✅ Broadcast complete. Sent to {sent}/{len(channels)} channels."
-                if failed:
-                    msg += f" Failed: {len(failed)} (first 10): " + ", ".join(failed[:10])
-                client.chat_postMessage(channel=dm_channel, text=msg)
-            except Exception:
-                pass
-
-        self._send_json({"ok": True, "sent": sent, "failed": len(failed), "channels": len(channels)})
\ No newline at end of file
+        self._send_json({"ok": all(r.get("ok") for r in results), "jobs": results, "stats": stats})
@@ -0,0 +1,16 @@
+from __future__ import annotations
+import sys
+from http.server import ThreadingHTTPServer
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer for the fake backends: daemon request threads, and no
+    traceback when a benchmarked client drops its keep-alive connection on exit.
+    """
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
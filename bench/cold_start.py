@@ -0,0 +1,152 @@
+"""
+Cold-start benchmark for the api/* handlers.
+
+Each run starts a fresh interpreter, imports one handler module and serves one
+request to it in-process (no socket), so the numbers are what a new serverless
+instance pays before its first response:
+
+    python -m bench.cold_start                # 10 runs per handler
+    python -m bench.cold_start --runs 30 --json
+
+Requests are chosen so no network call is needed: health GETs for the slash
+and interactions endpoints, a signed url_verification for events, and an
+unauthorized GET for the worker. None of them should flush metrics; in case
+one does, Redis is an in-memory fake (bench.fake_upstash). The "loaded" column lists heavy modules that
+were imported by the end of the request; events must never load slack_sdk.
+Needs the packages from requirements.txt installed.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HANDLERS = ("api.slack", "api.interactions", "api.events", "api.worker")
+HEAVY_MODULES = ("slack_sdk", "upstash_redis", "urllib.request", "concurrent.futures")
+
+# Placeholder credentials: nothing in the measured path talks to Slack or Redis
+BENCH_ENV = {
+    "SLACK_BOT_TOKEN": "xoxb-bench",
+    "SLACK_SIGNING_SECRET": "bench-signing-secret",
+    "SLACK_BOT_USER_ID": "UBENCH",
+    "WORKER_SECRET": "bench-worker-secret",
+    "PUBLIC_BASE_URL": "http://127.0.0.1:9",
+    "KV_REST_API_URL": "http://127.0.0.1:9",
+    "KV_REST_API_TOKEN": "bench",
+}
+
+# Runs in the child interpreter. argv: module name, heavy modules (comma separated).
+_PROBE = r"""
+import sys, time
+started = time.perf_counter()
+import hashlib, hmac, importlib, io, json, os
+
+module_name, heavy = sys.argv[1], sys.argv[2].split(",")
+mod = importlib.import_module(module_name)
+imported = time.perf_counter()
+
+method, path, body = "GET", "/", b""
+headers = {}
+if module_name == "api.events":
+    method = "POST"
+    body = json.dumps({"type": "url_verification", "challenge": "bench"}).encode()
+    ts = str(int(time.time()))
+    sig = hmac.new(os.environ["SLACK_SIGNING_SECRET"].encode(), f"v0:{ts}:{body.decode()}".encode(), hashlib.sha256).hexdigest()
+    headers = {"X-Slack-Request-Timestamp": ts, "X-Slack-Signature": "v0=" + sig}
+elif module_name == "api.worker":
+    path = "/api/worker?secret=wrong"
+headers["Content-Length"] = str(len(body))
+
+h = mod.handler.__new__(mod.handler)
+h.rfile, h.wfile = io.BytesIO(body), io.BytesIO()
+h.headers, h.path, h.command = headers, path, method
+h.request_version, h.requestline = "HTTP/1.1", f"{method} {path} HTTP/1.1"
+h.client_address, h.server, h.close_connection = ("127.0.0.1", 0), None, True
+h.log_message = lambda *a, **k: None
+getattr(h, "do_" + method)()
+served = time.perf_counter()
+
+status = h.wfile.getvalue().split(b"\r\n", 1)[0].decode()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (served - imported) * 1000,
+    "status": status,
+    "loaded": [m for m in heavy if m in sys.modules],
+}))
+"""
+
+
+def run_once(module: str, redis_url: str) -> Dict:
+    env = dict(os.environ)
+    env.update(BENCH_ENV)
+    env["KV_REST_API_URL"] = redis_url
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    proc = subprocess.run(
+        [sys.executable, "-c", _PROBE, module, ",".join(HEAVY_MODULES)],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{module}: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def bench(module: str, runs: int, redis_url: str) -> Dict:
+    # One untimed run so every module has compiled bytecode, like a deployed bundle
+    run_once(module, redis_url)
+    samples: List[Dict] = [run_once(module, redis_url) for _ in range(runs)]
+    imports = [s["import_ms"] for s in samples]
+    firsts = [s["first_request_ms"] for s in samples]
+    return {
+        "handler": module,
+        "import_ms_p50": round(statistics.median(imports), 2),
+        "import_ms_max": round(max(imports), 2),
+        "first_request_ms_p50": round(statistics.median(firsts), 2),
+        "first_request_ms_max": round(max(firsts), 2),
+        "status": samples[-1]["status"],
+        "loaded": samples[-1]["loaded"],
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--handler", action="append", choices=HANDLERS, help="only these handlers (repeatable)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    os.environ.update(BENCH_ENV)
+    from bench import fake_upstash
+
+    redis_server, _, redis_url = fake_upstash.start()
+    try:
+        results = [bench(m, args.runs, redis_url) for m in (args.handler or HANDLERS)]
+    finally:
+        redis_server.shutdown()
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'handler':<18} {'import p50':>11} {'import max':>11} {'1st req p50':>12} {'1st req max':>12}  loaded")
+        for r in results:
+            print(
+                f"{r['handler']:<18} {r['import_ms_p50']:>9.1f}ms {r['import_ms_max']:>9.1f}ms "
+                f"{r['first_request_ms_p50']:>10.1f}ms {r['first_request_ms_max']:>10.1f}ms  {', '.join(r['loaded']) or '-'}"
+            )
+
+    events = next((r for r in results if r["handler"] == "api.events"), None)
+    if events and "slack_sdk" in events["loaded"]:
+        print("api.events imported slack_sdk", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Fake Slack Web API for benchmarks.
+
+Answers the methods the bot calls (chat.postMessage / update / delete,
+conversations.open, auth.test, users.conversations) after a configurable
+latency, and enforces a per-method rate limit the way Slack does: over the
+limit, a request gets HTTP 429 with a Retry-After header. Keeps per-method
+counts, 429s and the summary DMs it received.
+
+Attachments take the external upload flow: files.getUploadURLExternal hands out
+an upload URL on this server, and files.completeUploadExternal records the
+channels each upload was shared to. GET <base>/files/<id> serves a download of
+`download_bytes` bytes, standing in for a file's url_private_download.
+"""
+from __future__ import annotations
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+from typing import Any, Dict, List, Optional
+
+from bench._http import QuietHTTPServer
+
+
+class _Bucket:
+    """
+    Token bucket: `rate` requests/s with bursts of up to `burst`.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Takes a token; returns 0, or the seconds until one is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FakeSlack:
+    def __init__(
+        self,
+        latency_ms: float = 50.0,
+        jitter_ms: float = 10.0,
+        rate_per_second: Optional[float] = None,
+        burst: Optional[float] = None,
+        team_id: str = "TBENCH",
+        download_bytes: int = 0,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_per_second = rate_per_second
+        self.burst = burst if burst is not None else max(1.0, rate_per_second or 1.0)
+        self.team_id = team_id
+        self.download_bytes = download_bytes
+        self.base_url = ""
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.file_shares = 0
+        self.calls: Dict[str, int] = {}
+        self.ratelimited: Dict[str, int] = {}
+        self.dms: List[Dict[str, Any]] = []
+        self._buckets: Dict[str, _Bucket] = {}
+        self._lock = threading.Lock()
+        self._ts = 0
+
+    def _throttle(self, method: str) -> float:
+        if not self.rate_per_second:
+            return 0.0
+        with self._lock:
+            bucket = self._buckets.get(method)
+            if bucket is None:
+                bucket = self._buckets[method] = _Bucket(self.rate_per_second, self.burst)
+            return bucket.take()
+
+    def _next_ts(self) -> str:
+        with self._lock:
+            self._ts += 1
+            return f"{int(time.time())}.{self._ts:06d}"
+
+    def answer(self, method: str, args: Dict[str, Any]):
+        """
+        Returns (status, headers, payload) for one call.
+        """
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        wait = self._throttle(method)
+        if wait:
+            with self._lock:
+                self.ratelimited[method] = self.ratelimited.get(method, 0) + 1
+            return 429, {"Retry-After": str(max(1, math.ceil(wait)))}, {"ok": False, "error": "ratelimited"}
+
+        channel = str(args.get("channel") or "")
+        if method in ("chat.postMessage", "chat.update"):
+            if channel.startswith("D"):
+                with self._lock:
+                    self.dms.append({"channel": channel, "text": args.get("text")})
+            return 200, {}, {"ok": True, "channel": channel, "ts": args.get("ts") or self._next_ts()}
+        if method == "chat.delete":
+            return 200, {}, {"ok": True, "channel": channel, "ts": args.get("ts")}
+        if method == "conversations.open":
+            return 200, {}, {"ok": True, "channel": {"id": "D" + str(args.get("users") or "BENCH").lstrip("U")}}
+        if method == "auth.test":
+            return 200, {}, {"ok": True, "team_id": self.team_id, "user_id": "UBENCHBOT"}
+        if method == "files.getUploadURLExternal":
+            file_id = f"F{self._next_ts().replace('.', '')}"
+            return 200, {}, {"ok": True, "file_id": file_id, "upload_url": f"{self.base_url}/upload/{file_id}"}
+        if method == "files.completeUploadExternal":
+            files = json.loads(args.get("files") or "[]")
+            channels = [c for c in str(args.get("channels") or args.get("channel_id") or "").split(",") if c]
+            with self._lock:
+                self.file_shares += len(channels)
+            return 200, {}, {"ok": True, "files": [{"id": f["id"], "permalink": f"{self.base_url}/files/{f['id']}"} for f in files]}
+        if method == "files.delete":
+            return 200, {}, {"ok": True}
+        if method == "users.conversations":
+            return 200, {}, {"ok": True, "channels": [], "response_metadata": {"next_cursor": ""}}
+        return 200, {}, {"ok": False, "error": "unknown_method"}
+
+
+def _parse_args(content_type: str, query: str, body: bytes) -> Dict[str, Any]:
+    args: Dict[str, Any] = {k: v[0] for k, v in urllib.parse.parse_qs(query).items()}
+    if not body:
+        return args
+    if content_type.startswith("application/json"):
+        try:
+            args.update(json.loads(body))
+        except ValueError:
+            pass
+    else:
+        args.update({k: v[0] for k, v in urllib.parse.parse_qs(body.decode("utf-8")).items()})
+    return args
+
+
+
+def make_handler(slack: FakeSlack):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _serve(self):
+            parsed = urllib.parse.urlsplit(self.path)
+            parent, _, method = parsed.path.rstrip("/").rpartition("/")
+            if parent.endswith("/upload"):
+                return self._upload()
+            if parent.endswith("/files"):
+                return self._download()
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            args = _parse_args(self.headers.get("Content-Type") or "", parsed.query, body)
+
+            status, headers, payload = slack.answer(method, args)
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _upload(self):
+            remaining = int(self.headers.get("Content-Length") or 0)
+            received = 0
+            while remaining:
+                chunk = self.rfile.read(min(remaining, 64 * 1024))
+                if not chunk:
+                    break
+                received += len(chunk)
+                remaining -= len(chunk)
+            with slack._lock:
+                slack.uploads += 1
+                slack.uploaded_bytes += received
+            self._send_raw(200, b"OK", "text/plain")
+
+        def _download(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(slack.download_bytes))
+            self.end_headers()
+            remaining = slack.download_bytes
+            while remaining:
+                n = min(remaining, 64 * 1024)
+                self.wfile.write(b"\0" * n)
+                remaining -= n
+
+        def _send_raw(self, status: int, data: bytes, content_type: str):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = _serve
+        do_POST = _serve
+
+    return Handler
+
+
+def start(host: str = "127.0.0.1", port: int = 0, slack: Optional[FakeSlack] = None):
+    """
+    Serves a FakeSlack on a background thread. Returns (server, slack, base URL
+    to use as SLACK_API_BASE_URL).
+    """
+    slack = slack or FakeSlack()
+    server = QuietHTTPServer((host, port), make_handler(slack))
+    slack.base_url = f"http://{host}:{server.server_address[1]}/api"
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-slack").start()
+    return server, slack, slack.base_url
@@ -0,0 +1,626 @@
+"""
+In-memory fake of the Upstash Redis REST API, for benchmarks.
+
+Speaks the protocol upstash_redis uses: POST / with a JSON command array,
+POST /pipeline and /multi-exec with an array of them, answering {"result": ...}
+(or {"error": ...}), base64-encoding strings when the client sends
+Upstash-Encoding: base64. Holds strings, hashes, sets, lists and sorted sets
+with expiry, which covers every command the bot sends.
+
+There is no Lua interpreter: the bot's EVAL scripts are emulated in Python,
+keyed by their exact source (see SCRIPTS). An unknown script is an error, so a
+script edited without updating its emulation here fails loudly.
+"""
+from __future__ import annotations
+import base64
+import fnmatch
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from typing import Any, Callable, Dict, List, Optional
+
+from bench._http import QuietHTTPServer
+
+
+class CommandError(Exception):
+    pass
+
+
+def _s(value: Any) -> str:
+    return value if isinstance(value, str) else json.dumps(value) if isinstance(value, (list, dict)) else str(value)
+
+
+def _num(value: Any) -> float:
+    return float(value)
+
+
+def _lua_str(value: float) -> str:
+    # tostring() of a number in Redis' Lua 5.1
+    return "%.14g" % value
+
+
+class FakeRedis:
+    """
+    A single-threaded Redis data model guarded by one lock, like the real thing.
+    """
+
+    def __init__(self):
+        self.data: Dict[str, Any] = {}
+        self.expires: Dict[str, float] = {}
+        self.lock = threading.RLock()
+        self.commands = 0
+        # HTTP round trips served (a pipeline or transaction counts once)
+        self.requests = 0
+
+    # ---- keyspace ----
+
+    def _alive(self, key: str) -> bool:
+        at = self.expires.get(key)
+        if at is not None and at <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _get(self, key: str, kind: type, create: bool = False):
+        if not self._alive(key):
+            if not create:
+                return None
+            self.data[key] = kind()
+        value = self.data[key]
+        if not isinstance(value, kind):
+            raise CommandError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _cleanup(self, key: str):
+        value = self.data.get(key)
+        if value is not None and not isinstance(value, str) and len(value) == 0:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+    def execute(self, command: List[Any]) -> Any:
+        if not command:
+            raise CommandError("ERR empty command")
+        name = str(command[0]).lower()
+        fn = getattr(self, f"cmd_{name}", None)
+        if fn is None:
+            raise CommandError(f"ERR unknown command '{name}'")
+        with self.lock:
+            self.commands += 1
+            return fn(*[_s(a) for a in command[1:]])
+
+    call = execute
+
+    def r(self, *command) -> Any:
+        # redis.call() for script emulations
+        return self.execute(list(command))
+
+    # ---- generic ----
+
+    def cmd_del(self, *keys):
+        n = 0
+        for key in keys:
+            if self._alive(key):
+                del self.data[key]
+                self.expires.pop(key, None)
+                n += 1
+        return n
+
+    def cmd_exists(self, *keys):
+        return sum(1 for key in keys if self._alive(key))
+
+    def cmd_expire(self, key, seconds):
+        if not self._alive(key):
+            return 0
+        self.expires[key] = time.time() + int(seconds)
+        return 1
+
+    def cmd_ttl(self, key):
+        if not self._alive(key):
+            return -2
+        at = self.expires.get(key)
+        return -1 if at is None else int(at - time.time())
+
+    def cmd_flushall(self, *args):
+        self.data.clear()
+        self.expires.clear()
+        return "OK"
+
+    def cmd_ping(self, *args):
+        return "PONG"
+
+    def cmd_time(self):
+        sec, usec = divmod(int(time.time() * 1_000_000), 1_000_000)
+        return [str(sec), str(usec)]
+
+    # ---- strings ----
+
+    def cmd_get(self, key):
+        return self._get(key, str)
+
+    def cmd_set(self, key, value, *opts):
+        opts = [o.upper() for o in opts]
+        exists = self._alive(key)
+        if "NX" in opts and exists:
+            return None
+        if "XX" in opts and not exists:
+            return None
+        self.data[key] = value
+        self.expires.pop(key, None)
+        for flag, scale in (("EX", 1.0), ("PX", 0.001)):
+            if flag in opts:
+                self.expires[key] = time.time() + float(opts[opts.index(flag) + 1]) * scale
+        return "OK"
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, 1)
+
+    def cmd_incrby(self, key, amount):
+        value = int(self._get(key, str) or 0) + int(amount)
+        self.data[key] = str(value)
+        return value
+
+    # ---- hashes ----
+
+    def cmd_hset(self, key, *pairs):
+        h = self._get(key, dict, create=True)
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in h
+            h[field] = value
+        return added
+
+    def cmd_hsetnx(self, key, field, value):
+        h = self._get(key, dict, create=True)
+        if field in h:
+            return 0
+        h[field] = value
+        return 1
+
+    def cmd_hget(self, key, field):
+        return (self._get(key, dict) or {}).get(field)
+
+    def cmd_hmget(self, key, *fields):
+        h = self._get(key, dict) or {}
+        return [h.get(f) for f in fields]
+
+    def cmd_hgetall(self, key):
+        out = []
+        for field, value in (self._get(key, dict) or {}).items():
+            out += [field, value]
+        return out
+
+    def cmd_hvals(self, key):
+        return list((self._get(key, dict) or {}).values())
+
+    def cmd_hdel(self, key, *fields):
+        h = self._get(key, dict) or {}
+        n = sum(1 for f in fields if h.pop(f, None) is not None)
+        self._cleanup(key)
+        return n
+
+    def cmd_hincrby(self, key, field, amount):
+        h = self._get(key, dict, create=True)
+        h[field] = str(int(h.get(field, 0)) + int(amount))
+        return int(h[field])
+
+    def cmd_hincrbyfloat(self, key, field, amount):
+        h = self._get(key, dict, create=True)
+        value = float(h.get(field, 0)) + float(amount)
+        h[field] = repr(value)
+        return h[field]
+
+    def cmd_hlen(self, key):
+        return len(self._get(key, dict) or {})
+
+    def cmd_hscan(self, key, cursor, *opts):
+        return self._scan(list((self._get(key, dict) or {}).items()), cursor, opts, pairs=True)
+
+    # ---- sets ----
+
+    def cmd_sadd(self, key, *members):
+        s = self._get(key, set, create=True)
+        before = len(s)
+        s.update(members)
+        return len(s) - before
+
+    def cmd_srem(self, key, *members):
+        s = self._get(key, set) or set()
+        n = sum(1 for m in members if m in s)
+        s.difference_update(members)
+        self._cleanup(key)
+        return n
+
+    def cmd_scard(self, key):
+        return len(self._get(key, set) or ())
+
+    def cmd_sismember(self, key, member):
+        return int(member in (self._get(key, set) or ()))
+
+    def cmd_smembers(self, key):
+        return sorted(self._get(key, set) or ())
+
+    def cmd_sscan(self, key, cursor, *opts):
+        return self._scan(sorted(self._get(key, set) or ()), cursor, opts)
+
+    def _store(self, dest, members: set) -> int:
+        self.cmd_del(dest)
+        if members:
+            self.data[dest] = set(members)
+        return len(members)
+
+    def _sets(self, keys) -> List[set]:
+        return [self._get(k, set) or set() for k in keys]
+
+    def cmd_sdiffstore(self, dest, first, *others):
+        first_set, *rest = self._sets((first, *others))
+        return self._store(dest, first_set.difference(*rest))
+
+    def cmd_sinterstore(self, dest, *keys):
+        sets = self._sets(keys)
+        return self._store(dest, set.intersection(*sets) if sets else set())
+
+    def cmd_sunionstore(self, dest, *keys):
+        return self._store(dest, set().union(*self._sets(keys)))
+
+    # ---- lists ----
+
+    def cmd_lpush(self, key, *values):
+        lst = self._get(key, list, create=True)
+        for v in values:
+            lst.insert(0, v)
+        return len(lst)
+
+    def cmd_rpush(self, key, *values):
+        lst = self._get(key, list, create=True)
+        lst.extend(values)
+        return len(lst)
+
+    def cmd_llen(self, key):
+        return len(self._get(key, list) or ())
+
+    @staticmethod
+    def _range(length: int, start, stop):
+        start, stop = int(start), int(stop)
+        if start < 0:
+            start = max(0, length + start)
+        if stop < 0:
+            stop = length + stop
+        return start, min(stop, length - 1)
+
+    def cmd_lrange(self, key, start, stop):
+        lst = self._get(key, list) or []
+        start, stop = self._range(len(lst), start, stop)
+        return lst[start:stop + 1] if start <= stop else []
+
+    def cmd_ltrim(self, key, start, stop):
+        lst = self._get(key, list)
+        if lst is None:
+            return "OK"
+        start, stop = self._range(len(lst), start, stop)
+        lst[:] = lst[start:stop + 1] if start <= stop else []
+        self._cleanup(key)
+        return "OK"
+
+    def cmd_lrem(self, key, count, value):
+        lst = self._get(key, list) or []
+        count = int(count)
+        removed = 0
+        order = range(len(lst)) if count >= 0 else range(len(lst) - 1, -1, -1)
+        keep = [True] * len(lst)
+        for i in order:
+            if lst[i] == value and (count == 0 or removed < abs(count)):
+                keep[i] = False
+                removed += 1
+        lst[:] = [v for v, k in zip(lst, keep) if k]
+        self._cleanup(key)
+        return removed
+
+    def cmd_lmove(self, source, dest, wherefrom, whereto):
+        src = self._get(source, list)
+        if not src:
+            return None
+        value = src.pop(0 if wherefrom.upper() == "LEFT" else -1)
+        self._cleanup(source)
+        dst = self._get(dest, list, create=True)
+        if whereto.upper() == "LEFT":
+            dst.insert(0, value)
+        else:
+            dst.append(value)
+        return value
+
+    # ---- sorted sets ----
+
+    def cmd_zadd(self, key, *args):
+        flags = set()
+        args = list(args)
+        while args and args[0].upper() in ("NX", "XX", "GT", "LT", "CH"):
+            flags.add(args.pop(0).upper())
+        z = self._get(key, dict, create=True)
+        added = 0
+        for score, member in zip(args[::2], args[1::2]):
+            if "XX" in flags and member not in z:
+                continue
+            if "NX" in flags and member in z:
+                continue
+            added += member not in z
+            z[member] = _num(score)
+        self._cleanup(key)
+        return added
+
+    def cmd_zrem(self, key, *members):
+        z = self._get(key, dict) or {}
+        n = sum(1 for m in members if z.pop(m, None) is not None)
+        self._cleanup(key)
+        return n
+
+    def cmd_zcard(self, key):
+        return len(self._get(key, dict) or {})
+
+    def cmd_zrangebyscore(self, key, low, high):
+        lo = float("-inf") if low == "-inf" else _num(low)
+        hi = float("inf") if high in ("+inf", "inf") else _num(high)
+        z = self._get(key, dict) or {}
+        return [m for m, s in sorted(z.items(), key=lambda kv: (kv[1], kv[0])) if lo <= s <= hi]
+
+    def cmd_zcount(self, key, low, high):
+        return len(self.cmd_zrangebyscore(key, low, high))
+
+    # ---- scanning ----
+
+    def _scan(self, items: list, cursor, opts, pairs: bool = False):
+        opts = [o.upper() if i % 2 == 0 else o for i, o in enumerate(opts)]
+        count = int(opts[opts.index("COUNT") + 1]) if "COUNT" in opts else 10
+        match = opts[opts.index("MATCH") + 1] if "MATCH" in opts else None
+        start = int(cursor)
+        page = items[start:start + count]
+        nxt = start + count if start + count < len(items) else 0
+        out = []
+        for item in page:
+            name = item[0] if pairs else item
+            if match and not fnmatch.fnmatchcase(name, match):
+                continue
+            out += list(item) if pairs else [item]
+        return [str(nxt), out]
+
+    # ---- scripting ----
+
+    def cmd_eval(self, script, numkeys, *rest):
+        numkeys = int(numkeys)
+        keys, args = list(rest[:numkeys]), list(rest[numkeys:])
+        emulation = SCRIPTS.get(script)
+        if emulation is None:
+            raise CommandError("ERR fake_upstash has no emulation for this script")
+        return emulation(self, keys, args)
+
+
+# ---- script emulations (same KEYS / ARGV contract as the Lua sources) ----
+
+def _enqueue(r: FakeRedis, keys, args):
+    if r.r("SET", keys[0], "1", "NX", "EX", args[1]):
+        r.r("LPUSH", keys[1], args[0])
+        return 1
+    return 0
+
+
+def _claim(r: FakeRedis, keys, args):
+    now = _num(args[0])
+    reaped = 0
+    for i in range(1, len(keys), 2):
+        expired = r.r("ZRANGEBYSCORE", keys[i + 1], "-inf", now)
+        for item in expired:
+            if r.r("LREM", keys[0], 1, item) > 0:
+                r.r("RPUSH", keys[i], item)
+            r.r("ZREM", keys[i + 1], item)
+        reaped += len(expired)
+    item, lane = None, 0
+    for i in range(1, len(keys), 2):
+        item = r.r("LMOVE", keys[i], keys[0], "RIGHT", "LEFT")
+        if item:
+            r.r("ZADD", keys[i + 1], now + _num(args[1]), item)
+            lane = (i + 1) // 2
+            break
+    pending = sum(r.r("LLEN", keys[i]) for i in range(1, len(keys), 2))
+    top = r.r("LLEN", keys[1]) + r.r("ZCARD", keys[2])
+    return [item, lane, pending, reaped, top]
+
+
+def _requeue(r: FakeRedis, keys, args):
+    r.r("ZREM", keys[2], args[0])
+    if r.r("LREM", keys[1], 1, args[0]) > 0:
+        r.r("RPUSH", keys[0], args[0])
+        return 1
+    return 0
+
+
+def _claim_slice(r: FakeRedis, keys, args):
+    listed = r.r("LRANGE", keys[0], args[0], args[1])
+    claimed = [ch for ch in listed if r.r("HSETNX", keys[1], ch, "pending") == 1]
+    return [len(listed), claimed]
+
+
+def _first_delivery(r: FakeRedis, keys, args):
+    if r.r("HSETNX", keys[0], "first_delivery_ms", args[0]) == 1:
+        r.r("LPUSH", keys[1], args[0])
+        r.r("LTRIM", keys[1], 0, int(args[1]) - 1)
+        return 1
+    return 0
+
+
+def _throughput(r: FakeRedis, keys, args):
+    rate, limited, weight = _num(args[0]), _num(args[1]), _num(args[2])
+    current = r.r("HMGET", keys[0], "msgs_per_sec", "ratelimited_per_msg")
+    if current[0] is not None:
+        rate = _num(current[0]) + weight * (rate - _num(current[0]))
+        limited = _num(current[1] or 0) + weight * (limited - _num(current[1] or 0))
+    r.r("HSET", keys[0], "msgs_per_sec", _lua_str(rate), "ratelimited_per_msg", _lua_str(limited), "updated_at", args[3])
+    r.r("HINCRBY", keys[0], "samples", 1)
+    return _lua_str(rate)
+
+
+def _server_ms(r: FakeRedis) -> int:
+    sec, usec = r.r("TIME")
+    return int(sec) * 1000 + int(usec) // 1000
+
+
+def _gcra(r: FakeRedis, keys, args):
+    now = _server_ms(r)
+    pause = _num(r.r("GET", keys[1]) or 0)
+    if pause > now:
+        return int(pause - now)
+    interval, tolerance = _num(args[0]), _num(args[1])
+    tat = max(_num(r.r("GET", keys[0]) or 0), now)
+    if tat - tolerance > now:
+        return int(-(-(tat - tolerance - now) // 1))
+    new_tat = tat + interval
+    r.r("SET", keys[0], _lua_str(new_tat), "PX", int(-(-(new_tat - now + tolerance) // 1)) + 1000)
+    return 0
+
+
+def _pause(r: FakeRedis, keys, args):
+    until = _server_ms(r) + int(_num(args[0]))
+    if until > _num(r.r("GET", keys[0]) or 0):
+        r.r("SET", keys[0], str(until), "PX", args[1])
+    return 1
+
+
+def _membership(r: FakeRedis, keys, args):
+    if r.r("SET", keys[0], "1", "NX", "EX", args[2]) is None:
+        return -1
+    if args[0] == "add":
+        if r.r("EXISTS", keys[2]) == 1:
+            r.r("SADD", keys[2], args[1])
+        return r.r("SADD", keys[1], args[1])
+    r.r("HDEL", keys[3], f"{args[1]}:failures", f"{args[1]}:last_error")
+    return r.r("SREM", keys[1], args[1])
+
+
+def _health(r: FakeRedis, keys, args):
+    threshold = int(args[0])
+    pruned = 0
+    for i in range(3, len(args), 3):
+        ch, err = args[i], args[i + 1]
+        r.r("HSET", keys[0], f"{ch}:last_error", err)
+        drop = args[i + 2] == "1"
+        if not drop:
+            drop = r.r("HINCRBY", keys[0], f"{ch}:failures", 1) >= threshold
+        if drop:
+            if r.r("SREM", keys[1], ch) == 1:
+                r.r("RPUSH", keys[2], f"{ch} ({err})")
+                pruned += 1
+            r.r("HDEL", keys[0], f"{ch}:failures", f"{ch}:last_error")
+    r.r("EXPIRE", keys[0], args[2])
+    if pruned > 0:
+        r.r("EXPIRE", keys[2], args[1])
+    return pruned
+
+
+def _reconcile_page(r: FakeRedis, keys, args):
+    ids = args[2:]
+    added = 0
+    if ids:
+        r.r("SADD", keys[0], *ids)
+        added = r.r("SADD", keys[1], *ids)
+    r.r("EXPIRE", keys[0], args[1])
+    r.r("HSET", keys[2], "cursor", args[0])
+    r.r("HINCRBY", keys[2], "added", added)
+    r.r("HINCRBY", keys[2], "pages", 1)
+    r.r("EXPIRE", keys[2], args[1])
+    return added
+
+
+def _load_scripts() -> Dict[str, Callable]:
+    from api import _channels, _jobs, _metrics, _queue, _ratelimit, _reconcile
+
+    return {
+        _queue._ENQUEUE_SCRIPT: _enqueue,
+        _queue._CLAIM_SCRIPT: _claim,
+        _queue._REQUEUE_SCRIPT: _requeue,
+        _jobs._CLAIM_SLICE_SCRIPT: _claim_slice,
+        _jobs._FIRST_DELIVERY_SCRIPT: _first_delivery,
+        _metrics._THROUGHPUT_SCRIPT: _throughput,
+        _ratelimit._GCRA_SCRIPT: _gcra,
+        _ratelimit._PAUSE_SCRIPT: _pause,
+        _channels._MEMBERSHIP_SCRIPT: _membership,
+        _channels._HEALTH_SCRIPT: _health,
+        _reconcile._PAGE_SCRIPT: _reconcile_page,
+    }
+
+
+SCRIPTS: Dict[str, Callable] = {}
+
+
+# ---- REST protocol ----
+
+def _encode(value: Any, b64: bool) -> Any:
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float):
+        return int(value)
+    if isinstance(value, str):
+        return base64.b64encode(value.encode("utf-8")).decode("ascii") if b64 else value
+    if isinstance(value, (list, tuple)):
+        return [_encode(v, b64) for v in value]
+    return value
+
+
+def _reply(store: FakeRedis, command, b64: bool) -> Dict[str, Any]:
+    try:
+        return {"result": _encode(store.execute(command), b64)}
+    except CommandError as e:
+        return {"error": str(e)}
+
+
+
+def make_handler(store: FakeRedis, latency_seconds: float = 0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            b64 = (self.headers.get("Upstash-Encoding") or "").lower() == "base64"
+            try:
+                payload = json.loads(body or b"[]")
+            except ValueError:
+                return self._send(400, {"error": "ERR invalid JSON"})
+            if latency_seconds:
+                time.sleep(latency_seconds)
+            with store.lock:
+                store.requests += 1
+
+            path = self.path.split("?")[0].rstrip("/")
+            if path in ("/pipeline", "/multi-exec"):
+                if path == "/multi-exec":
+                    # Whole transaction under the store lock, like MULTI/EXEC
+                    with store.lock:
+                        replies = [_reply(store, c, b64) for c in payload]
+                else:
+                    replies = [_reply(store, c, b64) for c in payload]
+                return self._send(200, replies)
+            reply = _reply(store, payload, b64)
+            self._send(400 if "error" in reply else 200, reply)
+
+        def _send(self, status: int, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def start(host: str = "127.0.0.1", port: int = 0, latency_seconds: float = 0.0, store: Optional[FakeRedis] = None):
+    """
+    Serves a FakeRedis on a background thread. Returns (server, store, base URL).
+    """
+    if not SCRIPTS:
+        SCRIPTS.update(_load_scripts())
+    store = store or FakeRedis()
+    server = QuietHTTPServer((host, port), make_handler(store, latency_seconds))
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-upstash").start()
+    return server, store, f"http://{host}:{server.server_address[1]}"
@@ -0,0 +1,247 @@
+"""
+Delivery throughput benchmark for the worker.
+
+Runs the real api/worker.py drain loop against a fake Slack (bench.fake_slack)
+and an in-memory fake of the Upstash REST API (bench.fake_upstash), both served
+over HTTP from this process, so every post and every Redis command takes the
+same code path and wire format as in production:
+
+    python -m bench.throughput                       # 100, 1,000 and 10,000 channels
+    python -m bench.throughput --sizes 1000 --latency-ms 120 --slack-rate 50
+    python -m bench.throughput --json
+    python -m bench.throughput --attachment-kb 512  # with a file shared to every channel
+
+Each scenario seeds the tracked-channel set, queues one broadcast and measures
+from enqueue to the summary DM. The worker runs in a fresh interpreter (its
+settings are read at import); triggers that would start another /api/worker
+invocation start another drain there instead, up to --invocations at once, each
+with its own time budget, so sharding, hand-offs and re-leasing all happen.
+Reports messages/s, wall time, Slack 429s and retries, p50/p99 latency of a
+single chat.postMessage round trip, and Redis commands per message.
+Needs the packages from requirements.txt installed.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+from bench import fake_slack, fake_upstash
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SIZES = (100, 1000, 10000)
+BENCH_USER = "UBENCH"
+
+# Fixed for every scenario; worker tunables (BROADCAST_CONCURRENCY,
+# DELIVERY_SLICE_SIZE, ...) are taken from the environment when set
+BENCH_ENV = {
+    "SLACK_BOT_TOKEN": "xoxb-bench",
+    "SLACK_SIGNING_SECRET": "bench-signing-secret",
+    "SLACK_BOT_USER_ID": "UBENCHBOT",
+    "SLACK_TEAM_ID": "TBENCH",
+    "WORKER_SECRET": "bench-worker-secret",
+    "PUBLIC_BASE_URL": "http://127.0.0.1:9",
+    "KV_REST_API_TOKEN": "bench",
+}
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def _child(invocations: int, budget: float, timeout: float, attachment_bytes: int = 0) -> Dict:
+    """
+    Runs inside the worker interpreter: queues the broadcast, drives drains and
+    returns the client-side measurements.
+    """
+    import threading
+    import time
+
+    import api.worker as worker
+    from api._jobs import new_job_id
+    from api._queue import enqueue
+    from api._trigger import set_worker_trigger
+
+    latencies: List[float] = []
+    ratelimited = [0]
+    lock = threading.Lock()
+    real_post_json = worker.post_json
+
+    def timed_post_json(method, body, token):
+        started = time.perf_counter()
+        resp, headers = real_post_json(method, body, token)
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            ratelimited[0] += resp.get("error") == "ratelimited"
+        return resp, headers
+
+    done = threading.Event()
+    summary: Dict = {}
+    real_send_summary = worker._send_summary
+
+    def send_summary(queued_by, total, job_summary, job):
+        summary.update(job_summary)
+        real_send_summary(queued_by, total, job_summary, job)
+        done.set()
+
+    worker.post_json = timed_post_json
+    worker._send_summary = send_summary
+
+    # Stands in for Vercel starting /api/worker invocations
+    state = {"running": 0, "wanted": False, "started": 0, "handed_off": 0}
+
+    def run():
+        while True:
+            _, stats = worker.drain_queue(time.monotonic() + budget)
+            with lock:
+                state["handed_off"] += stats["handed_off"]
+                if not state["wanted"]:
+                    state["running"] -= 1
+                    return
+                state["wanted"] = False
+                state["started"] += 1
+
+    def trigger():
+        with lock:
+            if state["running"] >= invocations:
+                state["wanted"] = True
+                return
+            state["running"] += 1
+            state["started"] += 1
+        threading.Thread(target=run, daemon=True).start()
+
+    set_worker_trigger(trigger)
+
+    job = {
+        "job_id": new_job_id(),
+        "queued_at": round(time.time(), 3),
+        "queued_by": BENCH_USER,
+        "title": "Benchmark",
+        "category": "Release",
+        "body": "Delivery throughput benchmark.",
+        "link": None,
+    }
+    if attachment_bytes:
+        base = os.environ["SLACK_API_BASE_URL"]
+        job["file"] = {"id": "FBENCH", "name": "bench.bin", "title": "bench.bin", "size": attachment_bytes, "url": f"{base}/files/FBENCH"}
+    started = time.monotonic()
+    enqueue(json.dumps(job), lane="normal")
+    trigger()
+    finished = done.wait(timeout)
+    wall = time.monotonic() - started
+
+    return {
+        "finished": finished,
+        "wall_seconds": wall,
+        "sent": summary.get("sent", 0),
+        "failed": summary.get("failed", 0),
+        "posts": len(latencies),
+        "retries": ratelimited[0],
+        "p50_ms": _percentile(latencies, 50),
+        "p99_ms": _percentile(latencies, 99),
+        "invocations": state["started"],
+        "hand_offs": state["handed_off"],
+    }
+
+
+def run_scenario(channels: int, args) -> Dict:
+    from api._channels import CHANNEL_SET_KEY
+
+    slack_server, slack, slack_url = fake_slack.start(
+        slack=fake_slack.FakeSlack(
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            rate_per_second=args.slack_rate or None,
+            burst=args.slack_burst,
+            download_bytes=int(args.attachment_kb * 1024),
+        )
+    )
+    redis_server, store, redis_url = fake_upstash.start(latency_seconds=args.redis_latency_ms / 1000)
+    store.cmd_sadd(CHANNEL_SET_KEY, *[f"C{i:08d}" for i in range(channels)])
+    try:
+        env = dict(os.environ)
+        env.setdefault("BROADCAST_RATE_PER_SECOND", str(args.rate))
+        env.update(BENCH_ENV)
+        env.update({
+            "KV_REST_API_URL": redis_url,
+            "SLACK_API_BASE_URL": slack_url,
+            "MAX_BROADCAST_CHANNELS": str(max(channels, int(env.get("MAX_BROADCAST_CHANNELS") or 0))),
+            "PYTHONPATH": ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        })
+        code = f"import json, bench.throughput as t; print(json.dumps(t._child({args.invocations}, {args.budget}, {args.timeout}, {int(args.attachment_kb * 1024)})))"
+        proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{channels} channels: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+    finally:
+        slack_server.shutdown()
+        redis_server.shutdown()
+
+    wall = result["wall_seconds"]
+    return {
+        "channels": channels,
+        "finished": result["finished"],
+        "sent": result["sent"],
+        "failed": result["failed"],
+        "wall_seconds": round(wall, 2),
+        "msgs_per_second": round(result["sent"] / wall, 1) if wall else 0.0,
+        "retries": result["retries"],
+        "slack_429s": sum(slack.ratelimited.values()),
+        "post_p50_ms": round(result["p50_ms"], 1),
+        "post_p99_ms": round(result["p99_ms"], 1),
+        "invocations": result["invocations"],
+        "hand_offs": result["hand_offs"],
+        "redis_cmds_per_msg": round(store.commands / max(1, result["sent"]), 2),
+        "uploads": slack.uploads,
+        "uploaded_mb": round(slack.uploaded_bytes / 1024 / 1024, 2),
+        "file_shares": slack.file_shares,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="channel counts to run")
+    parser.add_argument("--rate", type=float, default=100.0, help="BROADCAST_RATE_PER_SECOND, unless set in the environment")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="fake Slack response time")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--slack-rate", type=float, default=100.0, help="fake Slack limit per method (req/s); 0 disables 429s")
+    parser.add_argument("--slack-burst", type=float, default=None, help="fake Slack burst (default: one second's worth)")
+    parser.add_argument("--redis-latency-ms", type=float, default=0.0, help="added to every fake Upstash request")
+    parser.add_argument("--invocations", type=int, default=10, help="concurrent worker invocations allowed")
+    parser.add_argument("--budget", type=float, default=8.0, help="time budget per worker invocation (s)")
+    parser.add_argument("--attachment-kb", type=float, default=0, help="attach a file of this size to the broadcast")
+    parser.add_argument("--timeout", type=float, default=900.0, help="give up on a scenario after this many seconds")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = [run_scenario(n, args) for n in args.sizes]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'channels':>8} {'sent':>7} {'wall':>9} {'msgs/s':>8} {'retries':>8} {'429s':>6} {'p50':>9} {'p99':>9} {'invocations':>12} {'redis/msg':>10}")
+        for r in results:
+            print(
+                f"{r['channels']:>8} {r['sent']:>7} {r['wall_seconds']:>8.2f}s {r['msgs_per_second']:>8.1f} "
+                f"{r['retries']:>8} {r['slack_429s']:>6} {r['post_p50_ms']:>7.1f}ms {r['post_p99_ms']:>7.1f}ms "
+                f"{r['invocations']:>12} {r['redis_cmds_per_msg']:>10.2f}"
+            )
+        if args.attachment_kb:
+            for r in results:
+                print(f"{r['channels']} channels: attachment uploaded {r['uploads']}x ({r['uploaded_mb']} MB), shared to {r['file_shares']} channels")
+
+    unfinished = [r["channels"] for r in results if not r["finished"] or r["sent"] + r["failed"] != r["channels"]]
+    if unfinished:
+        print(f"Incomplete broadcasts: {unfinished}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Standalone mode: one long-running asyncio process serving every endpoint.
+
+    python server.py --host 0.0.0.0 --port 3000
+
+Mounts /api/slack, /api/interactions, /api/events and /api/worker (the same
+handler classes Vercel runs), so all requests share one Redis client, one Slack
+client and the delivery thread pools. Broadcasts run as in-process background
+tasks: trigger_worker_async() schedules a queue drain here instead of making an
+HTTP request to /api/worker. Configure it with the same environment variables;
+PUBLIC_BASE_URL is not needed.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import importlib
+import os
+import signal
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import Parser
+from http.client import HTTPMessage
+
+ROUTES = {
+    "/api/slack": "api.slack",
+    "/api/interactions": "api.interactions",
+    "/api/events": "api.events",
+    "/api/worker": "api.worker",
+}
+
+SERVER_REQUEST_THREADS = int(os.environ.get("SERVER_REQUEST_THREADS", "16"))
+SERVER_WORKER_TASKS = int(os.environ.get("SERVER_WORKER_TASKS", "4"))
+# No platform timeout here; each drain still checkpoints and re-leases per slice
+SERVER_WORKER_BUDGET_SECONDS = float(os.environ.get("SERVER_WORKER_BUDGET_SECONDS", "60"))
+MAX_BODY_BYTES = 1024 * 1024
+READ_TIMEOUT_SECONDS = 10
+
+
+class _ResponseWriter:
+    """
+    wfile for a handler running in a thread: bytes go straight to the asyncio
+    transport, so a handler that acks first and then runs deferred work gets its
+    response on the wire before that work starts.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, writer: asyncio.StreamWriter):
+        self._loop = loop
+        self._writer = writer
+        self.written = 0
+
+    def write(self, data) -> int:
+        self.written += len(data)
+        self._loop.call_soon_threadsafe(self._writer.write, bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class _BodyReader:
+    def __init__(self, body: bytes):
+        self._body = body
+        self._pos = 0
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._body) if size is None or size < 0 else self._pos + size
+        chunk = self._body[self._pos:end]
+        self._pos += len(chunk)
+        return chunk
+
+
+def _run_handler(handler_cls, method: str, target: str, version: str, headers: HTTPMessage, body: bytes, wfile, peer):
+    h = handler_cls.__new__(handler_cls)
+    h.rfile, h.wfile = _BodyReader(body), wfile
+    h.headers, h.path, h.command = headers, target, method
+    h.request_version, h.requestline = version, f"{method} {target} {version}"
+    h.client_address, h.server, h.close_connection = peer, None, True
+    do = getattr(h, f"do_{method}", None)
+    if do is None:
+        h.send_error(501, f"Unsupported method ({method})")
+        return
+    do()
+
+
+class BackgroundWorker:
+    """
+    In-process replacement for the HTTP worker trigger: each trigger runs
+    api.worker.drain_queue() on a worker thread, at most SERVER_WORKER_TASKS at
+    once. Triggers arriving while all are busy collapse into one follow-up run.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, concurrency: int, budget_seconds: float):
+        self._loop = loop
+        self._concurrency = max(1, concurrency)
+        self._budget = budget_seconds
+        self._executor = ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix="drain")
+        self._running = 0
+        self._wanted = False
+
+    def trigger(self):
+        # Called from any thread (handlers, delivery threads, drains)
+        self._loop.call_soon_threadsafe(self._start)
+
+    def _start(self):
+        if self._running >= self._concurrency:
+            self._wanted = True
+            return
+        self._running += 1
+        future = self._loop.run_in_executor(self._executor, self._drain)
+        future.add_done_callback(self._done)
+
+    def _drain(self):
+        from api import _metrics
+        from api.worker import drain_queue
+
+        try:
+            results, stats = drain_queue(time.monotonic() + self._budget)
+        finally:
+            _metrics.flush()
+        if results:
+            print(f"Worker drained {stats['jobs']} item(s), {stats['posted']} message(s) in {stats['busy_seconds']}s")
+
+    def _done(self, future: asyncio.Future):
+        self._running -= 1
+        if future.exception() is not None:
+            print(f"Worker drain failed: {future.exception()!r}")
+        if self._wanted:
+            self._wanted = False
+            self._start()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class Server:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._executor = ThreadPoolExecutor(max_workers=SERVER_REQUEST_THREADS, thread_name_prefix="request")
+        self._handlers = {path: importlib.import_module(module).handler for path, module in ROUTES.items()}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername") or ("", 0)
+        try:
+            request = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT_SECONDS)
+            if request is None:
+                return
+            method, target, version, headers, body = request
+
+            handler_cls = self._handlers.get(urllib.parse.urlsplit(target).path.rstrip("/"))
+            if handler_cls is None:
+                writer.write(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+
+            wfile = _ResponseWriter(self._loop, writer)
+            try:
+                await self._loop.run_in_executor(
+                    self._executor, _run_handler, handler_cls, method, target, version, headers, body, wfile, peer
+                )
+            except Exception as e:
+                print(f"{method} {target} failed: {e!r}")
+                if not wfile.written:
+                    writer.write(b"HTTP/1.0 500 Internal Server Error\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("iso-8859-1").split("\r\n")
+        parts = lines[0].split()
+        if len(parts) != 3:
+            return None
+        method, target, version = parts
+        headers = Parser(_class=HTTPMessage).parsestr("\r\n".join(lines[1:]))
+        length = int(headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError("request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, target, version, headers, body
+
+
+async def _serve(host: str, port: int):
+    loop = asyncio.get_running_loop()
+
+    from api._trigger import set_worker_trigger
+
+    worker = BackgroundWorker(loop, SERVER_WORKER_TASKS, SERVER_WORKER_BUDGET_SECONDS)
+    set_worker_trigger(worker.trigger)
+    app = Server(loop)
+
+    server = await asyncio.start_server(app.handle, host, port)
+    print(f"Serving {', '.join(ROUTES)} on http://{host}:{port}")
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    # Pick up anything queued while the server was down
+    worker.trigger()
+    async with server:
+        await stop.wait()
+    set_worker_trigger(None)
+    # In-flight drains checkpoint per slice; let them finish their current work
+    await loop.run_in_executor(None, worker.shutdown)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run every endpoint in one asyncio process.")
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "3000")))
+    args = parser.parse_args(argv)
+    asyncio.run(_serve(args.host, args.port))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+The api modules run against the benchmark fakes (bench/fake_slack.py,
+bench/fake_upstash.py), started once per session before any api import: a few
+modules read their endpoints at import time.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench import fake_slack, fake_upstash  # noqa: E402
+from bench.throughput import BENCH_ENV  # noqa: E402
+
+os.environ.update(BENCH_ENV)
+_slack_server, _slack, _slack_url = fake_slack.start()
+os.environ["SLACK_API_BASE_URL"] = _slack_url
+_redis_server, _store, _redis_url = fake_upstash.start()
+os.environ["KV_REST_API_URL"] = _redis_url
+
+
+@pytest.fixture
+def store():
+    with _store.lock:
+        _store.data.clear()
+        _store.expires.clear()
+    return _store
+
+
+@pytest.fixture
+def slack():
+    _slack.calls.clear()
+    _slack.ratelimited.clear()
+    _slack.dms.clear()
+    _slack.rate_per_second = None
+    _slack.latency_ms = 0
+    _slack.jitter_ms = 0
+    return _slack
+
+
+@pytest.fixture
+def no_trigger():
+    """
+    Worker re-triggers are recorded instead of calling PUBLIC_BASE_URL.
+    """
+    from api._trigger import set_worker_trigger
+
+    fired = []
+    set_worker_trigger(lambda: fired.append(1))
+    yield fired
+    set_worker_trigger(None)
+
+
+@pytest.fixture
+def call():
+    return call_handler
+
+
+def call_handler(module: str, method: str, target: str, body: bytes = b"", headers=None):
+    """
+    Runs one request through api.<module>.handler the way server.py does.
+    Returns (status, headers, body).
+    """
+    import importlib
+    import io
+    from email.parser import Parser
+    from http.client import HTTPMessage
+
+    from server import _run_handler
+
+    raw = "".join(f"{k}: {v}\r\n" for k, v in (headers or {}).items())
+    raw += f"Content-Length: {len(body)}\r\n\r\n"
+    handler_cls = importlib.import_module(f"api.{module}").handler
+    out = io.BytesIO()
+    _run_handler(handler_cls, method, target, "HTTP/1.1", Parser(_class=HTTPMessage).parsestr(raw), body, out, ("127.0.0.1", 0))
+    head, _, payload = out.getvalue().partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    parsed = dict(line.split(": ", 1) for line in header_lines if ": " in line)
+    return int(status_line.split()[1]), parsed, payload
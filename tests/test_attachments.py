@@ -0,0 +1,73 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from api import _attachments
+from api._jobs import job_key
+
+
+@pytest.fixture
+def hosts():
+    """
+    Two local servers reached under different host names: "origin" redirects
+    every GET to "cdn", and both record the Authorization header they got.
+    """
+    seen = {}
+
+    def serve(name, respond):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                seen[name] = self.headers.get("Authorization")
+                respond(self)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def ok(h):
+        h.send_response(200)
+        h.send_header("Content-Length", "2")
+        h.end_headers()
+        h.wfile.write(b"ok")
+
+    cdn = serve("cdn", ok)
+    cdn_url = f"http://localhost:{cdn.server_address[1]}/file"
+
+    def redirect(h):
+        h.send_response(302)
+        h.send_header("Location", cdn_url if h.path == "/away" else "/file-here")
+        h.send_header("Content-Length", "0")
+        h.end_headers()
+
+    origin = serve("origin", lambda h: ok(h) if h.path == "/file-here" else redirect(h))
+    yield f"http://127.0.0.1:{origin.server_address[1]}", seen
+    for server in (origin, cdn):
+        server.shutdown()
+        server.server_close()
+
+
+def test_redirect_to_another_host_drops_the_token(hosts):
+    base, seen = hosts
+    conn, resp = _attachments._open(f"{base}/away", headers={"Authorization": "Bearer xoxb-1"})
+    assert resp.read() == b"ok"
+    conn.close()
+    assert seen == {"origin": "Bearer xoxb-1", "cdn": None}
+
+
+def test_redirect_on_the_same_host_keeps_the_token(hosts):
+    base, seen = hosts
+    conn, resp = _attachments._open(f"{base}/here", headers={"Authorization": "Bearer xoxb-1"})
+    assert resp.read() == b"ok"
+    conn.close()
+    assert seen == {"origin": "Bearer xoxb-1"}
+
+
+def test_share_left_pending_counts_as_failed(store):
+    store.cmd_hset(job_key("J1", "files"), "0:0", "F1", "0:100", "error: not_in_channel", "1:200", "pending")
+    failures = _attachments.share_failures("J1")
+    assert sorted(failures) == ["0:100", "1:200"]
+    assert failures["0:100"] == "not_in_channel"
@@ -0,0 +1,53 @@
+import pytest
+
+from api import _auth
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(store, monkeypatch):
+    monkeypatch.setattr(_auth, "_allowed_cache", {})
+    monkeypatch.setattr(_auth, "_cache_version", None)
+    monkeypatch.setattr(_auth, "_version_checked_at", float("-inf"))
+
+
+def test_cached_answer_is_served(store):
+    store.cmd_sadd(_auth.ALLOWED_BROADCASTERS_KEY, "U1", "U2")
+    assert _auth.user_allowed("U1")
+
+    # Edited without a version bump: the cache still answers until its TTL
+    store.cmd_srem(_auth.ALLOWED_BROADCASTERS_KEY, "U1")
+    assert _auth.user_allowed("U1")
+
+
+def test_version_bump_revokes_cached_access(store, monkeypatch):
+    store.cmd_sadd(_auth.ALLOWED_BROADCASTERS_KEY, "U1", "U2")
+    assert _auth.user_allowed("U1")
+
+    store.cmd_srem(_auth.ALLOWED_BROADCASTERS_KEY, "U1")
+    store.cmd_incr(_auth.ALLOWED_BROADCASTERS_VERSION_KEY)
+    # Seen at the next version check
+    monkeypatch.setattr(_auth, "_version_checked_at", float("-inf"))
+    assert not _auth.user_allowed("U1")
+    assert _auth.user_allowed("U2")
+
+
+def test_cache_hit_within_check_interval_costs_no_round_trip(store):
+    store.cmd_sadd(_auth.ALLOWED_BROADCASTERS_KEY, "U1")
+    before = store.requests
+    assert _auth.user_allowed("U1")
+    assert store.requests - before == 1
+
+    before = store.requests
+    for _ in range(5):
+        assert _auth.user_allowed("U1")
+    assert store.requests == before
+
+
+def test_version_check_is_one_round_trip(store, monkeypatch):
+    store.cmd_sadd(_auth.ALLOWED_BROADCASTERS_KEY, "U1")
+    assert _auth.user_allowed("U1")
+
+    monkeypatch.setattr(_auth, "AUTH_VERSION_CHECK_SECONDS", 0)
+    before = store.requests
+    assert _auth.user_allowed("U1")
+    assert store.requests - before == 1
@@ -0,0 +1,32 @@
+import argparse
+
+from bench import throughput
+
+
+def test_small_scenario_delivers_every_channel():
+    args = argparse.Namespace(
+        rate=1000.0,
+        latency_ms=1.0,
+        jitter_ms=0.0,
+        slack_rate=0.0,
+        slack_burst=None,
+        redis_latency_ms=0.0,
+        invocations=2,
+        budget=5.0,
+        attachment_kb=0,
+        timeout=60.0,
+    )
+    result = throughput.run_scenario(120, args)
+    assert result["finished"]
+    assert (result["sent"], result["failed"]) == (120, 0)
+    assert result["slack_429s"] == 0
+    assert result["redis_cmds_per_msg"] > 0
+
+
+def test_main_reports_incomplete_broadcasts(monkeypatch, capsys):
+    monkeypatch.setattr(throughput, "run_scenario", lambda n, args: {
+        "channels": n, "finished": False, "sent": n - 1, "failed": 0, "wall_seconds": 1.0, "msgs_per_second": 1.0,
+        "retries": 0, "slack_429s": 0, "post_p50_ms": 1.0, "post_p99_ms": 1.0, "invocations": 1, "redis_cmds_per_msg": 1.0,
+    })
+    assert throughput.main(["--sizes", "10"]) == 1
+    assert "Incomplete broadcasts: [10]" in capsys.readouterr().err
@@ -0,0 +1,126 @@
+import time
+
+import pytest
+
+from api import _channels, _reconcile
+from api._channels import CHANNEL_HEALTH_KEY, CHANNEL_SET_KEY, RECONCILE_SEEN_KEY
+from api._redis import RedisBatch
+
+PRUNED_KEY = "test:pruned"
+
+
+def record(results):
+    batch = RedisBatch()
+    _channels.queue_channel_health(batch, results, PRUNED_KEY, 60)
+    batch.flush()
+
+
+def health(store) -> dict:
+    values = store.cmd_hgetall(CHANNEL_HEALTH_KEY) or []
+    return dict(zip(values[::2], values[1::2]))
+
+
+def test_pruned_channel_leaves_no_health_fields(store):
+    store.cmd_sadd(CHANNEL_SET_KEY, "C1", "C2")
+    record([("C1", False, "restricted_action"), ("C2", False, "restricted_action")])
+    assert set(health(store)) == {"C1:failures", "C1:last_error", "C2:failures", "C2:last_error"}
+    assert store.cmd_ttl(CHANNEL_HEALTH_KEY) > 0
+
+    record([("C1", False, "channel_not_found"), ("C2", True, None)])
+    assert health(store) == {}
+    assert store.cmd_smembers(CHANNEL_SET_KEY) == ["C2"]
+
+
+def test_removed_channel_leaves_no_health_fields(store):
+    store.cmd_sadd(CHANNEL_SET_KEY, "C1", "C2")
+    record([("C1", False, "restricted_action"), ("C2", False, "restricted_action")])
+
+    assert _channels.apply_membership_event("remove", "C1", "test:dedup:1", 60) == 1
+    assert set(health(store)) == {"C2:failures", "C2:last_error"}
+
+
+def test_reconcile_prune_clears_health_fields(store):
+    store.cmd_sadd(CHANNEL_SET_KEY, "C1", "C2")
+    record([("C1", False, "restricted_action"), ("C2", False, "restricted_action")])
+
+    store.cmd_sadd(RECONCILE_SEEN_KEY, "C2")
+    assert _reconcile._prune() == 1
+    assert set(health(store)) == {"C2:failures", "C2:last_error"}
+
+
+def test_stream_visits_every_channel_once_per_page(store):
+    channels = [f"C{i:04d}" for i in range(1050)]
+    store.cmd_sadd(CHANNEL_SET_KEY, *channels)
+    seen = []
+
+    def on_batch(batch, page):
+        seen.extend(page)
+        batch.sadd("test:copy", *page)
+
+    before = store.requests
+    assert _channels.stream_channels_into(on_batch, batch_size=100) == len(channels)
+    assert sorted(seen) == channels
+    assert sorted(store.cmd_smembers("test:copy")) == channels
+    # The writes of each page ride along with the next SSCAN: one request per page
+    # (the fake returns pages of exactly `batch_size`), plus the first
+    assert store.requests - before <= len(channels) // 100 + 2
+
+
+def test_stream_of_empty_set_calls_nothing(store):
+    assert _channels.stream_channels_into(lambda batch, page: pytest.fail("called")) == 0
+
+
+def test_channel_meta_leaves_out_channels_without_fields(store):
+    store.cmd_hset(f"{_channels.CHANNEL_META_KEY_PREFIX}:C1", "partner_name", "Acme", "greeting", "Hi")
+    store.cmd_hset(f"{_channels.CHANNEL_META_KEY_PREFIX}:C2", "other", "x")
+    before = store.requests
+    assert _channels.channel_meta(["C1", "C2", "C3"], ["partner_name"]) == {"C1": {"partner_name": "Acme"}}
+    assert store.requests - before == 1
+
+
+class PagedSlack:
+    """
+    users.conversations over `channels`, `per_page` at a time, each page taking `delay` seconds.
+    """
+
+    def __init__(self, channels, per_page=2, delay=0.0):
+        self.channels, self.per_page, self.delay = channels, per_page, delay
+        self.pages = 0
+
+    def users_conversations(self, cursor=None, **_):
+        time.sleep(self.delay)
+        self.pages += 1
+        at = int(cursor or 0)
+        page = self.channels[at:at + self.per_page]
+        more = at + self.per_page < len(self.channels)
+        return {"channels": [{"id": ch} for ch in page], "response_metadata": {"next_cursor": str(at + self.per_page) if more else ""}}
+
+
+def test_reconcile_resumes_and_keeps_joins_made_meanwhile(store):
+    from api._delivery import RateLimiter
+
+    store.cmd_sadd(CHANNEL_SET_KEY, "C1", "C9")
+    slack = PagedSlack(["C1", "C2", "C3", "C4", "C5"], delay=0.1)
+
+    # Out of time after the first page: progress stays in Redis
+    finished, stats = _reconcile.run_reconcile(slack, RateLimiter(1000), time.monotonic() + 0.15)
+    assert not finished and stats["pages"] == 1
+
+    # Joined while the reconcile runs, but not in its listing
+    _channels.apply_membership_event("add", "C7", "test:dedup:join", 60)
+
+    slack.delay = 0
+    finished, stats = _reconcile.run_reconcile(slack, RateLimiter(1000), time.monotonic() + 5)
+    assert finished
+    assert stats == {"added": 4, "removed": 1, "pages": 3, "tracked": 6}
+    assert store.cmd_smembers(CHANNEL_SET_KEY) == ["C1", "C2", "C3", "C4", "C5", "C7"]
+    assert slack.pages == 3
+
+
+def test_empty_listing_prunes_nothing(store):
+    from api._delivery import RateLimiter
+
+    store.cmd_sadd(CHANNEL_SET_KEY, "C1", "C2")
+    finished, stats = _reconcile.run_reconcile(PagedSlack([]), RateLimiter(1000), time.monotonic() + 5)
+    assert finished and stats["removed"] == 0
+    assert store.cmd_smembers(CHANNEL_SET_KEY) == ["C1", "C2"]
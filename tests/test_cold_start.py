@@ -0,0 +1,18 @@
+"""
+A fresh interpreter per handler (bench/cold_start.py): what a new instance
+imports before its first response.
+"""
+import os
+
+import pytest
+
+from bench import cold_start
+
+
+@pytest.mark.parametrize("module", cold_start.HANDLERS)
+def test_first_request_loads_no_heavy_client(module):
+    sample = cold_start.run_once(module, os.environ["KV_REST_API_URL"])
+    assert sample["status"].split()[1] == ("401" if module == "api.worker" else "200")
+    # Nothing in these requests talks to Redis or the Slack Web API
+    assert "upstash_redis" not in sample["loaded"]
+    assert "slack_sdk" not in sample["loaded"]
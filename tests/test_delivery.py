@@ -0,0 +1,397 @@
+import json
+import threading
+import time
+
+import pytest
+
+from api import worker
+from api._attachments import ATTACHMENT_TMP_DIR
+from api._channels import CHANNEL_SET_KEY
+from api._jobs import job_key, new_job_id
+from api._queue import LANES, claim, enqueue, lane_for, queue_lane_load
+from api._redis import RedisBatch
+
+
+@pytest.fixture
+def small_slices(monkeypatch):
+    monkeypatch.setattr(worker, "DELIVERY_SLICE_SIZE", 10)
+    monkeypatch.setattr(worker, "BROADCAST_CONCURRENCY", 8)
+    monkeypatch.setattr(worker, "BROADCAST_RATE_PER_SECOND", 1000.0)
+    # Lets a short drain start a slice at all
+    monkeypatch.setattr(worker, "EXPECTED_POST_LATENCY_SECONDS", 0.001)
+
+
+def track(store, n: int):
+    channels = [f"C{i:08d}" for i in range(n)]
+    store.cmd_sadd(CHANNEL_SET_KEY, *channels)
+    return channels
+
+
+def queue_broadcast(**fields) -> str:
+    job = {
+        "job_id": new_job_id(),
+        "queued_at": round(time.time(), 3),
+        "queued_by": "U1",
+        "title": "Test",
+        "category": "Release",
+        "body": "Body",
+        "link": None,
+    }
+    job.update(fields)
+    enqueue(json.dumps(job), lane=lane_for(job["category"], job.get("type") or "broadcast"))
+    return job["job_id"]
+
+
+def drain_until_done(job_id: str, store, budget: float = 5.0, rounds: int = 50):
+    for _ in range(rounds):
+        worker.drain_queue(time.monotonic() + budget)
+        counts = store.cmd_hgetall(job_key(job_id, "counts")) or []
+        if "shards_done" in counts[::2]:
+            return
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def posts(slack, method: str = "chat.postMessage") -> int:
+    return slack.calls.get(method, 0) - (len(slack.dms) if method == "chat.postMessage" else 0)
+
+
+def test_shard_stopped_after_prefetch_resumes_every_channel(store, slack, no_trigger, small_slices):
+    channels = track(store, 40)
+    slack.latency_ms = 100
+    job_id = queue_broadcast()
+
+    # Short drains: the first plans the job, then each delivers one slice, claims
+    # the next one along with the checkpoint and stops for its deadline
+    while not posts(slack):
+        worker.drain_queue(time.monotonic() + 0.3)
+    assert posts(slack) < len(channels)
+
+    slack.latency_ms = 0
+    drain_until_done(job_id, store)
+    assert posts(slack) == len(channels)
+    status = dict(zip(*[iter(store.cmd_hgetall(job_key(job_id, "status")))] * 2))
+    assert sorted(status) == channels
+    assert "pending" not in status.values()
+
+
+def test_retract_beyond_tier_rate_stops_at_deadline(store, slack, no_trigger, small_slices, monkeypatch):
+    from api import _ratelimit
+
+    channels = track(store, 40)
+    job_id = queue_broadcast()
+    drain_until_done(job_id, store)
+
+    # chat.delete is tier 3: far fewer deletes fit in one budget than there are channels
+    monkeypatch.setitem(_ratelimit.TIER_RATES, "tier3", 5.0)
+    monkeypatch.setattr(worker, "DELIVERY_SLICE_SIZE", 50)
+    retract_id = queue_broadcast(type="retract", target_job=job_id)
+
+    budget = 2.0
+    started = time.monotonic()
+    worker.drain_queue(started + budget)
+    assert time.monotonic() - started < budget + 1.0
+    assert 0 < posts(slack, "chat.delete") < len(channels)
+
+    drain_until_done(retract_id, store, budget=budget)
+    assert posts(slack, "chat.delete") == len(channels)
+    status = dict(zip(*[iter(store.cmd_hgetall(job_key(retract_id, "status")))] * 2))
+    assert sorted(status) == channels
+    assert "pending" not in status.values()
+    assert store.cmd_hget(job_key(retract_id, "counts"), "shards_done") == "1"
+
+
+def test_retraction_stops_a_shard_at_the_next_slice(store, slack, no_trigger, small_slices, monkeypatch):
+    from api._jobs import mark_retracted
+
+    track(store, 40)
+    job_id = queue_broadcast()
+    fan_out = worker.fan_out
+
+    def retract_after_first_slice(*args, **kwargs):
+        results = fan_out(*args, **kwargs)
+        mark_retracted(job_id)
+        return results
+
+    monkeypatch.setattr(worker, "fan_out", retract_after_first_slice)
+    drain_until_done(job_id, store)
+
+    assert posts(slack) == 10
+    assert "pending" not in (store.cmd_hgetall(job_key(job_id, "status")) or [])[1::2]
+    assert "the broadcast was retracted" in slack.dms[-1]["text"]
+
+
+def test_retraction_does_not_yield_to_top_lane(store, slack, no_trigger, small_slices, monkeypatch):
+    from api import _ratelimit
+
+    monkeypatch.setitem(_ratelimit.TIER_RATES, "tier3", 1000.0)
+    channels = track(store, 20)
+    job_id = queue_broadcast()
+    drain_until_done(job_id, store)
+
+    queue_broadcast(category="Incident")
+    assert claim(lease_seconds=30).lane == "high"
+    retract_id = queue_broadcast(type="retract", target_job=job_id)
+
+    results, _ = worker.drain_queue(time.monotonic() + 5.0)
+    assert not any(r.get("yielded") for r in results)
+    assert store.cmd_hget(job_key(retract_id, "counts"), "shards_done") == "1"
+    assert posts(slack, "chat.delete") == len(channels)
+
+
+def test_channel_without_link_value_gets_no_button(store, slack, no_trigger, small_slices, monkeypatch):
+    from api._channels import CHANNEL_META_KEY_PREFIX
+
+    channels = track(store, 2)
+    store.cmd_hset(f"{CHANNEL_META_KEY_PREFIX}:{channels[0]}", "partner_url", "https://example.com/acme")
+    sent = {}
+    timed_post = worker._timed_post
+
+    def record(method, body, stats):
+        message = json.loads(body)
+        sent[message["channel"]] = [b for b in message["blocks"] if b["type"] == "actions"]
+        return timed_post(method, body, stats)
+
+    monkeypatch.setattr(worker, "_timed_post", record)
+    drain_until_done(queue_broadcast(link="{{partner_url}}"), store)
+
+    assert sent[channels[0]][0]["elements"][0]["url"] == "https://example.com/acme"
+    assert sent[channels[1]] == []
+
+
+def test_expired_top_lane_lease_is_not_load(store):
+    queue_broadcast(category="Incident")
+    claim(lease_seconds=0)
+    batch = RedisBatch()
+    idx = queue_lane_load(batch, LANES[0])
+    results = batch.flush()
+    assert sum(results[i] for i in idx) == 0
+
+
+def test_yielded_job_resumes_after_dead_top_lane_lease(store, slack, no_trigger, small_slices, monkeypatch):
+    monkeypatch.setattr(worker, "LANE_YIELD_POLL_SECONDS", 0.2)
+    track(store, 20)
+    incident_id = queue_broadcast(category="Incident")
+    # Leased by a worker that died: the lease is live for another second
+    assert claim(lease_seconds=1).lane == "high"
+    release_id = queue_broadcast()
+
+    worker.drain_queue(time.monotonic() + 5.0)
+    for job_id in (incident_id, release_id):
+        assert store.cmd_hget(job_key(job_id, "counts"), "shards_done") == "1"
+    assert posts(slack) == 40
+
+
+def test_yield_hands_off_when_budget_runs_out(store, slack, no_trigger, small_slices, monkeypatch):
+    monkeypatch.setattr(worker, "LANE_YIELD_POLL_SECONDS", 5.0)
+    track(store, 20)
+    queue_broadcast(category="Incident")
+    claim(lease_seconds=30)
+    queue_broadcast()
+
+    results, stats = worker.drain_queue(time.monotonic() + 1.0)
+    assert results[-1].get("yielded")
+    assert stats["handed_off"] and no_trigger
+
+
+def test_failed_attachment_share_is_reported(store, slack, no_trigger, small_slices, monkeypatch):
+    import os
+
+    monkeypatch.setattr(worker, "FILE_SHARE_MAX_CHANNELS", 10)
+    slack.download_bytes = 1024
+    channels = track(store, 20)
+    shared = worker.upload_and_share
+
+    def upload_and_share(client, path, file, group):
+        if channels[0] in group:
+            raise RuntimeError("not_in_channel")
+        return shared(client, path, file, group)
+
+    monkeypatch.setattr(worker, "upload_and_share", upload_and_share)
+    sent = {}
+    timed_post = worker._timed_post
+
+    def record(method, body, stats):
+        message = json.loads(body)
+        sent[message["channel"]] = json.dumps(message.get("blocks"))
+        return timed_post(method, body, stats)
+
+    monkeypatch.setattr(worker, "_timed_post", record)
+    base = os.environ["SLACK_API_BASE_URL"]
+    job_id = queue_broadcast(file={"id": "FTEST", "name": "notes.pdf", "title": "notes.pdf", "size": 1024, "url": f"{base}/files/FTEST"})
+    drain_until_done(job_id, store)
+
+    assert slack.file_shares == 10
+    assert all("shared in this channel" not in sent[ch] for ch in channels[:10])
+    assert all("shared in this channel" in sent[ch] for ch in channels[10:])
+    assert "could not be shared with 10 channel(s)" in slack.dms[-1]["text"]
+    assert "not_in_channel" in slack.dms[-1]["text"]
+    assert not os.path.exists(os.path.join(ATTACHMENT_TMP_DIR, "partner_alert_bot-FTEST"))
+
+
+def test_fan_out_keeps_order_and_bounds_concurrency():
+    from api._delivery import RateLimiter, fan_out
+
+    lock = threading.Lock()
+    in_flight, peak = 0, 0
+
+    def post(ch):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.02)
+        with lock:
+            in_flight -= 1
+        return ch != "C3", "1.0" if ch != "C3" else "channel_not_found"
+
+    channels = [f"C{i}" for i in range(12)]
+    results = fan_out(channels, post, concurrency=4, limiter=RateLimiter(1000))
+    assert [ch for ch, _, _ in results] == channels
+    assert results[3] == ("C3", False, "channel_not_found")
+    assert peak == 4
+
+
+def test_fan_out_leaves_out_channels_past_the_deadline():
+    from api._delivery import RateLimiter, fan_out
+
+    # 5 per second, one at once: about three posts fit in half a second
+    results = fan_out([f"C{i}" for i in range(20)], lambda ch: (True, "1.0"), concurrency=2, limiter=RateLimiter(5, burst=1), deadline=time.monotonic() + 0.5)
+    assert 1 <= len(results) <= 5
+    posted = [int(ch[1:]) for ch, _, _ in results]
+    assert posted == sorted(posted) and posted[-1] < 8
+
+
+def test_rate_limiter_pause_holds_every_caller():
+    from api._delivery import RateLimiter
+
+    limiter = RateLimiter(1000)
+    limiter.pause(0.2)
+    started = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - started >= 0.19
+
+
+def test_shard_ranges_cover_every_channel_once():
+    from api._jobs import shard_ranges
+
+    assert shard_ranges(10, 3) == [[0, 4], [4, 7], [7, 10]]
+    assert shard_ranges(2, 8) == [[0, 1], [1, 2]]
+    assert shard_ranges(0, 4) == [[0, 0]]
+
+
+def test_sharded_broadcast_delivers_each_channel_once(store, slack, no_trigger, small_slices, monkeypatch):
+    from api._jobs import load_job
+
+    monkeypatch.setattr(worker, "SHARD_MIN_CHANNELS", 10)
+    # Ten posts per second per invocation: the rate budget feeds many shards
+    monkeypatch.setattr(worker, "BROADCAST_CONCURRENCY", 1)
+    monkeypatch.setattr(worker, "EXPECTED_POST_LATENCY_SECONDS", 0.1)
+    channels = track(store, 40)
+    job_id = queue_broadcast()
+    drain_until_done(job_id, store)
+
+    job, _ = load_job(job_id)
+    assert len(job["shards"]) == 4
+    # One worker woken per shard beyond the planner's own
+    assert len(no_trigger) >= 3
+    assert store.cmd_hget(job_key(job_id, "counts"), "shards_done") == "4"
+    assert posts(slack) == len(channels)
+    status = dict(zip(*[iter(store.cmd_hgetall(job_key(job_id, "status")))] * 2))
+    assert sorted(status) == channels
+    assert len(slack.dms) == 1
+
+
+def test_retry_posts_to_failed_channels_only(store, slack, no_trigger, small_slices):
+    from api._jobs import is_message_ts
+
+    channels = track(store, 10)
+    job_id = queue_broadcast()
+    drain_until_done(job_id, store)
+    # As if these had failed: retryable, permanent, and possibly posted before a crash
+    store.cmd_hset(
+        job_key(job_id, "status"),
+        channels[0], "restricted_action",
+        channels[1], "ratelimited",
+        channels[2], "channel_not_found",
+        channels[3], "pending",
+    )
+
+    before = posts(slack)
+    retry_id = queue_broadcast(retry_of=job_id)
+    drain_until_done(retry_id, store)
+
+    assert posts(slack) - before == 2
+    retried = dict(zip(*[iter(store.cmd_hgetall(job_key(retry_id, "status")))] * 2))
+    assert sorted(retried) == channels[:2]
+    # Deliveries are written back to the original job's ledger
+    ledger = dict(zip(*[iter(store.cmd_hgetall(job_key(job_id, "status")))] * 2))
+    assert all(is_message_ts(ledger[ch]) for ch in channels[:2])
+    assert ledger[channels[2]] == "channel_not_found"
+    assert slack.dms[-1]["text"].startswith("✅ Retry complete. Sent to 2/2")
+
+
+def test_one_invocation_drains_back_to_back_jobs(store, slack, no_trigger, small_slices):
+    track(store, 10)
+    job_ids = [queue_broadcast() for _ in range(3)]
+
+    results, stats = worker.drain_queue(time.monotonic() + 5.0)
+    for job_id in job_ids:
+        assert store.cmd_hget(job_key(job_id, "counts"), "shards_done") == "1"
+    assert posts(slack) == 30
+    # Planned and delivered: two items per job
+    assert stats["jobs"] == 6 and not stats["handed_off"]
+
+
+def test_unfinished_work_is_handed_off_once(store, slack, no_trigger, small_slices):
+    track(store, 40)
+    slack.latency_ms = 100
+    queue_broadcast()
+
+    results, stats = worker.drain_queue(time.monotonic() + 0.5)
+    assert results[-1].get("continued")
+    assert stats["handed_off"] and len(no_trigger) == 1
+
+
+def test_worker_endpoint_needs_the_secret(call, store):
+    status, _, _ = call("worker", "GET", "/api/worker?secret=wrong")
+    assert status == 401
+
+
+def test_crashed_invocation_resumes_from_its_last_checkpoint(store, slack, no_trigger, small_slices, monkeypatch):
+    from api._queue import LEASES_KEY
+
+    class Crash(BaseException):
+        pass
+
+    channels = track(store, 50)
+    job_id = queue_broadcast()
+    save_checkpoint = worker.save_checkpoint
+    saved = []
+
+    def crash_after_two(*args, **kwargs):
+        out = save_checkpoint(*args, **kwargs)
+        saved.append(1)
+        if len(saved) == 2:
+            raise Crash()
+        return out
+
+    monkeypatch.setattr(worker, "save_checkpoint", crash_after_two)
+    with pytest.raises(Crash):
+        drain_until_done(job_id, store)
+    monkeypatch.setattr(worker, "save_checkpoint", save_checkpoint)
+    assert posts(slack) == 20
+
+    # Nothing is delivered until the dead invocation's lease runs out
+    worker.drain_queue(time.monotonic() + 5)
+    assert posts(slack) == 20
+    for item in store.cmd_zrangebyscore(LEASES_KEY, "-inf", "+inf"):
+        store.cmd_zadd(LEASES_KEY, "0", item)
+    drain_until_done(job_id, store)
+
+    # The slice claimed with the last checkpoint may have gone out before the
+    # crash, so it stays claimed; everything else is posted exactly once
+    status = dict(zip(*[iter(store.cmd_hgetall(job_key(job_id, "status")))] * 2))
+    assert sorted(status) == channels
+    stuck = [ch for ch, value in status.items() if value == "pending"]
+    assert stuck == channels[20:30]
+    assert posts(slack) == len(channels) - len(stuck)
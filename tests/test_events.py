@@ -0,0 +1,76 @@
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+from api._channels import CHANNEL_SET_KEY
+
+
+def event(event_id: str, kind: str, channel: str, user=None):
+    body = json.dumps({
+        "type": "event_callback",
+        "event_id": event_id,
+        "event": {"type": kind, "user": user or os.environ["SLACK_BOT_USER_ID"], "channel": channel},
+    }).encode()
+    ts = str(int(time.time()))
+    sig = hmac.new(os.environ["SLACK_SIGNING_SECRET"].encode(), f"v0:{ts}:{body.decode()}".encode(), hashlib.sha256).hexdigest()
+    return body, {"X-Slack-Request-Timestamp": ts, "X-Slack-Signature": "v0=" + sig, "Content-Type": "application/json"}
+
+
+def test_join_and_leave(call, store):
+    status, _, _ = call("events", "POST", "/api/events", *event("Ev1", "member_joined_channel", "C1"))
+    assert status == 200
+    assert store.cmd_smembers(CHANNEL_SET_KEY) == ["C1"]
+
+    call("events", "POST", "/api/events", *event("Ev2", "member_left_channel", "C1"))
+    assert store.cmd_smembers(CHANNEL_SET_KEY) == []
+
+
+def test_retried_event_is_applied_once(call, store):
+    call("events", "POST", "/api/events", *event("Ev1", "member_joined_channel", "C1"))
+    call("events", "POST", "/api/events", *event("Ev2", "member_left_channel", "C1"))
+    # Slack retries the join after the leave went through: no resurrection
+    status, _, _ = call("events", "POST", "/api/events", *event("Ev1", "member_joined_channel", "C1"))
+    assert status == 200
+    assert store.cmd_smembers(CHANNEL_SET_KEY) == []
+
+
+def test_other_users_are_ignored(call, store):
+    call("events", "POST", "/api/events", *event("Ev1", "member_joined_channel", "C1", user="U_SOMEONE"))
+    assert store.cmd_smembers(CHANNEL_SET_KEY) == []
+
+
+def test_bad_signature_is_rejected(call, store):
+    body, headers = event("Ev1", "member_joined_channel", "C1")
+    headers["X-Slack-Signature"] = "v0=" + "0" * 64
+    status, _, _ = call("events", "POST", "/api/events", body, headers)
+    assert status == 401
+    assert store.cmd_smembers(CHANNEL_SET_KEY) == []
+
+
+def test_invite_burst_shares_round_trips(call, store, monkeypatch):
+    from api import _channels
+
+    writer = _channels._membership_writer
+    flush = writer._flush
+    flushes = []
+
+    def slow_flush(entries):
+        # A round trip long enough for the rest of the burst to queue up behind it
+        flushes.append(len(entries))
+        time.sleep(0.05)
+        flush(entries)
+
+    monkeypatch.setattr(writer, "_flush", slow_flush)
+    channels = [f"C{i:02d}" for i in range(24)]
+    requests = [event(f"Ev{ch}", "member_joined_channel", ch) for ch in channels]
+    threads = [threading.Thread(target=call, args=("events", "POST", "/api/events", *r)) for r in requests]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert store.cmd_smembers(CHANNEL_SET_KEY) == channels
+    assert sum(flushes) == len(channels)
+    assert len(flushes) <= 4
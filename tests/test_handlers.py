@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize("module", ["interactions", "slack", "events"])
+def test_get_health_check(call, store, module):
+    status, headers, body = call(module, "GET", f"/api/{module}")
+    assert status == 200
+    assert headers["Content-Type"] == "application/json"
+    assert json.loads(body)["ok"] is True
+
+
+def test_handler_timing_alone_is_not_flushed(call, store):
+    from api import _metrics
+
+    _metrics.snapshot(reset=True)
+    before = store.commands
+    call("interactions", "GET", "/api/interactions")
+    assert store.commands == before
+
+    # Goes out with the next request that recorded something else
+    _metrics.incr("test.requests")
+    call("interactions", "GET", "/api/interactions")
+    hist = _metrics.stored_histograms("handler.interactions.GET")["handler.interactions.GET"]
+    assert hist.count == 2
+
+
+def test_flush_does_not_make_the_next_request_flush(call, store):
+    from api import _metrics
+
+    _metrics.snapshot(reset=True)
+    _metrics.incr("test.requests")
+    call("interactions", "GET", "/api/interactions")
+
+    # Only handler timings were recorded since: nothing to send
+    before = store.requests
+    call("interactions", "GET", "/api/interactions")
+    call("interactions", "GET", "/api/interactions")
+    assert store.requests == before
@@ -0,0 +1,111 @@
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+from api import _auth, _deferred
+from api._queue import claim
+
+
+def signed(payload: dict):
+    body = urllib.parse.urlencode({"payload": json.dumps(payload)}).encode()
+    ts = str(int(time.time()))
+    sig = hmac.new(os.environ["SLACK_SIGNING_SECRET"].encode(), f"v0:{ts}:{body.decode()}".encode(), hashlib.sha256).hexdigest()
+    return body, {"X-Slack-Request-Timestamp": ts, "X-Slack-Signature": "v0=" + sig, "Content-Type": "application/x-www-form-urlencoded"}
+
+
+@pytest.fixture(autouse=True)
+def fresh_auth(monkeypatch):
+    monkeypatch.setattr(_auth, "_allowed_cache", {})
+    monkeypatch.setattr(_auth, "_version_checked_at", float("-inf"))
+
+
+def test_deferred_start_runs_before_run():
+    started = threading.Event()
+    deferred = _deferred.Deferred()
+    deferred.start(started.set)
+    assert started.wait(1)
+    deferred.run()
+
+
+def test_retry_keeps_the_original_lane(call, store, no_trigger):
+    from api._jobs import job_key
+
+    store.cmd_set(job_key("J1"), json.dumps({"job_id": "J1", "category": "Incident", "shards": [[0, 0]]}))
+    body, headers = signed({
+        "type": "block_actions",
+        "user": {"id": "U1"},
+        "actions": [{"action_id": "retry_failed", "value": "J1"}],
+        "message": {"ts": "1.0"},
+    })
+    status, _, _ = call("interactions", "POST", "/api/interactions", body, headers)
+
+    assert status == 200
+    claimed = claim()
+    assert claimed.lane == "high"
+    assert json.loads(claimed.item)["retry_of"] == "J1"
+
+
+def test_send_wakes_worker_before_the_ack(call, store, slack, monkeypatch):
+    events = []
+    from api._trigger import set_worker_trigger
+
+    set_worker_trigger(lambda: events.append("trigger"))
+    from api import interactions
+
+    sent = interactions.handler._send_json
+
+    def send_json(self, payload, status=200):
+        # Give a started thread the chance to run first, as it would on a real host
+        time.sleep(0.05)
+        events.append("ack")
+        sent(self, payload, status)
+
+    monkeypatch.setattr(interactions.handler, "_send_json", send_json)
+    try:
+        draft = {"title": "Hi", "category": "Release", "body": "Body", "link": None}
+        body, headers = signed({
+            "type": "block_actions",
+            "user": {"id": "U1"},
+            "actions": [{"action_id": "send_broadcast"}],
+            "view": {"id": "V1", "hash": "h", "private_metadata": json.dumps({"user_id": "U1", "draft": draft})},
+        })
+        status, _, _ = call("interactions", "POST", "/api/interactions", body, headers)
+    finally:
+        set_worker_trigger(None)
+
+    assert status == 200
+    assert events == ["trigger", "ack"]
+    assert slack.calls.get("views.update") == 1
+    assert json.loads(claim().item)["body"] == "Body"
+
+
+def test_review_shows_the_delivery_estimate(call, store):
+    from api._channels import CHANNEL_SET_KEY
+    from api._metrics import record_broadcast
+
+    store.cmd_sadd(CHANNEL_SET_KEY, *[f"C{i}" for i in range(300)])
+
+    def review():
+        body, headers = signed({
+            "type": "view_submission",
+            "user": {"id": "U1"},
+            "view": {
+                "callback_id": "broadcast_draft_submit",
+                "private_metadata": "{}",
+                "state": {"values": {"body_block": {"body_input": {"value": "Body"}}}},
+            },
+        })
+        status, _, raw = call("interactions", "POST", "/api/interactions", body, headers)
+        reply = json.loads(raw)
+        assert status == 200 and reply["response_action"] == "update"
+        return json.dumps(reply, ensure_ascii=False)
+
+    assert "Estimated delivery" not in review()
+    record_broadcast("J1", "broadcast", {"sent": 100, "seconds": 10.0})
+    assert "Estimated delivery: about 30s (10.0 msgs/s" in review()
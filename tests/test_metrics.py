@@ -0,0 +1,41 @@
+from api import _metrics
+from api._metrics import delivery_estimate, queue_throughput, record_broadcast, throughput_key
+from api._redis import RedisBatch
+
+
+def perf(sent: int, seconds: float, retries: int = 0):
+    return {"sent": sent, "seconds": seconds, "retries": retries}
+
+
+def read_model(kind: str = "broadcast"):
+    batch = RedisBatch()
+    idx = queue_throughput(batch, kind)
+    return batch.flush()[idx]
+
+
+def test_no_estimate_before_the_first_measured_job(store):
+    assert delivery_estimate(read_model(), 500) is None
+    assert delivery_estimate(["10", "0"], 0) is None
+
+
+def test_model_folds_each_job_into_the_average(store, monkeypatch):
+    monkeypatch.setattr(_metrics, "THROUGHPUT_EWMA_ALPHA", 0.5)
+    record_broadcast("J1", "broadcast", perf(100, 10.0))
+    # The first sample is taken as is
+    assert float(read_model()[0]) == 10.0
+
+    record_broadcast("J2", "broadcast", perf(300, 10.0, retries=30))
+    rate, limited = (float(v) for v in read_model())
+    assert rate == 20.0 and limited == 0.05
+    assert int(store.cmd_hget(throughput_key("broadcast"), "samples")) == 2
+
+    # Other job types have their own model; an empty job is not a sample
+    record_broadcast("J3", "edit", perf(0, 0.0))
+    assert read_model("edit") == [None, None]
+
+
+def test_estimate_text():
+    assert delivery_estimate(["20", "0"], 600) == "⏱ Estimated delivery: about 30s (20.0 msgs/s over recent broadcasts)"
+    assert delivery_estimate(["20", "0.25"], 6000) == (
+        "⏱ Estimated delivery: about 5 min (20.0 msgs/s over recent broadcasts, 25% of posts rate-limited)"
+    )
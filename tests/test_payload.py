@@ -0,0 +1,84 @@
+import json
+
+from api._blocks import build_broadcast_blocks
+from api._payload import PLACEHOLDER_MAX_CHARS, PayloadTemplate, Placeholders, fill_placeholders
+
+
+def render(title: str, body: str, link=None, meta=None):
+    placeholders = Placeholders()
+    title, body, link = placeholders.mark(title), placeholders.mark(body, mrkdwn=True), placeholders.mark(link, url=True)
+    values = placeholders.values(meta or {})
+    if placeholders.drops_link(values):
+        link = None
+    blocks = build_broadcast_blocks(title=title, body=body, category="Release", sender_name="Bot", link=link)
+    payload = PayloadTemplate({"text": title, "blocks": blocks}, inline=tuple(placeholders.slots))
+    message = json.loads(payload.render(channel="C1", **values))
+    by_type = {}
+    for block in message["blocks"]:
+        by_type.setdefault(block["type"], block)
+    return by_type
+
+
+def test_long_header_value_fits_header_limit():
+    blocks = render("Update for {{partner_name}}", "Body", meta={"partner_name": "P" * 300})
+    header = blocks["header"]["text"]["text"]
+    assert len(header) <= 150
+    assert header.startswith("Release: Update for " + "P" * PLACEHOLDER_MAX_CHARS)
+
+
+def test_mark_at_cut_point_is_never_split():
+    title = "T" * 135 + "{{partner_name}}"
+    body = "B" * 2990 + "{{partner_name}} tail"
+    blocks = render(title, body, meta={"partner_name": "Acme"})
+    header = blocks["header"]["text"]["text"]
+    text = blocks["section"]["text"]["text"]
+    assert header == "Release: " + "T" * 135
+    assert len(text) <= 3000
+    assert "\ue000" not in header + text
+
+    # With room for the longest value, the placeholder is kept
+    blocks = render("T" * 50 + "{{partner_name}}", "Body", meta={"partner_name": "Acme"})
+    assert blocks["header"]["text"]["text"].endswith("T" * 50 + "Acme")
+
+
+def test_link_values_are_percent_encoded():
+    blocks = render(
+        "Docs for {{slug}}",
+        "Body",
+        link="https://docs.example.com/{{slug}}?ref={{ref|x}}",
+        meta={"slug": 'setup "guide"', "ref": "a&b c"},
+    )
+    assert blocks["actions"]["elements"][0]["url"] == "https://docs.example.com/setup%20%22guide%22?ref=a%26b%20c"
+    # The same placeholder outside the link keeps its plain value
+    assert blocks["header"]["text"]["text"] == 'Release: Docs for setup "guide"'
+
+
+def test_whole_link_value_is_kept_as_is():
+    url = "https://partners.example.com/accounts/" + "a" * 200 + "?tab=alerts&x=1"
+    blocks = render("Hi", "Body", link="{{partner_url}}", meta={"partner_url": url})
+    assert blocks["actions"]["elements"][0]["url"] == url
+
+
+def test_link_without_url_drops_the_button():
+    for meta in ({}, {"partner_url": ""}, {"partner_url": "not a url"}, {"partner_url": "javascript:alert(1)"}):
+        assert "actions" not in render("Hi", "Body", link="{{partner_url}}", meta=meta)
+
+    # The default stands in for a missing or unusable value
+    blocks = render("Hi", "Body", link="{{partner_url|https://example.com/partners}}", meta={"partner_url": "n/a"})
+    assert blocks["actions"]["elements"][0]["url"] == "https://example.com/partners"
+
+
+def test_mrkdwn_values_are_escaped():
+    blocks = render("For {{partner_name}}", "Hello {{partner_name}}", meta={"partner_name": "A&B <Ltd>"})
+    assert blocks["section"]["text"]["text"] == "Hello A&amp;B &lt;Ltd&gt;"
+    # The header is plain text
+    assert blocks["header"]["text"]["text"] == "Release: For A&B <Ltd>"
+
+    blocks = render("Hi", "{{partner_name}}", meta={"partner_name": "&" * 100})
+    assert blocks["section"]["text"]["text"] == "&amp;" * (PLACEHOLDER_MAX_CHARS // 5)
+
+
+def test_preview_link():
+    assert fill_placeholders("{{partner_url}}", {}, url=True) == ""
+    assert fill_placeholders("{{partner_url|https://example.com}}", {}, url=True) == "https://example.com"
+    assert fill_placeholders("https://example.com/{{slug}}", {}, url=True) == "https://example.com/slug"
@@ -0,0 +1,26 @@
+import time
+
+from api._ratelimit import DistributedRateLimiter
+
+
+def test_instances_share_one_schedule(store):
+    first = DistributedRateLimiter("T1", "tier3", rate=20, burst=1)
+    second = DistributedRateLimiter("T1", "tier3", rate=20, burst=1)
+
+    started = time.monotonic()
+    for _ in range(3):
+        first.acquire()
+        second.acquire()
+    # Six requests at 20/s, one at a time: the last goes out ~250 ms in
+    assert time.monotonic() - started >= 0.2
+
+
+def test_pause_is_shared(store):
+    first = DistributedRateLimiter("T1", "tier3", rate=100)
+    second = DistributedRateLimiter("T1", "tier3", rate=100)
+
+    first.pause(0.3)
+    started = time.monotonic()
+    second.acquire()
+    assert time.monotonic() - started >= 0.25
+    assert second.throttled_seconds > 0
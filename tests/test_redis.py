@@ -0,0 +1,46 @@
+import pytest
+
+from api._redis import RedisBatch, decode, get_redis
+
+
+def test_batch_is_one_round_trip(store):
+    before = store.requests
+    batch = RedisBatch()
+    set_idx = batch.set("k", "v")
+    get_idx = batch.get("k")
+    incr_idx = batch.incr("n")
+    results = batch.flush()
+    assert store.requests - before == 1
+    assert (results[get_idx], results[incr_idx]) == ("v", 1)
+    assert batch.results == results and results[set_idx]
+
+
+def test_empty_batch_sends_nothing(store):
+    before = store.requests
+    assert RedisBatch().flush() == []
+    assert store.requests == before
+
+
+def test_context_manager_flushes_only_on_success(store):
+    with RedisBatch() as batch:
+        batch.sadd("s", "a", "b")
+    assert sorted(get_redis().smembers("s")) == ["a", "b"]
+
+    with pytest.raises(RuntimeError):
+        with RedisBatch() as batch:
+            batch.sadd("s", "c")
+            raise RuntimeError("stop")
+    assert sorted(get_redis().smembers("s")) == ["a", "b"]
+
+
+def test_transaction(store):
+    batch = RedisBatch(transaction=True)
+    batch.rpush("l", "x", "y")
+    len_idx = batch.llen("l")
+    assert batch.flush()[len_idx] == 2
+
+
+def test_decode():
+    assert decode(b"abc") == "abc"
+    assert decode("abc") == "abc"
+    assert decode(3) == "3"
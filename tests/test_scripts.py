@@ -0,0 +1,155 @@
+"""
+Every Lua script runs against bench/fake_upstash.py through a Python
+emulation. Here each script's real source runs too, in Lua 5.1 (the version
+Redis embeds) with redis.call() bound to a FakeRedis, and both must leave the
+same results and data behind.
+"""
+import pytest
+
+from bench import fake_upstash
+
+lua51 = pytest.importorskip("lupa.lua51")
+
+NOW = ("1760000000", "123456")
+
+
+def _arg(value) -> str:
+    # Lua numbers reach Redis formatted with %.17g
+    return "%.17g" % value if isinstance(value, float) else str(value)
+
+
+def run_lua(store: fake_upstash.FakeRedis, source: str, keys, args):
+    """
+    Runs `source` with the reply conversions of Redis: nil bulk -> false,
+    arrays -> tables, and back: numbers -> integers (truncated), false -> nil.
+    """
+    lua = lua51.LuaRuntime(unpack_returned_tuples=False)
+
+    def to_lua(value):
+        if value is None:
+            return False
+        if isinstance(value, (list, tuple)):
+            return lua.table_from([to_lua(v) for v in value])
+        return value
+
+    def to_redis(value):
+        if value is None or value is False:
+            return None
+        if value is True:
+            return 1
+        if isinstance(value, (int, float)):
+            return int(value)
+        if lua51.lua_type(value) == "table":
+            items = []
+            for i in range(1, len(value) + 1):
+                items.append(to_redis(value[i]))
+            return items
+        return value
+
+    g = lua.globals()
+    g.redis = lua.table_from({"call": lambda *command: to_lua(store.r(*[_arg(c) for c in command]))})
+    g.KEYS = lua.table_from([str(k) for k in keys])
+    g.ARGV = lua.table_from([str(a) for a in args])
+    return to_redis(lua.execute(source))
+
+
+def run_emulation(store: fake_upstash.FakeRedis, source: str, keys, args):
+    return store.r("EVAL", source, len(keys), *keys, *args)
+
+
+def fresh_store(setup) -> fake_upstash.FakeRedis:
+    store = fake_upstash.FakeRedis()
+    store.cmd_time = lambda: list(NOW)
+    for command in setup:
+        store.r(*command)
+    return store
+
+
+def scenarios():
+    from api import _channels, _jobs, _metrics, _queue, _ratelimit, _reconcile
+
+    claim_keys = ["processing", "pending:high", "leases:high", "pending", "leases"]
+    return {
+        "enqueue": ([], [
+            (_queue._ENQUEUE_SCRIPT, ["idem:a", "pending"], ["item-1", 60]),
+            (_queue._ENQUEUE_SCRIPT, ["idem:a", "pending"], ["item-1", 60]),
+            (_queue._ENQUEUE_SCRIPT, ["idem:b", "pending"], ["item-2", 60]),
+        ]),
+        "claim": ([
+            ("LPUSH", "pending", "n1", "n2"),
+            ("LPUSH", "processing", "h0"),
+            ("ZADD", "leases:high", "500", "h0"),
+        ], [
+            (_queue._CLAIM_SCRIPT, claim_keys, [1000, 30000]),
+            (_queue._CLAIM_SCRIPT, claim_keys, [1000.5, 30000]),
+            (_queue._CLAIM_SCRIPT, claim_keys, [2000, 30000]),
+            (_queue._CLAIM_SCRIPT, claim_keys, [40000, 30000]),
+            (_queue._REQUEUE_SCRIPT, ["pending", "processing", "leases"], ["n1"]),
+            (_queue._REQUEUE_SCRIPT, ["pending", "processing", "leases"], ["missing"]),
+        ]),
+        "slices": ([
+            ("RPUSH", "targets", "C1", "C2", "C3", "C4", "C5"),
+            ("HSET", "status", "C2", "1.0"),
+        ], [
+            (_jobs._CLAIM_SLICE_SCRIPT, ["targets", "status"], [0, 2]),
+            (_jobs._CLAIM_SLICE_SCRIPT, ["targets", "status"], [0, 9]),
+            (_jobs._FIRST_DELIVERY_SCRIPT, ["counts", "samples"], [1234, 2]),
+            (_jobs._FIRST_DELIVERY_SCRIPT, ["counts", "samples"], [999, 2]),
+            (_jobs._FIRST_DELIVERY_SCRIPT, ["counts2", "samples"], [88, 2]),
+            (_jobs._FIRST_DELIVERY_SCRIPT, ["counts3", "samples"], [77, 2]),
+        ]),
+        "throughput": ([], [
+            (_metrics._THROUGHPUT_SCRIPT, ["tp"], [10, 0, 0.333, 1]),
+            (_metrics._THROUGHPUT_SCRIPT, ["tp"], [13.7, 0.25, 0.333, 2]),
+            (_metrics._THROUGHPUT_SCRIPT, ["tp"], [12, 0.1, 0.333, 3]),
+        ]),
+        "rate limit": ([], [
+            (_ratelimit._GCRA_SCRIPT, ["tat", "pause"], [83.333, 250]),
+            (_ratelimit._GCRA_SCRIPT, ["tat", "pause"], [83.333, 250]),
+            (_ratelimit._GCRA_SCRIPT, ["tat", "pause"], [83.333, 250]),
+            (_ratelimit._GCRA_SCRIPT, ["tat", "pause"], [83.333, 250]),
+            (_ratelimit._GCRA_SCRIPT, ["tat", "pause"], [83.333, 250]),
+            (_ratelimit._PAUSE_SCRIPT, ["pause"], [1500, 2500]),
+            (_ratelimit._PAUSE_SCRIPT, ["pause"], [500, 1500]),
+            (_ratelimit._GCRA_SCRIPT, ["tat", "pause"], [83.333, 250]),
+        ]),
+        "membership": ([("HSET", "health", "C1:failures", "2", "C1:last_error", "x")], [
+            (_channels._MEMBERSHIP_SCRIPT, ["dedup:1", "channels", "seen", "health"], ["add", "C1", 60]),
+            (_channels._MEMBERSHIP_SCRIPT, ["dedup:1", "channels", "seen", "health"], ["add", "C1", 60]),
+            (_channels._MEMBERSHIP_SCRIPT, ["dedup:2", "channels", "seen", "health"], ["add", "C2", 60]),
+            ("SADD", "seen", "C0"),
+            (_channels._MEMBERSHIP_SCRIPT, ["dedup:3", "channels", "seen", "health"], ["add", "C3", 60]),
+            (_channels._MEMBERSHIP_SCRIPT, ["dedup:4", "channels", "seen", "health"], ["remove", "C1", 60]),
+            (_channels._MEMBERSHIP_SCRIPT, ["dedup:5", "channels", "seen", "health"], ["remove", "C9", 60]),
+        ]),
+        "health": ([("SADD", "channels", "C1", "C2", "C3")], [
+            (_channels._HEALTH_SCRIPT, ["health", "channels", "pruned"], [2, 60, 120, "C1", "restricted_action", "0", "C2", "channel_not_found", "1"]),
+            (_channels._HEALTH_SCRIPT, ["health", "channels", "pruned"], [2, 60, 120, "C1", "restricted_action", "0", "C3", "restricted_action", "0"]),
+            (_channels._HEALTH_SCRIPT, ["health", "channels", "pruned"], [2, 60, 120, "C2", "is_archived", "1"]),
+        ]),
+        "reconcile": ([("SADD", "channels", "C1")], [
+            (_reconcile._PAGE_SCRIPT, ["seen", "channels", "state"], ["c1", 600, "C1", "C2"]),
+            (_reconcile._PAGE_SCRIPT, ["seen", "channels", "state"], ["", 600]),
+        ]),
+    }
+
+
+@pytest.mark.parametrize("name", sorted(scenarios()))
+def test_emulation_matches_lua(name):
+    setup, steps = scenarios()[name]
+    lua_store, fake_store = fresh_store(setup), fresh_store(setup)
+    for step in steps:
+        if len(step) != 3 or not isinstance(step[1], list):
+            lua_store.r(*step)
+            fake_store.r(*step)
+            continue
+        source, keys, args = step
+        expected = run_lua(lua_store, source, keys, args)
+        assert run_emulation(fake_store, source, keys, args) == expected, (name, keys, args)
+    assert fake_store.data == lua_store.data
+    assert set(fake_store.expires) == set(lua_store.expires)
+
+
+def test_every_script_has_a_scenario():
+    covered = {step[0] for _, steps in scenarios().values() for step in steps if len(step) == 3 and isinstance(step[1], list)}
+    assert covered == set(fake_upstash.SCRIPTS)
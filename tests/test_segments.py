@@ -0,0 +1,46 @@
+from api._channels import CHANNEL_SET_KEY
+from api._jobs import job_key
+from api._segments import SEGMENT_INDEX_KEY, audience_count, list_segments, segment_sizes, tag_channels, untag_channels
+
+from tests.test_delivery import drain_until_done, posts, queue_broadcast, small_slices  # noqa: F401
+
+
+def test_tag_and_untag(store):
+    assert tag_channels("emea", ["C1", "C2"]) == 2
+    assert tag_channels("emea", ["C2", "C3"]) == 1
+    assert list_segments() == ["emea"]
+    assert segment_sizes(["emea", "apac"]) == {"emea": 3, "apac": 0}
+
+    assert untag_channels("emea", ["C1", "C9"]) == (1, 2)
+    # An emptied segment leaves the picker
+    assert untag_channels("emea", ["C2", "C3"]) == (2, 0)
+    assert list_segments() == []
+    assert not store.cmd_sismember(SEGMENT_INDEX_KEY, "emea")
+
+
+def test_audience_is_computed_from_tracked_channels(store):
+    store.cmd_sadd(CHANNEL_SET_KEY, "C1", "C2", "C3", "C4")
+    tag_channels("emea", ["C1", "C2", "C9"])  # C9: the bot has left it
+    tag_channels("tier-1", ["C2", "C3"])
+    tag_channels("paused", ["C3"])
+
+    assert audience_count({"segments": ["emea"]}) == 2
+    assert audience_count({"segments": ["emea", "tier-1"]}) == 3
+    assert audience_count({"segments": ["emea", "tier-1"], "match": "all"}) == 1
+    assert audience_count({"segments": ["emea", "tier-1"], "exclude": ["paused"]}) == 2
+    assert audience_count({"exclude": ["paused"]}) == 3
+    # The preview set is not left behind
+    assert not [k for k in store.data if k.startswith("partner_alert_bot:audience")]
+
+
+def test_targeted_broadcast_reaches_only_the_audience(store, slack, no_trigger, small_slices):  # noqa: F811
+    store.cmd_sadd(CHANNEL_SET_KEY, *[f"C{i:03d}" for i in range(30)])
+    tag_channels("emea", ["C001", "C002", "C003", "C900"])
+    tag_channels("paused", ["C002"])
+
+    job_id = queue_broadcast(audience={"segments": ["emea"], "match": "any", "exclude": ["paused"]})
+    drain_until_done(job_id, store)
+
+    assert posts(slack) == 2
+    delivered = store.cmd_hgetall(job_key(job_id, "status"))[::2]
+    assert sorted(delivered) == ["C001", "C003"]
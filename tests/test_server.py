@@ -0,0 +1,86 @@
+import asyncio
+import http.client
+import json
+import threading
+import time
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def served():
+    """
+    server.Server on an event loop in a background thread. Yields (loop, port).
+    """
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    box = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        app = server.Server(loop)
+        box["server"] = loop.run_until_complete(asyncio.start_server(app.handle, "127.0.0.1", 0))
+        box["port"] = box["server"].sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+        # Connections still open finish before the loop closes
+        box["server"].close()
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert ready.wait(5)
+    yield loop, box["port"]
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+
+def get(port: int, path: str, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        conn.request("GET", path, headers=headers or {})
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+    finally:
+        conn.close()
+
+
+def test_every_route_is_mounted(served, store):
+    _, port = served
+    for path in ("/api/slack", "/api/interactions", "/api/events"):
+        status, body = get(port, path)
+        assert status == 200 and json.loads(body)["ok"] is True
+    assert get(port, "/api/worker?secret=wrong")[0] == 401
+    assert get(port, "/api/nowhere")[0] == 404
+
+
+def test_oversized_body_is_refused(served, store):
+    _, port = served
+    with pytest.raises((http.client.HTTPException, ConnectionError)):
+        get(port, "/api/events", headers={"Content-Length": str(server.MAX_BODY_BYTES + 1)})
+
+
+def test_triggers_while_busy_collapse_into_one_more_drain(served, store, monkeypatch):
+    from api import worker as worker_module
+
+    loop, _ = served
+    drains = []
+
+    def drain_queue(deadline):
+        drains.append(time.monotonic())
+        time.sleep(0.2)
+        return [], {}
+
+    monkeypatch.setattr(worker_module, "drain_queue", drain_queue)
+    background = server.BackgroundWorker(loop, concurrency=1, budget_seconds=1.0)
+    for _ in range(5):
+        background.trigger()
+    time.sleep(0.8)
+    background.shutdown()
+    assert len(drains) == 2
@@ -0,0 +1,91 @@
+import socket
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+from api import _slack_http
+
+
+class RawServer:
+    """
+    Accepts connections and answers each request with `respond(n)`'s bytes (n =
+    requests seen so far), or closes the connection when it returns None. With
+    `close_idle`, a connection is closed right after each answer, like an idle
+    keep-alive connection the peer timed out.
+    """
+
+    def __init__(self, respond, close_idle: bool = False):
+        self.respond = respond
+        self.close_idle = close_idle
+        self.requests = 0
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.sock.getsockname()[1]}/api"
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            buf = b""
+            while True:
+                while b"\r\n\r\n" not in buf:
+                    chunk = conn.recv(65536)
+                    if not chunk:
+                        return
+                    buf += chunk
+                head, _, buf = buf.partition(b"\r\n\r\n")
+                length = int(head.lower().split(b"content-length: ")[1].split(b"\r\n")[0])
+                while len(buf) < length:
+                    buf += conn.recv(65536)
+                buf = buf[length:]
+                self.requests += 1
+                reply = self.respond(self.requests)
+                if reply is None:
+                    return
+                conn.sendall(reply)
+                if self.close_idle:
+                    return
+
+
+OK = b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: 11\r\n\r\n{"ok":true}'
+
+
+@pytest.fixture
+def point_at(monkeypatch):
+    def point(server):
+        monkeypatch.setattr(_slack_http, "_base", urllib.parse.urlparse(server.url))
+        _slack_http._reset()
+
+    yield point
+    _slack_http._reset()
+
+
+def test_dropped_response_is_not_resent(point_at):
+    server = RawServer(lambda n: None)
+    point_at(server)
+    with pytest.raises(Exception):
+        _slack_http.post_json("chat.postMessage", b'{"channel":"C1"}', "xoxb-test")
+    assert server.requests == 1
+
+
+def test_closed_keep_alive_connection_is_replaced(point_at):
+    server = RawServer(lambda n: OK, close_idle=True)
+    point_at(server)
+    for _ in range(3):
+        time.sleep(0.05)
+        resp, _ = _slack_http.post_json("chat.postMessage", b'{"channel":"C1"}', "xoxb-test")
+        assert resp["ok"]
+    assert server.requests == 3